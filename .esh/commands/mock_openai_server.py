@@ -3,8 +3,61 @@ OpenAI-compatible mock server for fount testing.
 
 Supports:
 - POST /v1/chat/completions
+- POST /v1/embeddings: batched `input`, seeded unit vectors of configurable
+  size (`dimensions` / --embedding-dim), encoding_format float or base64
+- POST /v1/messages (Anthropic) and POST /v1beta/models/{model}:generateContent
+  / :streamGenerateContent (Gemini, alt=sse or a streamed JSON array): the
+  same seeded replies, tool calls and timing in each protocol's own event,
+  usage and error shapes, so fount's claude / gemini sources can point
+  their base_url here too
 - stream: true (SSE) and stream: false
+- n > 1: independent seeded choices; streamed chunks of different choices
+  are interleaved by their own timing over one connection
 - logprobs + top_logprobs
+- mock_reply / --reply echo: the last user message comes back verbatim, so
+  clients that ask for structured output (update-locales.py's JSON-batch
+  translation backend) can run end to end against the mock
+- mock_tool_calls: reply with tool calls whose JSON arguments (any size, up
+  to MBs via mock_tool_args_bytes) stream in mock_chunk_tokens fragments
+- --engine threading (default) or asyncio (thousands of concurrent streams per process)
+- seeded stream timing: mock_ttft_ms, mock_delay_ms, mock_jitter_ms,
+  mock_latency_dist (fixed | uniform | lognormal) and mock_chunk_tokens
+  per request, with CLI defaults (--ttft-ms, --delay-ms, ...)
+- virtual clock: --time-scale / mock_time_scale shrinks every delay (0 or
+  --no-sleep: none at all); chunk `created` fields then carry simulated
+  time and x-mock-simulated-ms the simulated stream length
+- --workers N: N forked processes share the port via SO_REUSEPORT; /health
+  and /metrics aggregate every worker, and mock_seed replies stay identical
+  whichever worker serves them
+- chat request bodies are parsed incrementally as they arrive (Content-Length
+  or chunked): prompt tokens are counted per message and only the last user
+  message is kept, so multi-MB histories and inline images stay cheap
+- fault injection: 429 / 503 with Retry-After (mock_error_rate), streams cut
+  after N tokens, mid-stream stalls and write-rate caps, seeded per request
+  (mock_fault_seed) or from --fault-seed
+- drift-free pacing: every stream wait targets an absolute deadline from
+  the stream start, so send time and sleep overshoot do not accumulate;
+  --pacing-trace FILE logs scheduled vs actual send offsets per write
+- flush policy (--flush / mock_flush): write every event, or coalesce every
+  N events / T ms into one sendmsg (writev); --tcp-nodelay on|off
+- --unix PATH: the same protocol on an AF_UNIX socket, next to TCP or alone
+  (--no-tcp), shared by all --workers; `bench --unix PATH` drives it. fount's
+  own AI sources fetch() http:// URLs, so they keep talking TCP loopback
+- --record DIR / --replay DIR: append-only transcript store keyed by a hash
+  of the normalized request; replay serves from an mmap without re-encoding
+- --profiles FILE: per-model settings keyed by name or glob (TTFT,
+  tokens/s, error rate, any mock_* default) plus max_concurrency with a FIFO
+  queue (max_queue bounds it, then 429); GET /v1/models lists them
+- GET /metrics: Prometheus counters for open streams, bytes / tokens sent,
+  client disconnects and request duration histograms
+- `bench` subcommand: concurrent streaming load generator with TTFT /
+  inter-token latency percentiles, for this mock or any OpenAI, Anthropic
+  (--protocol anthropic) or Gemini (--protocol gemini) streaming API
+- `microbench` subcommand for the CPU-bound encoding paths; `self-test`
+  runs the built-in checks (CI: src/scripts/checks/test/manifest.json)
+- usage counts and chunk boundaries come from a byte-level BPE tokenizer
+  with a bundled vocabulary (mock_openai_server.vocab.json, rebuilt by the
+  `build-vocab` subcommand); --tokenizer char restores one token per char
 
 No third-party dependencies required.
 """
@@ -12,19 +65,63 @@ No third-party dependencies required.
 from __future__ import annotations
 
 import argparse
+import asyncio
+import base64
+import codecs
+import hashlib
+import heapq
+import http.client
 import json
+import math
+import mmap
+import os
 import random
 import re
+import signal
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import tempfile
+import threading
 import time
 import uuid
+from array import array
+from bisect import bisect_left
+from collections import Counter, deque
+from collections.abc import AsyncIterator, Callable, Generator, Iterable, Iterator, Mapping
+from fnmatch import fnmatchcase
+from functools import lru_cache
+from itertools import count, islice
+from email.utils import formatdate
+from http import HTTPStatus
 from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json.decoder import scanstring
+from json.encoder import encode_basestring
 from typing import Any
+from urllib.parse import parse_qs, urlsplit
+
+try:
+	import fcntl
+except ImportError:  # Windows: appends are only serialized within one process
+	fcntl = None
 
 
 def now_ts() -> int:
 	return int(time.time())
 
 
+def clamp_float(value: Any, low: float, high: float, default: float = 0.0) -> float:
+	try:
+		v = float(value)
+	except Exception:
+		return default
+	if not math.isfinite(v):
+		return default
+	return max(low, min(high, v))
+
+
 def clamp_int(value: Any, low: int, high: int, default: int) -> int:
 	try:
 		v = int(value)
@@ -33,44 +130,234 @@ def clamp_int(value: Any, low: int, high: int, default: int) -> int:
 	return max(low, min(high, v))
 
 
+# ---------------------------------------------------------------------------
+# tokenizer
+# ---------------------------------------------------------------------------
+
+# Byte-level BPE in the GPT-2 / cl100k style: text is pre-split into words,
+# each word's UTF-8 bytes are merged by rank. Merges come from the bundled
+# VOCAB_PATH (regenerate with the `build-vocab` subcommand).
+VOCAB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_openai_server.vocab.json")
+VOCAB_FORMAT = "fount-mock-bpe/1"
+# Letter runs are capped so unspaced CJK text cannot make one merge loop quadratic.
+PRETOKENIZE_RE = re.compile(r"""'(?:[sdmt]|ll|ve|re)| ?[^\W\d_]{1,32}| ?\d{1,3}| ?(?:[^\w\s]|_)+|\s+(?!\S)|\s+""")
+# A single space between two non-space characters always starts a new word,
+# so long texts are counted in windows cut there instead of one huge findall.
+PRETOKENIZE_SPLIT_RE = re.compile(r"\S (?=\S)")
+COUNT_WINDOW = 1 << 16
+
+
+class BPETokenizer:
+	def __init__(self, merges: list[tuple[int, int]]) -> None:
+		self.ranks = {pair: rank for rank, pair in enumerate(merges)}
+		self.vocab: list[bytes] = [bytes([i]) for i in range(256)]
+		for left, right in merges:
+			self.vocab.append(self.vocab[left] + self.vocab[right])
+		self._words: dict[str, tuple[int, ...]] = {}
+
+	@classmethod
+	def load(cls, path: str = VOCAB_PATH) -> BPETokenizer:
+		with open(path, encoding="utf-8") as f:
+			data = json.load(f)
+		if data.get("format") != VOCAB_FORMAT:
+			raise ValueError(f"{path}: unsupported vocabulary format {data.get('format')!r}")
+		return cls([(left, right) for left, right in data["merges"]])
+
+	def encode_word(self, word: str) -> tuple[int, ...]:
+		cached = self._words.get(word)
+		if cached is not None:
+			return cached
+		ids = list(word.encode("utf-8"))
+		ranks = self.ranks
+		while len(ids) > 1:
+			best_rank = best_at = -1
+			for i in range(len(ids) - 1):
+				rank = ranks.get((ids[i], ids[i + 1]))
+				if rank is not None and (best_rank < 0 or rank < best_rank):
+					best_rank, best_at = rank, i
+			if best_rank < 0:
+				break
+			pair = (ids[best_at], ids[best_at + 1])
+			merged: list[int] = []
+			i = 0
+			while i < len(ids):
+				if i < len(ids) - 1 and (ids[i], ids[i + 1]) == pair:
+					merged.append(256 + best_rank)
+					i += 2
+				else:
+					merged.append(ids[i])
+					i += 1
+			ids = merged
+		result = tuple(ids)
+		if len(self._words) >= 1 << 18:
+			self._words.clear()
+		self._words[word] = result
+		return result
+
+	def encode(self, text: str) -> list[int]:
+		return [tid for word in PRETOKENIZE_RE.findall(text or "") for tid in self.encode_word(word)]
+
+	def count(self, text: str) -> int:
+		total = start = 0
+		size = len(text or "")
+		while start < size:
+			end = size
+			if size - start > COUNT_WINDOW:
+				split = PRETOKENIZE_SPLIT_RE.search(text, start + COUNT_WINDOW)
+				if split is not None:
+					end = split.start() + 1
+			total += sum(len(self.encode_word(word)) for word in PRETOKENIZE_RE.findall(text, start, end))
+			start = end
+		return total
+
+	def pieces(self, text: str) -> list[str]:
+		"""
+		Decoded text of each token. A token that ends inside a multi-byte
+		character (emoji, rare CJK) is joined with the following token(s),
+		so every piece is valid UTF-8 text.
+		"""
+		out: list[str] = []
+		vocab = self.vocab
+		for word in PRETOKENIZE_RE.findall(text or ""):
+			ids = self.encode_word(word)
+			if len(ids) == 1:
+				out.append(word)
+				continue
+			pending = b""
+			for tid in ids:
+				pending += vocab[tid]
+				try:
+					out.append(pending.decode("utf-8"))
+				except UnicodeDecodeError:
+					continue
+				pending = b""
+		return out
+
+
+class CharTokenizer:
+	"""One token per character (the original mock behavior; --tokenizer char)."""
+
+	def count(self, text: str) -> int:
+		return len(text or "")
+
+	def pieces(self, text: str) -> list[str]:
+		return list(text or "")
+
+
+TOKENIZER: BPETokenizer | CharTokenizer | None = None
+
+
+def get_tokenizer() -> BPETokenizer | CharTokenizer:
+	"""Loaded once per process (before fork with --workers, so pages are shared)."""
+	global TOKENIZER
+	if TOKENIZER is None:
+		TOKENIZER = BPETokenizer.load()
+	return TOKENIZER
+
+
 def split_tokens(text: str) -> list[str]:
-	# Character-level split keeps behavior stable for mixed CJK/emoji tests.
-	return list(text or "")
+	return get_tokenizer().pieces(text)
+
+
+def count_tokens(text: str) -> int:
+	return get_tokenizer().count(text)
+
+
+def train_bpe(texts: Iterable[str], merges: int) -> list[tuple[int, int]]:
+	"""Classic BPE training over pre-tokenized word counts (heap + per-pair word index)."""
+	word_counts = Counter(word.encode("utf-8") for text in texts for word in PRETOKENIZE_RE.findall(text))
+	words = [list(word) for word in word_counts]
+	freqs = list(word_counts.values())
+	pair_counts: Counter[tuple[int, int]] = Counter()
+	where: dict[tuple[int, int], set[int]] = {}
+	for i, word in enumerate(words):
+		for pair in zip(word, word[1:]):
+			pair_counts[pair] += freqs[i]
+			where.setdefault(pair, set()).add(i)
+	heap = [(-count, pair) for pair, count in pair_counts.items()]
+	heapq.heapify(heap)
+
+	out: list[tuple[int, int]] = []
+	while heap and len(out) < merges:
+		neg_count, pair = heapq.heappop(heap)
+		if pair_counts.get(pair, 0) != -neg_count:
+			continue  # stale heap entry
+		if -neg_count < 2:
+			break
+		new_id = 256 + len(out)
+		out.append(pair)
+		changed: set[tuple[int, int]] = set()
+		for i in where.pop(pair, ()):
+			word, freq = words[i], freqs[i]
+			for old in zip(word, word[1:]):
+				pair_counts[old] -= freq
+				changed.add(old)
+			merged: list[int] = []
+			j = 0
+			while j < len(word):
+				if j < len(word) - 1 and word[j] == pair[0] and word[j + 1] == pair[1]:
+					merged.append(new_id)
+					j += 2
+				else:
+					merged.append(word[j])
+					j += 1
+			words[i] = merged
+			for new in zip(merged, merged[1:]):
+				pair_counts[new] += freq
+				where.setdefault(new, set()).add(i)
+				changed.add(new)
+		pair_counts.pop(pair, None)
+		for p in changed:
+			count = pair_counts.get(p, 0)
+			if count > 0 and p != pair:
+				heapq.heappush(heap, (-count, p))
+	return out
+
+
+def vocab_corpus(root: str) -> Iterator[str]:
+	"""Every string in fount's locale files, plus its markdown docs and .mjs sources."""
+
+	def strings(value: Any) -> Iterator[str]:
+		if isinstance(value, str):
+			yield value
+		elif isinstance(value, dict):
+			for v in value.values():
+				yield from strings(v)
+		elif isinstance(value, list):
+			for v in value:
+				yield from strings(v)
+
+	locale_dir = os.path.join(root, "src", "public", "locales")
+	for dirpath, dirnames, filenames in os.walk(root):
+		dirnames[:] = sorted(d for d in dirnames if not d.startswith(".") and d != "node_modules")
+		for name in sorted(filenames):
+			path = os.path.join(dirpath, name)
+			if dirpath == locale_dir and name.endswith(".json"):
+				with open(path, encoding="utf-8") as f:
+					yield from strings(json.load(f))
+			elif name.endswith((".md", ".mjs")):
+				with open(path, encoding="utf-8", errors="replace") as f:
+					yield f.read()
 
 
 def bytes_of_token(token: str) -> list[int]:
 	return list(token.encode("utf-8"))
 
 
+# Fixed alternative-token pool for top_logprobs; TOP_CANDIDATE_ALTERNATIVES
+# holds the pool minus each member, precomputed once instead of de-duplicating
+# on every token.
+TOP_CANDIDATE_POOL = (" ", "。", "！", "？", ",", ".", "好", "的", "嗯")
+TOP_CANDIDATE_ALTERNATIVES = {tok: tuple(t for t in TOP_CANDIDATE_POOL if t != tok) for tok in TOP_CANDIDATE_POOL}
+
+
 def build_top_candidates(selected: str, n: int, rng: random.Random, selected_lp: float) -> list[dict[str, Any]]:
 	if n <= 0:
 		return []
-	pool = [
-		selected,
-		" ",
-		"。",
-		"！",
-		"？",
-		",",
-		".",
-		"好",
-		"的",
-		"嗯",
-	]
-	uniq: list[str] = []
-	for t in pool:
-		if t not in uniq:
-			uniq.append(t)
-	rows: list[dict[str, Any]] = []
-	for i, tok in enumerate(uniq[:n]):
-		if tok == selected:
-			lp = selected_lp
-		else:
-			# Keep alternatives lower-probability than selected token.
-			lp = selected_lp - rng.uniform(0.2, 3.2) - (i * 0.03)
-		rows.append({"token": tok, "logprob": lp})
-	if selected not in [x["token"] for x in rows]:
-		rows[-1] = {"token": selected, "logprob": selected_lp}
+	rows: list[dict[str, Any]] = [{"token": selected, "logprob": selected_lp}]
+	for i, tok in enumerate(TOP_CANDIDATE_ALTERNATIVES.get(selected, TOP_CANDIDATE_POOL)[: n - 1], start=1):
+		# Keep alternatives lower-probability than selected token.
+		rows.append({"token": tok, "logprob": selected_lp - rng.uniform(0.2, 3.2) - (i * 0.03)})
 	rows.sort(key=lambda x: x["logprob"], reverse=True)
 	return rows
 
@@ -86,6 +373,29 @@ def make_logprob_item(token: str, top_n: int, rng: random.Random) -> dict[str, A
 	}
 
 
+def iter_logprob_items(tokens: list[str], top_n: int, rng: random.Random) -> Iterator[dict[str, Any]]:
+	"""Logprob items produced on demand, in step with the stream that consumes them."""
+	for token in tokens:
+		yield make_logprob_item(token, top_n, rng)
+
+
+def normalize_seed(seed: Any) -> int | float | str | None:
+	"""
+	Map a JSON mock_seed onto a value random.Random seeds identically in every
+	process (ints, floats and str hash deterministically; containers do not).
+	"""
+	if seed is None or isinstance(seed, (int, float, str)):
+		return seed
+	return json.dumps(seed, sort_keys=True, ensure_ascii=False)
+
+
+def make_completion_id(seed: int | float | str | None) -> str:
+	"""Seeded requests get a seed-derived id so replies match byte-for-byte across workers."""
+	if seed is None:
+		return f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
+	return f"chatcmpl-mock-{random.Random(f'{seed}:id').getrandbits(48):012x}"
+
+
 def extract_text_from_message_content(content: Any) -> str:
 	if isinstance(content, str):
 		return content
@@ -100,6 +410,53 @@ def extract_text_from_message_content(content: Any) -> str:
 	return ""
 
 
+TRANSPORT_CONTENT_TAG_RE = re.compile(r"<(/?)content>", re.IGNORECASE)
+# One alternation instead of a sub() per tag kind: a sender/content seam
+# becomes a newline, every other tag (message, sender, content, p, ...) and
+# the whitespace between </content> and </message> is dropped. Well-formed
+# markup strips exactly as the old tag-by-tag passes did; malformed input can
+# differ (a stray "<" before a tag is kept: "<<b>" gives "<", the old passes
+# gave ""; nor are tags re-formed by deleting an inner one, as in "<me<p>ssage>").
+TRANSPORT_TAG_RE = re.compile(
+	r"(</sender>\s*<content>)|</content>(?:\s|</sender>\s*<content>)*</message[^>]*>|</?(?:message|sender|content|p)[^>]*>|<[^<>]+>",
+	re.IGNORECASE,
+)
+
+
+def transport_tag_replacement(match: re.Match[str]) -> str:
+	return "" if match.lastindex is None else "\n"
+
+
+def last_content_block(text: str) -> str | None:
+	"""
+	Inner text of the last <content>...</content> pair, as the last match of
+	a left-to-right lazy findall would give it, without scanning the whole text.
+
+	Right after any </content> such a scan is outside a block, so the tags
+	that follow the first </content> inside a tail window decide the result;
+	the window grows until it holds one (or covers the text).
+	"""
+	window = 1 << 16
+	while True:
+		start = max(0, len(text) - window)
+		synced = start == 0
+		opened = -1
+		block = None
+		for tag in TRANSPORT_CONTENT_TAG_RE.finditer(text, start):
+			if tag.group(1):
+				if opened >= 0:
+					block = (opened, tag.start())
+					opened = -1
+				synced = True
+			elif synced and opened < 0:
+				opened = tag.end()
+		if block is not None:
+			return text[block[0] : block[1]]
+		if start == 0:
+			return None
+		window *= 4
+
+
 def strip_transport_markup(text: str) -> str:
 	"""
 	Remove fount transport wrappers / HTML-ish tags from echoed text.
@@ -107,218 +464,3754 @@ def strip_transport_markup(text: str) -> str:
 	"""
 	if not text:
 		return text
-	content_blocks = re.findall(r"<content>([\s\S]*?)</content>", text, flags=re.IGNORECASE)
-	if content_blocks:
-		text = content_blocks[-1]
-	text = re.sub(r"</sender>\s*<content>", "\n", text, flags=re.IGNORECASE)
-	text = re.sub(r"</content>\s*</message[^>]*>", "", text, flags=re.IGNORECASE)
-	text = re.sub(r"</?message[^>]*>", "", text, flags=re.IGNORECASE)
-	text = re.sub(r"</?sender[^>]*>", "", text, flags=re.IGNORECASE)
-	text = re.sub(r"</?content[^>]*>", "", text, flags=re.IGNORECASE)
-	text = re.sub(r"</?p[^>]*>", "", text, flags=re.IGNORECASE)
-	text = re.sub(r"<[^>]+>", "", text)
-	return text.strip()
-
-
-def build_completion_text(messages: list[dict[str, Any]]) -> str:
-	user_text = ""
+	block = last_content_block(text)
+	if block is not None:
+		text = block
+	return TRANSPORT_TAG_RE.sub(transport_tag_replacement, text).strip()
+
+
+def last_user_text(messages: list[dict[str, Any]]) -> str:
 	for msg in reversed(messages or []):
 		if isinstance(msg, dict) and msg.get("role") == "user":
-			user_text = extract_text_from_message_content(msg.get("content"))
-			break
+			return extract_text_from_message_content(msg.get("content"))
+	return ""
+
+
+def build_completion_text(user_text: str, index: int = 0, echo: bool = False) -> str:
+	"""
+	Reply text for choice `index`; choices after the first are numbered so n > 1
+	candidates differ. `echo` (mock_reply "echo") returns the last user message
+	verbatim, markup included, so clients that expect a structured reply (e.g. a
+	JSON array) get their own input back.
+	"""
+	if echo:
+		return user_text
 	user_text = strip_transport_markup(user_text).strip()
 	if not user_text:
 		user_text = "Hello from mock server."
-	return f"Mock reply: {user_text}"
+	return f"Mock reply {index + 1}: {user_text}" if index else f"Mock reply: {user_text}"
 
 
-def count_prompt_chars(messages: list[dict[str, Any]]) -> int:
+def count_prompt_tokens(messages: list[dict[str, Any]]) -> int:
 	total = 0
 	for msg in messages or []:
 		if not isinstance(msg, dict):
 			continue
-		total += len(extract_text_from_message_content(msg.get("content")))
+		total += count_tokens(extract_text_from_message_content(msg.get("content")))
 	return total
 
 
-class OpenAIMockHandler(BaseHTTPRequestHandler):
-	server_version = "OpenAIMock/1.0"
-	protocol_version = "HTTP/1.1"
+class PromptSummary:
+	"""All a reply needs from `messages`: prompt token count and the last user message."""
 
-	def _set_cors_headers(self) -> None:
-		self.send_header("Access-Control-Allow-Origin", "*")
-		self.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
-		self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS")
-
-	def _send_json(self, status: int, payload: dict[str, Any]) -> None:
-		data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
-		self.send_response(status)
-		self._set_cors_headers()
-		self.send_header("Content-Type", "application/json; charset=utf-8")
-		self.send_header("Content-Length", str(len(data)))
-		self.end_headers()
-		self.wfile.write(data)
-
-	def _send_sse_headers(self) -> None:
-		self.send_response(200)
-		self._set_cors_headers()
-		self.send_header("Content-Type", "text/event-stream; charset=utf-8")
-		self.send_header("Cache-Control", "no-cache")
-		self.send_header("Connection", "close")
-		self.end_headers()
-
-	def _sse(self, obj: dict[str, Any]) -> None:
-		line = f"data: {json.dumps(obj, ensure_ascii=False)}\n\n".encode("utf-8")
-		self.wfile.write(line)
-		self.wfile.flush()
+	__slots__ = ("tokens", "last_user_text")
 
-	def do_OPTIONS(self) -> None:  # noqa: N802
-		self.send_response(204)
-		self._set_cors_headers()
-		self.send_header("Content-Length", "0")
-		self.end_headers()
+	def __init__(self, tokens: int = 0, last_user_text: str = "") -> None:
+		self.tokens = tokens
+		self.last_user_text = last_user_text
 
-	def do_GET(self) -> None:  # noqa: N802
-		if self.path in ("/health", "/healthz"):
-			self._send_json(200, {"ok": True, "time": now_ts()})
-			return
-		self._send_json(404, {"error": {"message": "Not Found"}})
+	@classmethod
+	def of(cls, messages: Any) -> PromptSummary:
+		if not isinstance(messages, list):
+			messages = []
+		return cls(count_prompt_tokens(messages), last_user_text(messages))
 
-	def do_POST(self) -> None:  # noqa: N802
-		if self.path.rstrip("/") != "/v1/chat/completions":
-			self._send_json(404, {"error": {"message": "Unknown endpoint"}})
-			return
 
+class MockResponse:
+	"""
+	Engine-agnostic response description.
+
+	Either `body` is a complete payload, or `events` is an iterator of
+	(data, delay_after_s, tokens) triples that the serving engine writes and
+	paces. `tokens` counts completion tokens carried by a body / event (for
+	a streamed response: by the whole stream). Bodies and event data may be
+	any bytes-like object (replayed transcripts hand out memoryviews).
+	"""
+
+	__slots__ = ("status", "headers", "body", "events", "tokens", "route", "blocking", "time_scale", "flush", "gate", "truncated")
+
+	def __init__(
+		self,
+		status: int,
+		headers: list[tuple[str, str]],
+		body: bytes = b"",
+		events: Iterator[tuple[bytes, float, int]] | None = None,
+		tokens: int = 0,
+	) -> None:
+		self.status = status
+		self.headers = headers
+		self.body = body
+		self.events = events
+		self.tokens = tokens
+		self.route = "unknown"
+		# Set when iterating `events` blocks on I/O (proxied upstream streams).
+		self.blocking = False
+		# Engines sleep delay_after_s * time_scale; 0 writes events back to back.
+		self.time_scale = MOCK_DEFAULTS["mock_time_scale"]
+		# FlushPolicy spec: how events are batched into socket writes.
+		self.flush = MOCK_DEFAULTS["mock_flush"]
+		# Profile slot (--profiles max_concurrency) held while the response is written.
+		self.gate: ConcurrencyGate | None = None
+		# Set when a FaultPlan ends `events` early (mock_cut_after_tokens).
+		self.truncated = False
+
+
+CORS_HEADERS = [
+	("Access-Control-Allow-Origin", "*"),
+	("Access-Control-Allow-Headers", "Content-Type, Authorization, x-api-key, anthropic-version, anthropic-beta, x-goog-api-key, x-goog-api-client"),
+	("Access-Control-Allow-Methods", "GET, POST, OPTIONS"),
+]
+
+SSE_HEADERS = [
+	("Content-Type", "text/event-stream; charset=utf-8"),
+	("Cache-Control", "no-cache"),
+	("Connection", "close"),
+]
+
+
+# Server-wide defaults for the per-request `mock_*` fields (overridable from the CLI).
+MOCK_DEFAULTS: dict[str, Any] = {
+	"mock_delay_ms": 1000,
+	"mock_ttft_ms": 0,
+	"mock_jitter_ms": 0,
+	"mock_latency_dist": "fixed",
+	"mock_chunk_tokens": 1,
+	"mock_error_rate": 0.0,
+	"mock_error_status": 429,
+	"mock_retry_after_s": 1,
+	"mock_cut_after_tokens": 0,
+	"mock_stall_rate": 0.0,
+	"mock_stall_ms": 0,
+	"mock_write_bps": 0,
+	"mock_embedding_dim": 1536,
+	"mock_tool_args_bytes": 256,
+	"mock_time_scale": 1.0,
+	"mock_flush": "event",
+	"mock_reply": "mock",
+}
+FAULT_KEYS = ("mock_error_rate", "mock_cut_after_tokens", "mock_stall_rate", "mock_write_bps")
+
+
+def mock_option(req: dict[str, Any], key: str) -> Any:
+	value = req.get(key)
+	return MOCK_DEFAULTS[key] if value is None else value
+
+
+def json_response(status: int, payload: dict[str, Any]) -> MockResponse:
+	data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+	return MockResponse(
+		status,
+		[("Content-Type", "application/json; charset=utf-8"), ("Content-Length", str(len(data)))],
+		body=data,
+	)
+
+
+ANTHROPIC_ERROR_TYPES = {
+	400: "invalid_request_error",
+	401: "authentication_error",
+	403: "permission_error",
+	404: "not_found_error",
+	413: "request_too_large",
+	429: "rate_limit_error",
+	503: "overloaded_error",
+	529: "overloaded_error",
+}
+GEMINI_ERROR_STATUS = {
+	400: "INVALID_ARGUMENT",
+	401: "UNAUTHENTICATED",
+	403: "PERMISSION_DENIED",
+	404: "NOT_FOUND",
+	429: "RESOURCE_EXHAUSTED",
+	500: "INTERNAL",
+	503: "UNAVAILABLE",
+	504: "DEADLINE_EXCEEDED",
+}
+
+
+def error_response(route: str, status: int, error: dict[str, Any]) -> MockResponse:
+	"""`error` is an OpenAI-style {"message", ...} object; Anthropic and Gemini routes get their own envelope."""
+	if route == "messages":
+		kind = ANTHROPIC_ERROR_TYPES.get(status, "api_error")
+		return json_response(status, {"type": "error", "error": {"type": kind, "message": error["message"]}})
+	if route == "generate_content":
+		code = GEMINI_ERROR_STATUS.get(status, "UNKNOWN")
+		return json_response(status, {"error": {"code": status, "message": error["message"], "status": code}})
+	return json_response(status, {"error": error})
+
+
+def sse_bytes(obj: dict[str, Any]) -> bytes:
+	return f"data: {json.dumps(obj, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def encode_logprob_item(item: dict[str, Any], escape: Callable[[str], str]) -> str:
+	"""Hand-rolled json.dumps for make_logprob_item() output (same bytes, no generic encoder)."""
+	top = ", ".join(f'{{"token": {escape(t["token"])}, "logprob": {float.__repr__(t["logprob"])}}}' for t in item["top_logprobs"])
+	return (
+		f'{{"token": {escape(item["token"])}, "logprob": {float.__repr__(item["logprob"])}, '
+		f'"bytes": [{", ".join(map(str, item["bytes"]))}], "top_logprobs": [{top}]}}'
+	)
+
+
+class ChunkEncoder:
+	"""
+	Pre-encoded `chat.completion.chunk` envelope for one completion.
+
+	The id/object/created/model prefix is serialized once; each content chunk
+	only splices in the escaped token (and its logprobs fragment). Output is
+	byte-identical to sse_bytes() on the equivalent dict.
+	"""
+
+	def __init__(self, completion_id: str, created: int, model: str, index: int = 0) -> None:
+		head = json.dumps(
+			{"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model},
+			ensure_ascii=False,
+		)
+		self._prefix = f'data: {head[:-1]}, "choices": [{{"index": {index}, "delta": {{"content": '
+		self._tool_prefix = f'data: {head[:-1]}, "choices": [{{"index": {index}, "delta": {{"tool_calls": [{{"index": '
+		self._escaped: dict[str, str] = {}
+
+	def escape(self, token: str) -> str:
+		escaped = self._escaped.get(token)
+		if escaped is None:
+			escaped = self._escaped[token] = encode_basestring(token)
+		return escaped
+
+	def content(self, text: str, logprob_items: list[dict[str, Any]] | None = None) -> bytes:
+		if logprob_items is None:
+			return f'{self._prefix}{self.escape(text)}}}, "finish_reason": null}}]}}\n\n'.encode("utf-8")
+		lp = ", ".join(encode_logprob_item(item, self.escape) for item in logprob_items)
+		return f'{self._prefix}{encode_basestring(text)}}}, "finish_reason": null, "logprobs": {{"content": [{lp}]}}}}]}}\n\n'.encode("utf-8")
+
+	def arguments(self, call_index: int, fragment: str) -> bytes:
+		"""One `tool_calls[call_index].function.arguments` fragment."""
+		return (
+			f'{self._tool_prefix}{call_index}, "function": {{"arguments": {encode_basestring(fragment)}}}}}]}}, '
+			f'"finish_reason": null}}]}}\n\n'
+		).encode("utf-8")
+
+
+LATENCY_DISTRIBUTIONS = ("fixed", "uniform", "lognormal")
+
+
+class LatencyModel:
+	"""
+	Seeded stream timing: one time-to-first-token wait, then per-token delays
+	drawn from `dist` around `delay_ms` with spread `jitter_ms`.
+
+	- fixed:     every token takes exactly delay_ms (jitter ignored)
+	- uniform:   delay_ms ± jitter_ms
+	- lognormal: mean delay_ms, standard deviation jitter_ms (long right tail)
+	"""
+
+	def __init__(self, ttft_ms: float, delay_ms: float, jitter_ms: float, dist: str, rng: random.Random) -> None:
+		self.ttft_ms = ttft_ms
+		self.delay_ms = delay_ms
+		self.jitter_ms = jitter_ms
+		self.dist = dist if dist in LATENCY_DISTRIBUTIONS else "fixed"
+		self.rng = rng
+		self._drawn: deque[float] = deque()
+		if self.dist == "lognormal" and delay_ms > 0 and jitter_ms > 0:
+			sigma2 = math.log1p((jitter_ms / delay_ms) ** 2)
+			self._mu, self._sigma = math.log(delay_ms) - sigma2 / 2, math.sqrt(sigma2)
+		else:
+			self._mu = self._sigma = 0.0
+
+	def ttft_s(self) -> float:
+		return self.ttft_ms / 1000.0
+
+	@property
+	def constant(self) -> bool:
+		return self.delay_ms <= 0 or self.jitter_ms <= 0 or self.dist == "fixed"
+
+	def token_ms(self) -> float:
+		if self._drawn:
+			return self._drawn.popleft()
+		return self._draw()
+
+	def _draw(self) -> float:
+		if self.constant:
+			return self.delay_ms
+		if self.dist == "uniform":
+			return max(0.0, self.rng.uniform(self.delay_ms - self.jitter_ms, self.delay_ms + self.jitter_ms))
+		return self.rng.lognormvariate(self._mu, self._sigma)
+
+	def prefetch(self, tokens: int) -> float:
+		"""
+		Draw the next `tokens` per-token delays up front (token_ms() then hands
+		them out in order) and return their sum in seconds.
+		"""
+		if self.constant:
+			return tokens * self.delay_ms / 1000.0
+		drawn = [self._draw() for _ in range(tokens)]
+		self._drawn.extend(drawn)
+		return sum(drawn) / 1000.0
+
+	def gap_s(self, tokens: int) -> float:
+		"""Delay before the next event carrying `tokens` tokens."""
+		return sum(self.token_ms() for _ in range(tokens)) / 1000.0
+
+
+MAX_CHOICES = 128
+MAX_TOOL_CALLS = 128
+MAX_TOOL_ARGS_BYTES = 64 << 20
+# Filler for generated tool arguments: multi-byte characters and JSON escapes,
+# so fragment boundaries land inside both.
+TOOL_ARGS_FILLER = 'lorem ipsum 你好世界 "quoted" back\\slash\ttab\nnewline 🦊👨\u200d👩\u200d👧 '
+
+
+class ToolCall:
+	__slots__ = ("id", "name", "arguments", "tokens")
+
+	def __init__(self, call_id: str, name: str, arguments: str) -> None:
+		self.id = call_id
+		self.name = name
+		self.arguments = arguments
+		# Argument fragments, split only for streamed replies.
+		self.tokens: list[str] = []
+
+	def message(self) -> dict[str, Any]:
+		return {"id": self.id, "type": "function", "function": {"name": self.name, "arguments": self.arguments}}
+
+	def input(self) -> dict[str, Any]:
+		"""The arguments as an object, for protocols that send them parsed (Anthropic, Gemini)."""
 		try:
-			length = int(self.headers.get("Content-Length", "0"))
-			raw = self.rfile.read(length) if length > 0 else b"{}"
-			req = json.loads(raw.decode("utf-8"))
-		except Exception as e:
-			self._send_json(400, {"error": {"message": f"Invalid JSON: {e}"}})
-			return
+			value = json.loads(self.arguments)
+		except ValueError:
+			value = None
+		return value if isinstance(value, dict) else {"arguments": self.arguments}
 
-		model = str(req.get("model", "mock-model"))
-		messages = req.get("messages", [])
-		stream = bool(req.get("stream", False))
-		with_logprobs = bool(req.get("logprobs", False))
-		top_n = clamp_int(req.get("top_logprobs", 0), 0, 20, 0)
-		delay_ms = clamp_int(req.get("mock_delay_ms", 1000), 0, 5000, 1000)
-		seed = req.get("mock_seed")
-		rng = random.Random(seed if seed is not None else time.time_ns())
-
-		text = build_completion_text(messages)
-		tokens = split_tokens(text)
-		completion_logprobs = [make_logprob_item(t, top_n, rng) for t in tokens] if with_logprobs else []
-
-		completion_id = f"chatcmpl-mock-{uuid.uuid4().hex[:12]}"
-		created = now_ts()
-		usage = {
-			"prompt_tokens": count_prompt_chars(messages),
-			"completion_tokens": len(tokens),
-			"total_tokens": count_prompt_chars(messages) + len(tokens),
-		}
 
-		if not stream:
-			payload: dict[str, Any] = {
-				"id": completion_id,
-				"object": "chat.completion",
-				"created": created,
-				"model": model,
-				"choices": [
-					{
-						"index": 0,
-						"message": {"role": "assistant", "content": text},
-						"finish_reason": "stop",
-					}
-				],
-				"usage": usage,
-			}
-			if with_logprobs:
-				payload["choices"][0]["logprobs"] = {"content": completion_logprobs}
-			self._send_json(200, payload)
+def generate_tool_arguments(call_index: int, choice_index: int, query: str, size: int) -> str:
+	"""A JSON object of exactly `size` UTF-8 bytes (or its minimal form if `size` is smaller)."""
+	base = {"call": call_index, "choice": choice_index, "query": query, "data": ""}
+	need = size - len(json.dumps(base, ensure_ascii=False).encode("utf-8"))
+	if need > 0:
+		unit_bytes = len(encode_basestring(TOOL_ARGS_FILLER).encode("utf-8")) - 2
+		reps, rest = divmod(need, unit_bytes)
+		base["data"] = TOOL_ARGS_FILLER * reps + "x" * rest
+	return json.dumps(base, ensure_ascii=False)
+
+
+def mock_tool_calls(
+	req: dict[str, Any],
+	query: str,
+	choice_index: int,
+	seed: int | float | str | None,
+	id_prefix: str = "call_",
+) -> list[ToolCall]:
+	"""
+	Tool calls asked for by `mock_tool_calls`: a count, or a list of
+	{"name", "arguments", "arguments_bytes"} specs. Names default to the
+	request's `tools` in turn; missing arguments are generated JSON of
+	arguments_bytes (mock_tool_args_bytes) UTF-8 bytes.
+	"""
+	spec = req.get("mock_tool_calls")
+	if isinstance(spec, list):
+		specs = [item if isinstance(item, dict) else {} for item in spec[:MAX_TOOL_CALLS]]
+	elif spec is True:
+		specs = [{}]
+	else:
+		specs = [{}] * clamp_int(spec, 0, MAX_TOOL_CALLS, 0)
+	if not specs:
+		return []
+	names = [
+		tool["function"]["name"]
+		for tool in req.get("tools") or []
+		if isinstance(tool, dict) and isinstance(tool.get("function"), dict) and isinstance(tool["function"].get("name"), str)
+	] or ["mock_tool"]
+	default_size = clamp_int(mock_option(req, "mock_tool_args_bytes"), 0, MAX_TOOL_ARGS_BYTES, 256)
+	calls = []
+	for call_index, item in enumerate(specs):
+		arguments = item.get("arguments")
+		if not isinstance(arguments, str):
+			if arguments is not None:
+				arguments = json.dumps(arguments, ensure_ascii=False)
+			else:
+				size = clamp_int(item.get("arguments_bytes", default_size), 0, MAX_TOOL_ARGS_BYTES, default_size)
+				arguments = generate_tool_arguments(call_index, choice_index, query, size)
+		if seed is None:
+			call_id = f"{id_prefix}{uuid.uuid4().hex[:24]}"
+		else:
+			call_id = f"{id_prefix}{random.Random(f'{seed}:{choice_index}:call:{call_index}').getrandbits(96):024x}"
+		calls.append(ToolCall(call_id, str(item.get("name") or names[call_index % len(names)]), arguments))
+	return calls
+
+
+class ChoiceStream:
+	"""
+	What one streamed choice needs: its content tokens (or tool calls), logprobs
+	and its own latency model.
+	"""
+
+	__slots__ = ("tokens", "logprob_items", "latency", "tool_calls")
+
+	def __init__(
+		self,
+		tokens: list[str],
+		logprob_items: Iterator[dict[str, Any]] | None,
+		latency: LatencyModel,
+		tool_calls: list[ToolCall] | None = None,
+	) -> None:
+		self.tokens = tokens
+		self.logprob_items = logprob_items
+		self.latency = latency
+		self.tool_calls = tool_calls or []
+
+	def prefetch_s(self, chunk_tokens: int) -> float:
+		"""Simulated length of this choice's stream, with every delay drawn up front."""
+		if self.tool_calls:
+			paced = len(self.tool_calls) - 1 + sum(len(call.tokens) for call in self.tool_calls)
+		else:
+			paced = max(0, len(self.tokens) - chunk_tokens)
+		return self.latency.ttft_s() + self.latency.prefetch(paced)
+
+	def schedule(self, chunk_tokens: int) -> Iterator[tuple[float, int, str | None, int]]:
+		"""
+		Pacing shared by every wire format: (offset_s, call_index, text, tokens)
+		per event, starting at time-to-first-token. Content events have
+		call_index -1; a tool call opens with a (call_index, None) event
+		followed by its argument fragments.
+		"""
+		latency = self.latency
+		at = latency.ttft_s()
+		if not self.tool_calls:
+			tokens = self.tokens
+			for start in range(0, len(tokens), chunk_tokens):
+				end = start + chunk_tokens
+				text = "".join(tokens[start:end]) if chunk_tokens > 1 else tokens[start]
+				yield at, -1, text, min(end, len(tokens)) - start
+				if end < len(tokens):
+					at += latency.gap_s(min(chunk_tokens, len(tokens) - end))
 			return
+		for call_index, call in enumerate(self.tool_calls):
+			if call_index:
+				at += latency.gap_s(1)
+			yield at, call_index, None, 0
+			tokens = call.tokens
+			for start in range(0, len(tokens), chunk_tokens):
+				end = start + chunk_tokens
+				at += latency.gap_s(min(end, len(tokens)) - start)
+				text = "".join(tokens[start:end]) if chunk_tokens > 1 else tokens[start]
+				yield at, call_index, text, min(end, len(tokens)) - start
 
-		try:
-			self._send_sse_headers()
 
-			# First role chunk (common OpenAI-compatible behavior)
-			self._sse(
-				{
-					"id": completion_id,
-					"object": "chat.completion.chunk",
-					"created": created,
-					"model": model,
-					"choices": [
-						{
-							"index": 0,
-							"delta": {"role": "assistant"},
-							"finish_reason": None,
-						}
-					],
-				}
-			)
+def request_time_scale(req: dict[str, Any]) -> float:
+	return clamp_float(mock_option(req, "mock_time_scale"), 0.0, 1000.0, 1.0)
 
-			for i, token in enumerate(tokens):
-				chunk: dict[str, Any] = {
-					"id": completion_id,
-					"object": "chat.completion.chunk",
-					"created": created,
-					"model": model,
-					"choices": [
-						{
-							"index": 0,
-							"delta": {"content": token},
-							"finish_reason": None,
-						}
-					],
-				}
-				if with_logprobs:
-					chunk["choices"][0]["logprobs"] = {"content": [completion_logprobs[i]]}
-				self._sse(chunk)
-				if delay_ms > 0:
-					time.sleep(delay_ms / 1000.0)
 
-			# Final chunk
-			self._sse(
-				{
-					"id": completion_id,
-					"object": "chat.completion.chunk",
-					"created": created,
-					"model": model,
-					"choices": [
-						{
-							"index": 0,
-							"delta": {},
-							"finish_reason": "stop",
-						}
-					],
-					"usage": usage,
-				}
+class ReplyPlan:
+	"""
+	One reply before it meets a wire format: per-choice text or tool calls,
+	their seeded RNGs and latency models, pacing knobs and token usage. Choice
+	0 keeps the request's seeds; choice i draws from "<mock_seed>:<i>". The
+	OpenAI, Anthropic and Gemini endpoints each render a plan their own way.
+	"""
+
+	def __init__(self, req: dict[str, Any], prompt: PromptSummary, stream: bool, n: int = 1, tool_id_prefix: str = "call_") -> None:
+		self.stream = stream
+		self.seed = seed = normalize_seed(req.get("mock_seed"))
+		self.chunk_tokens = clamp_int(mock_option(req, "mock_chunk_tokens"), 1, 4096, 1)
+		ttft_ms = clamp_int(mock_option(req, "mock_ttft_ms"), 0, 60000, 0)
+		# Fractional: profiles derive it from tokens_per_s (150 tok/s = 6.67 ms).
+		delay_ms = clamp_float(mock_option(req, "mock_delay_ms"), 0.0, 5000.0, 1000.0)
+		jitter_ms = clamp_int(mock_option(req, "mock_jitter_ms"), 0, 5000, 0)
+		dist = str(mock_option(req, "mock_latency_dist"))
+
+		echo = str(mock_option(req, "mock_reply")) == "echo"
+		self.texts = [build_completion_text(prompt.last_user_text, index, echo) for index in range(n)]
+		self.tokens = [split_tokens(text) for text in self.texts]
+		self.tool_calls: list[list[ToolCall]] = [[] for _ in range(n)]
+		if req.get("mock_tool_calls"):
+			query = strip_transport_markup(prompt.last_user_text).strip()
+			self.tool_calls = [mock_tool_calls(req, query, index, seed, tool_id_prefix) for index in range(n)]
+			for index, calls in enumerate(self.tool_calls):
+				if calls:
+					self.texts[index] = ""
+					self.tokens[index] = []
+					if stream:
+						for call in calls:
+							call.tokens = split_tokens(call.arguments)
+							self.tokens[index] += call.tokens
+		self.rngs: list[random.Random] = []
+		self.latencies: list[LatencyModel] = []
+		for index in range(n):
+			choice_seed = seed if index == 0 or seed is None else f"{seed}:{index}"
+			self.rngs.append(random.Random(choice_seed if choice_seed is not None else time.time_ns()))
+			self.latencies.append(
+				LatencyModel(
+					ttft_ms,
+					delay_ms,
+					jitter_ms,
+					dist,
+					random.Random(f"{choice_seed}:latency" if choice_seed is not None else time.time_ns()),
+				)
 			)
-			self.wfile.write(b"data: [DONE]\n\n")
-			self.wfile.flush()
-		except (BrokenPipeError, ConnectionResetError):
-			# Client disconnected; ignore.
+
+		self.clock = time.time()
+		self.virtual = request_time_scale(req) != 1.0
+		self.prompt_tokens = prompt.tokens
+		self.completion_tokens = sum(count_tokens(text) for text in self.texts) + sum(
+			count_tokens(call.name) + count_tokens(call.arguments) for calls in self.tool_calls for call in calls
+		)
+
+	@property
+	def stream_tokens(self) -> int:
+		return sum(len(tokens) for tokens in self.tokens)
+
+	def choice_streams(self, logprob_items: list[Iterator[dict[str, Any]] | None] | None = None) -> list[ChoiceStream]:
+		return [
+			ChoiceStream(tokens, logprob_items[index] if logprob_items else None, latency, calls)
+			for index, (tokens, latency, calls) in enumerate(zip(self.tokens, self.latencies, self.tool_calls))
+		]
+
+	def stream_headers(self, streams: list[ChoiceStream], base: list[tuple[str, str]] = SSE_HEADERS) -> list[tuple[str, str]]:
+		"""On the virtual clock this draws every delay now, to report the simulated length up front."""
+		headers = list(base)
+		if self.virtual:
+			simulated_s = max(choice.prefetch_s(self.chunk_tokens) for choice in streams)
+			headers.append(("x-mock-simulated-ms", str(round(simulated_s * 1000))))
+		return headers
+
+
+def iter_paced(timelines: list[Iterator[tuple[float, bytes, int]]]) -> Generator[tuple[bytes, float, int], None, float]:
+	"""
+	Merge (offset_s, data, tokens) timelines by send time into (data,
+	delay_after_s, tokens) events; returns the offset of the last one.
+	heapq.merge is stable, so simultaneous events keep timeline order.
+	"""
+	merged = timelines[0] if len(timelines) == 1 else heapq.merge(*timelines, key=lambda event: event[0])
+	at, data, tokens = next(merged)
+	for next_at, next_data, next_tokens in merged:
+		yield data, next_at - at, tokens
+		at, data, tokens = next_at, next_data, next_tokens
+	yield data, 0.0, tokens
+	return at
+
+
+class StreamEnvelope:
+	"""
+	Chunk head and ChunkEncoder for one choice. On the virtual clock (`clock`
+	is the stream's start time) `created` follows each chunk's simulated send
+	time, so the envelope is re-stamped whenever that second changes.
+	"""
+
+	__slots__ = ("head", "index", "clock", "encoder")
+
+	def __init__(self, head: dict[str, Any], index: int, clock: float | None) -> None:
+		self.head = head
+		self.index = index
+		self.clock = clock
+		self.encoder = ChunkEncoder(head["id"], head["created"], head["model"], index)
+
+	def at(self, offset_s: float) -> None:
+		if self.clock is None:
 			return
+		created = int(self.clock + offset_s)
+		if created != self.head["created"]:
+			self.head = {**self.head, "created": created}
+			self.encoder = ChunkEncoder(self.head["id"], created, self.head["model"], self.index)
 
+	def chunk(self, delta: dict[str, Any], finish_reason: str | None = None, usage: dict[str, int] | None = None) -> bytes:
+		obj: dict[str, Any] = {**self.head, "choices": [{"index": self.index, "delta": delta, "finish_reason": finish_reason}]}
+		if usage is not None:
+			obj["usage"] = usage
+		return sse_bytes(obj)
 
-def main() -> None:
-	parser = argparse.ArgumentParser(description="OpenAI-compatible mock chat server")
-	parser.add_argument("--host", default="127.0.0.1", help="Bind host")
-	parser.add_argument("--port", type=int, default=18000, help="Bind port")
-	args = parser.parse_args()
 
-	server = ThreadingHTTPServer((args.host, args.port), OpenAIMockHandler)
-	print(f"[mock-openai] listening on http://{args.host}:{args.port}")
-	print("[mock-openai] endpoint: POST /v1/chat/completions")
-	print("[mock-openai] health:   GET  /health")
-	try:
-		server.serve_forever()
-	except KeyboardInterrupt:
-		pass
-	finally:
-		server.server_close()
-		print("[mock-openai] stopped")
+def iter_choice_timeline(
+	index: int,
+	head: dict[str, Any],
+	choice: ChoiceStream,
+	chunk_tokens: int,
+	usage: dict[str, int] | None,
+	clock: float | None,
+) -> Iterator[tuple[float, bytes, int]]:
+	"""
+	Chunks of one choice as (offset_s from stream start, data, tokens); `usage`
+	rides on its finish chunk. Tool calls stream like OpenAI's: a header chunk
+	per call (id, name, empty arguments), then its argument fragments.
+	"""
+	envelope = StreamEnvelope(head, index, clock)
+	# First role chunk (common OpenAI-compatible behavior)
+	yield 0.0, envelope.chunk({"role": "assistant"}), 0
+
+	at = choice.latency.ttft_s()
+	for at, call_index, text, count in choice.schedule(chunk_tokens):
+		envelope.at(at)
+		if call_index < 0:
+			chunk_logprobs = list(islice(choice.logprob_items, count)) if choice.logprob_items is not None else None
+			yield at, envelope.encoder.content(text, chunk_logprobs), count
+		elif text is None:
+			call = choice.tool_calls[call_index]
+			header = {"index": call_index, "id": call.id, "type": "function", "function": {"name": call.name, "arguments": ""}}
+			yield at, envelope.chunk({"tool_calls": [header]}), 0
+		else:
+			yield at, envelope.encoder.arguments(call_index, text), count
+
+	yield at, envelope.chunk({}, "tool_calls" if choice.tool_calls else "stop", usage), 0
+
+
+def iter_chat_stream(
+	completion_id: str,
+	created: int,
+	model: str,
+	choices: list[ChoiceStream],
+	usage: dict[str, int],
+	chunk_tokens: int,
+	clock: float | None = None,
+) -> Iterator[tuple[bytes, float, int]]:
+	"""
+	Interleave the choices' timelines by send time over one stream. With a
+	single choice usage rides on its finish chunk; with n > 1 every choice
+	finishes on its own and usage follows in a chunk with empty `choices`.
+	`clock` switches `created` to simulated time (see StreamEnvelope).
+	"""
+	head = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model}
+	single = len(choices) == 1
+	timelines = [
+		iter_choice_timeline(index, head, choice, chunk_tokens, usage if single else None, clock)
+		for index, choice in enumerate(choices)
+	]
+	at = yield from iter_paced(timelines)
+
+	if not single:
+		if clock is not None:
+			head["created"] = int(clock + at)
+		yield sse_bytes({**head, "choices": [], "usage": usage}), 0.0, 0
+	yield b"data: [DONE]\n\n", 0.0, 0
+
+
+def chat_completion_response(req: dict[str, Any], prompt: PromptSummary | None = None) -> MockResponse:
+	"""
+	`prompt` comes from ChatRequestReader when `messages` was streamed instead
+	of kept in `req`. `n` > 1 yields independent choices (see ReplyPlan). With
+	`mock_tool_calls` every choice answers with tool calls instead of content
+	(finish_reason "tool_calls").
+
+	Off real time (mock_time_scale != 1) streams run on a virtual clock: all
+	delays are drawn up front, the simulated length goes out in the
+	x-mock-simulated-ms header and chunk `created` fields carry simulated time.
+	"""
+	model = str(req.get("model", "mock-model"))
+	if prompt is None:
+		prompt = PromptSummary.of(req.get("messages", []))
+	n = clamp_int(req.get("n", 1), 1, MAX_CHOICES, 1)
+	plan = ReplyPlan(req, prompt, bool(req.get("stream", False)), n)
+	with_logprobs = bool(req.get("logprobs", False))
+	top_n = clamp_int(req.get("top_logprobs", 0), 0, 20, 0)
+
+	completion_id = make_completion_id(plan.seed)
+	created = int(plan.clock)
+	usage = {
+		"prompt_tokens": plan.prompt_tokens,
+		"completion_tokens": plan.completion_tokens,
+		"total_tokens": plan.prompt_tokens + plan.completion_tokens,
+	}
+
+	if not plan.stream:
+		choices: list[dict[str, Any]] = []
+		for index, text in enumerate(plan.texts):
+			choice: dict[str, Any] = {
+				"index": index,
+				"message": {"role": "assistant", "content": text},
+				"finish_reason": "stop",
+			}
+			calls = plan.tool_calls[index]
+			if calls:
+				choice["message"] = {"role": "assistant", "content": None, "tool_calls": [call.message() for call in calls]}
+				choice["finish_reason"] = "tool_calls"
+			elif with_logprobs:
+				choice["logprobs"] = {"content": list(iter_logprob_items(plan.tokens[index], top_n, plan.rngs[index]))}
+			choices.append(choice)
+		payload: dict[str, Any] = {
+			"id": completion_id,
+			"object": "chat.completion",
+			"created": created,
+			"model": model,
+			"choices": choices,
+			"usage": usage,
+		}
+		resp = json_response(200, payload)
+		resp.tokens = usage["completion_tokens"]
+		return resp
+
+	streams = plan.choice_streams(
+		[
+			iter_logprob_items(tokens, top_n, rng) if with_logprobs and not calls else None
+			for tokens, rng, calls in zip(plan.tokens, plan.rngs, plan.tool_calls)
+		]
+	)
+	headers = plan.stream_headers(streams)
+	clock = plan.clock if plan.virtual else None
+	events = iter_chat_stream(completion_id, created, model, streams, usage, plan.chunk_tokens, clock)
+	return MockResponse(200, headers, events=events, tokens=plan.stream_tokens)
+
+
+# ---------------------------------------------------------------------------
+# anthropic messages / gemini generateContent
+# ---------------------------------------------------------------------------
+
+GEMINI_PATH_RE = re.compile(r"/v1(?:alpha|beta)?/models/([^/:]+):(generateContent|streamGenerateContent)")
+# Placeholder string spliced out of json.dumps() output by json_template().
+TEMPLATE_SLOT = "\ufdd0"
+
+
+def json_template(obj: dict[str, Any]) -> tuple[str, str]:
+	"""Split json.dumps(obj) around its TEMPLATE_SLOT string so hot paths splice in encode_basestring(text)."""
+	head, _, tail = json.dumps(obj, ensure_ascii=False).partition(encode_basestring(TEMPLATE_SLOT))
+	return head, tail
+
+
+def make_reply_id(prefix: str, seed: int | float | str | None) -> str:
+	if seed is None:
+		return f"{prefix}{uuid.uuid4().hex[:24]}"
+	return f"{prefix}{random.Random(f'{seed}:id').getrandbits(96):024x}"
+
+
+def sse_event(event: str, obj: dict[str, Any]) -> bytes:
+	return f"event: {event}\ndata: {json.dumps(obj, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+def iter_anthropic_timeline(
+	message: dict[str, Any],
+	choice: ChoiceStream,
+	chunk_tokens: int,
+	output_tokens: int,
+) -> Iterator[tuple[float, bytes, int]]:
+	"""Anthropic Messages SSE: text goes in one text block, each tool call in a tool_use block."""
+	yield 0.0, sse_event("message_start", {"type": "message_start", "message": message}), 0
+	block = -1
+	if not choice.tool_calls:
+		block = 0
+		start = {"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}
+		yield 0.0, sse_event("content_block_start", start), 0
+	yield 0.0, sse_event("ping", {"type": "ping"}), 0
+
+	text_head, text_tail = json_template({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": TEMPLATE_SLOT}})
+	text_head = f"event: content_block_delta\ndata: {text_head}"
+	json_head = json_tail = ""
+	at = choice.latency.ttft_s()
+	for at, call_index, text, count in choice.schedule(chunk_tokens):
+		if call_index < 0:
+			yield at, f"{text_head}{encode_basestring(text)}{text_tail}\n\n".encode("utf-8"), count
+		elif text is None:
+			if block >= 0:
+				yield at, sse_event("content_block_stop", {"type": "content_block_stop", "index": block}), 0
+			block = call_index
+			call = choice.tool_calls[call_index]
+			tool_use = {"type": "tool_use", "id": call.id, "name": call.name, "input": {}}
+			yield at, sse_event("content_block_start", {"type": "content_block_start", "index": block, "content_block": tool_use}), 0
+			json_head, json_tail = json_template(
+				{"type": "content_block_delta", "index": block, "delta": {"type": "input_json_delta", "partial_json": TEMPLATE_SLOT}}
+			)
+			json_head = f"event: content_block_delta\ndata: {json_head}"
+		else:
+			yield at, f"{json_head}{encode_basestring(text)}{json_tail}\n\n".encode("utf-8"), count
+	if block >= 0:
+		yield at, sse_event("content_block_stop", {"type": "content_block_stop", "index": block}), 0
+	delta = {"stop_reason": "tool_use" if choice.tool_calls else "end_turn", "stop_sequence": None}
+	yield at, sse_event("message_delta", {"type": "message_delta", "delta": delta, "usage": {"output_tokens": output_tokens}}), 0
+	yield at, sse_event("message_stop", {"type": "message_stop"}), 0
+
+
+def anthropic_messages_response(req: dict[str, Any]) -> MockResponse:
+	"""POST /v1/messages in the Anthropic Messages format; `system` counts toward input tokens."""
+	model = str(req.get("model", "mock-model"))
+	prompt = PromptSummary.of(req.get("messages", []))
+	prompt.tokens += count_tokens(extract_text_from_message_content(req.get("system")))
+	plan = ReplyPlan(req, prompt, bool(req.get("stream", False)), tool_id_prefix="toolu_")
+	calls = plan.tool_calls[0]
+	message: dict[str, Any] = {
+		"id": make_reply_id("msg_", plan.seed),
+		"type": "message",
+		"role": "assistant",
+		"model": model,
+		"content": [],
+		"stop_reason": None,
+		"stop_sequence": None,
+		"usage": {"input_tokens": plan.prompt_tokens, "output_tokens": 0},
+	}
+
+	if not plan.stream:
+		if calls:
+			message["content"] = [{"type": "tool_use", "id": call.id, "name": call.name, "input": call.input()} for call in calls]
+		else:
+			message["content"] = [{"type": "text", "text": plan.texts[0]}]
+		message["stop_reason"] = "tool_use" if calls else "end_turn"
+		message["usage"]["output_tokens"] = plan.completion_tokens
+		resp = json_response(200, message)
+		resp.tokens = plan.completion_tokens
+		return resp
+
+	streams = plan.choice_streams()
+	events = iter_paced([iter_anthropic_timeline(message, streams[0], plan.chunk_tokens, plan.completion_tokens)])
+	return MockResponse(200, plan.stream_headers(streams), events=events, tokens=plan.stream_tokens)
+
+
+def gemini_prompt(req: dict[str, Any]) -> PromptSummary:
+	"""Gemini `contents` (and systemInstruction) read as OpenAI-style messages."""
+
+	def parts_text(content: Any) -> str:
+		parts = content.get("parts") if isinstance(content, dict) else None
+		if not isinstance(parts, list):
+			return ""
+		return "".join(str(part.get("text", "")) for part in parts if isinstance(part, dict))
+
+	contents = req.get("contents")
+	if isinstance(contents, dict):
+		contents = [contents]
+	messages = [
+		{"role": "assistant" if item.get("role") == "model" else "user", "content": parts_text(item)}
+		for item in contents or []
+		if isinstance(item, dict)
+	]
+	prompt = PromptSummary.of(messages)
+	prompt.tokens += count_tokens(parts_text(req.get("systemInstruction") or req.get("system_instruction")))
+	return prompt
+
+
+def iter_gemini_timeline(
+	index: int,
+	choice: ChoiceStream,
+	chunk_tokens: int,
+	tail: dict[str, Any],
+	usage: dict[str, int] | None,
+) -> Iterator[tuple[float, bytes, int]]:
+	"""
+	Bare GenerateContentResponse JSON for one candidate (framing is added by
+	gemini_frames). Function calls arrive whole, once their arguments would
+	have finished streaming.
+	"""
+
+	def candidate_chunk(parts: list[dict[str, Any]], finish: bool = False) -> bytes:
+		candidate: dict[str, Any] = {"content": {"parts": parts, "role": "model"}}
+		if finish:
+			candidate["finishReason"] = "STOP"
+		candidate["index"] = index
+		obj = {"candidates": [candidate], **tail}
+		if finish and usage is not None:
+			obj["usageMetadata"] = usage
+		return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+	template = {"content": {"parts": [{"text": TEMPLATE_SLOT}], "role": "model"}, "index": index}
+	text_head, text_tail = json_template({"candidates": [template], **tail})
+	at = last_at = choice.latency.ttft_s()
+	call_tokens = 0
+	for at, call_index, text, count in choice.schedule(chunk_tokens):
+		if call_index < 0:
+			yield at, f"{text_head}{encode_basestring(text)}{text_tail}".encode("utf-8"), count
+		elif text is None:
+			if call_index:
+				call = choice.tool_calls[call_index - 1]
+				yield last_at, candidate_chunk([{"functionCall": {"name": call.name, "args": call.input()}}]), call_tokens
+				call_tokens = 0
+		else:
+			call_tokens += count
+		last_at = at
+	if choice.tool_calls:
+		call = choice.tool_calls[-1]
+		yield at, candidate_chunk([{"functionCall": {"name": call.name, "args": call.input()}}]), call_tokens
+	yield at, candidate_chunk([{"text": ""}], finish=True), 0
+
+
+def gemini_frames(events: Iterator[tuple[bytes, float, int]], sse: bool) -> Iterator[tuple[bytes, float, int]]:
+	"""Frame bare JSON events as `data:` lines (alt=sse) or as the elements of one streamed JSON array."""
+	if sse:
+		for data, delay_s, tokens in events:
+			yield b"data: " + data + b"\r\n\r\n", delay_s, tokens
+		return
+	separator = b"["
+	for data, delay_s, tokens in events:
+		yield separator + data, delay_s, tokens
+		separator = b",\r\n"
+	yield b"]" if separator != b"[" else b"[]", 0.0, 0
+
+
+def gemini_response(req: dict[str, Any], path: str) -> MockResponse:
+	"""
+	Gemini models/{model}:generateContent and :streamGenerateContent (SSE with
+	?alt=sse, as the SDKs ask for; a streamed JSON array otherwise). The model
+	comes from the URL, generationConfig.candidateCount works like `n`.
+	"""
+	parts = urlsplit(path)
+	match = GEMINI_PATH_RE.fullmatch(parts.path.rstrip("/"))
+	assert match is not None
+	model, method = match.group(1), match.group(2)
+	config = req.get("generationConfig")
+	n = clamp_int(config.get("candidateCount", 1), 1, MAX_CHOICES, 1) if isinstance(config, dict) else 1
+	plan = ReplyPlan(req, gemini_prompt(req), method == "streamGenerateContent", n)
+	usage = {
+		"promptTokenCount": plan.prompt_tokens,
+		"candidatesTokenCount": plan.completion_tokens,
+		"totalTokenCount": plan.prompt_tokens + plan.completion_tokens,
+	}
+	tail = {"modelVersion": model, "responseId": make_reply_id("", plan.seed)}
+
+	if not plan.stream:
+		candidates = []
+		for index, (text, calls) in enumerate(zip(plan.texts, plan.tool_calls)):
+			content = [{"functionCall": {"name": call.name, "args": call.input()}} for call in calls] if calls else [{"text": text}]
+			candidates.append({"content": {"parts": content, "role": "model"}, "finishReason": "STOP", "index": index})
+		resp = json_response(200, {"candidates": candidates, "usageMetadata": usage, **tail})
+		resp.tokens = plan.completion_tokens
+		return resp
+
+	streams = plan.choice_streams()
+	single = n == 1
+
+	def events() -> Iterator[tuple[bytes, float, int]]:
+		timelines = [
+			iter_gemini_timeline(index, choice, plan.chunk_tokens, tail, usage if single else None)
+			for index, choice in enumerate(streams)
+		]
+		yield from iter_paced(timelines)
+		if not single:
+			yield json.dumps({"candidates": [], "usageMetadata": usage, **tail}, ensure_ascii=False).encode("utf-8"), 0.0, 0
+
+	sse = "sse" in parse_qs(parts.query).get("alt", [])
+	base = SSE_HEADERS if sse else [("Content-Type", "application/json; charset=utf-8"), ("Connection", "close")]
+	return MockResponse(200, plan.stream_headers(streams, base), events=gemini_frames(events(), sse), tokens=plan.stream_tokens)
+
+
+# ---------------------------------------------------------------------------
+# embeddings
+# ---------------------------------------------------------------------------
+
+EMBEDDING_FORMATS = ("float", "base64")
+
+
+def embedding_inputs(value: Any) -> tuple[list[str], int] | None:
+	"""
+	Normalize `input` (a string, a token array, or a batch of either) into
+	one key per item plus the prompt token count; None if malformed.
+	"""
+	if isinstance(value, str):
+		return [value], count_tokens(value)
+	if not isinstance(value, list) or not value:
+		return None
+	if all(isinstance(v, int) for v in value):
+		return [json.dumps(value, separators=(",", ":"))], len(value)
+	keys: list[str] = []
+	tokens = 0
+	for item in value:
+		if isinstance(item, str):
+			keys.append(item)
+			tokens += count_tokens(item)
+		elif isinstance(item, list) and item and all(isinstance(v, int) for v in item):
+			keys.append(json.dumps(item, separators=(",", ":")))
+			tokens += len(item)
+		else:
+			return None
+	return keys, tokens
+
+
+def embedding_vectors(keys: list[str], dim: int, salt: str) -> array:
+	"""
+	Unit vectors for a whole batch in one flat float32 array (row i holds
+	keys[i]). Each row depends only on (salt, key, dim): components are
+	int16 lanes of one SHAKE-256 stream, converted and normalized in bulk.
+	"""
+	lanes = array("h", b"".join(hashlib.shake_256(f"{salt}\0{key}".encode("utf-8")).digest(2 * dim) for key in keys))
+	if sys.byteorder == "big":
+		lanes.byteswap()
+	out = array("f")
+	for start in range(0, len(lanes), dim):
+		row = lanes[start : start + dim]
+		scale = 1.0 / (math.hypot(*row) or 1.0)
+		out.extend([x * scale for x in row])
+	return out
+
+
+def embeddings_response(req: dict[str, Any]) -> MockResponse:
+	parsed = embedding_inputs(req.get("input"))
+	if parsed is None:
+		return json_response(
+			400,
+			{"error": {"message": "'input' must be a string, a token array, or a non-empty array of either", "type": "invalid_request_error"}},
+		)
+	encoding = req.get("encoding_format") or "float"
+	if encoding not in EMBEDDING_FORMATS:
+		return json_response(400, {"error": {"message": f"Invalid encoding_format {encoding!r}", "type": "invalid_request_error"}})
+	keys, prompt_tokens = parsed
+	model = str(req.get("model", "mock-embedding"))
+	dim = clamp_int(req.get("dimensions") or mock_option(req, "mock_embedding_dim"), 1, 16384, 1536)
+	vectors = embedding_vectors(keys, dim, f"{normalize_seed(req.get('mock_seed'))}:{model}")
+
+	# Rows are formatted straight into the body: one %-format per row instead
+	# of json.dumps walking a list of Python floats.
+	if encoding == "base64":
+		if sys.byteorder == "big":
+			vectors.byteswap()
+		raw = vectors.tobytes()
+		row_bytes = 4 * dim
+		rows = [f'"{base64.b64encode(raw[i * row_bytes : (i + 1) * row_bytes]).decode("ascii")}"' for i in range(len(keys))]
+	else:
+		# %.9g round-trips float32, so float and base64 replies decode alike.
+		template = "[" + ",".join(["%.9g"] * dim) + "]"
+		rows = [template % tuple(vectors[i * dim : (i + 1) * dim]) for i in range(len(keys))]
+	data = ", ".join(f'{{"object": "embedding", "index": {i}, "embedding": {row}}}' for i, row in enumerate(rows))
+	usage = json.dumps({"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens})
+	body = f'{{"object": "list", "data": [{data}], "model": {json.dumps(model, ensure_ascii=False)}, "usage": {usage}}}'.encode("utf-8")
+	return MockResponse(
+		200,
+		[("Content-Type", "application/json; charset=utf-8"), ("Content-Length", str(len(body)))],
+		body=body,
+	)
+
+
+# ---------------------------------------------------------------------------
+# fault injection
+# ---------------------------------------------------------------------------
+
+FAULT_ERRORS = {
+	429: ("Rate limit reached for requests (injected by mock)", "requests", "rate_limit_exceeded"),
+	503: ("The server is overloaded or not ready yet (injected by mock)", "server_error", None),
+}
+# Requests without mock_fault_seed draw their fault seed from this stream
+# (--fault-seed; re-seeded per worker after fork).
+FAULT_RNG = random.Random()
+FAULT_RNG_LOCK = threading.Lock()
+
+
+def seed_faults(seed: Any, worker: int = 0) -> None:
+	with FAULT_RNG_LOCK:
+		FAULT_RNG.seed(None if seed is None else f"{seed}:{worker}")
+
+
+class FaultPlan:
+	"""
+	Seeded failure injection for one request (mock_* fields, CLI defaults):
+
+	- mock_error_rate:       chance of answering mock_error_status (429 / 503)
+	                         with Retry-After: mock_retry_after_s instead of a reply
+	- mock_cut_after_tokens: end the stream after N tokens, with no finish chunk
+	                         and no [DONE]
+	- mock_stall_rate:       chance that the stream stalls once for mock_stall_ms
+	                         at a random token
+	- mock_write_bps:        cap the write rate of the reply (bytes per second)
+
+	With mock_fault_seed the outcome is fixed for that request; otherwise the
+	seed comes from the --fault-seed stream, so a retried request can succeed.
+	"""
+
+	__slots__ = ("rng", "error_rate", "error_status", "retry_after_s", "cut_after_tokens", "stall_rate", "stall_s", "write_bps")
+
+	def __init__(self, req: dict[str, Any]) -> None:
+		seed = req.get("mock_fault_seed")
+		if seed is None:
+			with FAULT_RNG_LOCK:
+				seed = FAULT_RNG.getrandbits(64)
+		self.rng = random.Random(f"{normalize_seed(seed)}:faults")
+		self.error_rate = clamp_float(mock_option(req, "mock_error_rate"), 0.0, 1.0)
+		self.error_status = clamp_int(mock_option(req, "mock_error_status"), 400, 599, 429)
+		self.retry_after_s = clamp_int(mock_option(req, "mock_retry_after_s"), 0, 3600, 1)
+		self.cut_after_tokens = clamp_int(mock_option(req, "mock_cut_after_tokens"), 0, 1 << 30, 0)
+		self.stall_rate = clamp_float(mock_option(req, "mock_stall_rate"), 0.0, 1.0)
+		self.stall_s = clamp_int(mock_option(req, "mock_stall_ms"), 0, 3600000, 0) / 1000.0
+		self.write_bps = clamp_int(mock_option(req, "mock_write_bps"), 0, 1 << 40, 0)
+
+	@classmethod
+	def of(cls, req: dict[str, Any]) -> FaultPlan | None:
+		"""None when no fault is configured (the common, zero-cost case)."""
+		if not any(mock_option(req, key) for key in FAULT_KEYS):
+			return None
+		return cls(req)
+
+	def error_response(self, route: str = "chat_completions") -> MockResponse | None:
+		if self.error_rate <= 0 or self.rng.random() >= self.error_rate:
+			return None
+		message, kind, code = FAULT_ERRORS.get(self.error_status, ("Injected failure (mock)", "server_error", None))
+		resp = error_response(route, self.error_status, {"message": message, "type": kind, "param": None, "code": code})
+		resp.headers.append(("Retry-After", str(self.retry_after_s)))
+		METRICS.add(("errors_injected_total",))
+		return resp
+
+	def apply(self, resp: MockResponse, total_tokens: int) -> MockResponse:
+		if resp.events is not None:
+			cut_at = self.cut_after_tokens if 0 < self.cut_after_tokens < total_tokens else 0
+			resp.truncated = cut_at > 0
+			resp.events = self._disrupt(resp.events, total_tokens, cut_at)
+		if self.write_bps > 0:
+			if resp.events is None:
+				resp.events, resp.body = iter(((resp.body, 0.0, resp.tokens),)), b""
+			resp.events = throttle_events(resp.events, self.write_bps)
+		return resp
+
+	def _disrupt(self, events: Iterator[tuple[bytes, float, int]], total_tokens: int, cut_at: int) -> Iterator[tuple[bytes, float, int]]:
+		stall_at = 0
+		if self.stall_s > 0 and self.stall_rate > 0 and self.rng.random() < self.stall_rate:
+			stall_at = self.rng.randint(1, max(1, total_tokens - 1))
+		sent = 0
+		for data, delay_s, tokens in events:
+			sent += tokens
+			if stall_at and sent >= stall_at:
+				stall_at = 0
+				delay_s += self.stall_s
+				METRICS.add(("stalls_injected_total",))
+			yield data, delay_s, tokens
+			if cut_at and sent >= cut_at:
+				METRICS.add(("streams_cut_total",))
+				return
+
+
+def throttle_events(events: Iterator[tuple[bytes, float, int]], bps: int) -> Iterator[tuple[bytes, float, int]]:
+	"""Re-slice events into ~20 ms writes paced at `bps` bytes per second."""
+	slice_size = max(1, bps // 50)
+	for data, delay_s, tokens in events:
+		if len(data) <= slice_size:
+			yield data, delay_s + len(data) / bps, tokens
+			continue
+		view = memoryview(data)
+		last = (len(view) - 1) // slice_size * slice_size
+		for pos in range(0, len(view), slice_size):
+			piece = view[pos : pos + slice_size]
+			if pos == last:
+				yield piece, delay_s + len(piece) / bps, tokens
+			else:
+				yield piece, len(piece) / bps, 0
+
+
+# ---------------------------------------------------------------------------
+# write batching
+# ---------------------------------------------------------------------------
+
+# Set from --tcp-nodelay; None keeps each engine's default (Nagle on for the
+# threading engine, off for asyncio).
+TCP_NODELAY: bool | None = None
+try:
+	IOV_MAX = os.sysconf("SC_IOV_MAX")
+except (AttributeError, ValueError, OSError):
+	IOV_MAX = 1024
+
+
+class FlushPolicy:
+	"""
+	When buffered events go out on the socket: after every `events` events
+	and/or once the oldest pending event is `interval_s` old, whichever comes
+	first (0 disables a trigger). Spec strings: "event", "16", "20ms", "16,20ms".
+	"""
+
+	__slots__ = ("events", "interval_s")
+
+	def __init__(self, events: int = 1, interval_s: float = 0.0) -> None:
+		self.events = events
+		self.interval_s = interval_s
+
+	@classmethod
+	def parse(cls, spec: str) -> FlushPolicy:
+		if spec.strip() == "event":
+			return cls()
+		events, interval_s = 0, 0.0
+		for part in spec.split(","):
+			part = part.strip()
+			if part.endswith("ms"):
+				interval_s = float(part[:-2]) / 1000.0
+				if not math.isfinite(interval_s) or interval_s <= 0:
+					raise ValueError(f"flush interval must be > 0 ms: {part!r}")
+			else:
+				events = int(part)
+				if events < 1:
+					raise ValueError(f"flush event count must be >= 1: {part!r}")
+		return cls(events, interval_s)
+
+
+@lru_cache(maxsize=64)
+def flush_policy(spec: str) -> FlushPolicy:
+	"""Cached FlushPolicy.parse(); a bad per-request spec falls back to flushing every event."""
+	try:
+		return FlushPolicy.parse(spec)
+	except ValueError:
+		return FlushPolicy()
+
+
+def iter_writes(resp: MockResponse) -> Iterator[tuple[list[Any], int, float]]:
+	"""
+	Group resp.events into socket writes per resp.flush: (buffers, tokens,
+	sleep_after_s) with time_scale applied. Events held back by the policy
+	stay pending across delays; an empty `buffers` is a plain wait.
+	"""
+	policy = flush_policy(resp.flush)
+	scale = resp.time_scale
+	if policy.events == 1:
+		for data, delay_s, tokens in resp.events:
+			yield [data], tokens, delay_s * scale
+		return
+	pending: list[Any] = []
+	pending_tokens = 0
+	age_s = 0.0
+	for data, delay_s, tokens in resp.events:
+		pending.append(data)
+		pending_tokens += tokens
+		delay_s *= scale
+		if len(pending) == policy.events:
+			yield pending, pending_tokens, delay_s
+		elif policy.interval_s and age_s + delay_s >= policy.interval_s:
+			wait_s = policy.interval_s - age_s
+			yield [], 0, wait_s
+			yield pending, pending_tokens, delay_s - wait_s
+		else:
+			age_s += delay_s
+			if delay_s > 0:
+				yield [], 0, delay_s
+			continue
+		pending, pending_tokens, age_s = [], 0, 0.0
+	if pending:
+		yield pending, pending_tokens, 0.0
+
+
+def send_buffers(sock: socket.socket, buffers: list[Any]) -> None:
+	"""writev()-style send: one sendmsg() per IOV_MAX buffers, resumed after partial sends."""
+	if len(buffers) == 1 or not hasattr(sock, "sendmsg"):
+		sock.sendall(buffers[0] if len(buffers) == 1 else b"".join(buffers))
+		return
+	views = [view for view in (memoryview(buf).cast("B") for buf in buffers) if view.nbytes]
+	pos = 0
+	while pos < len(views):
+		sent = sock.sendmsg(views[pos : pos + IOV_MAX])
+		while sent:
+			size = views[pos].nbytes
+			if sent >= size:
+				sent -= size
+				pos += 1
+			else:
+				views[pos] = views[pos][sent:]
+				sent = 0
+
+
+def apply_tcp_nodelay(sock: socket.socket | None) -> None:
+	if TCP_NODELAY is None or sock is None or sock.family not in (socket.AF_INET, socket.AF_INET6):
+		return
+	try:
+		sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, int(TCP_NODELAY))
+	except OSError:
+		pass
+
+
+# ---------------------------------------------------------------------------
+# stream pacing
+# ---------------------------------------------------------------------------
+
+# --pacing-trace: O_APPEND fd shared by every worker; each stream's records
+# go out in one write() when it ends.
+PACING_TRACE_FD: int | None = None
+PACING_STREAM_IDS = count(1)
+
+
+class StreamPacer:
+	"""
+	Deadline pacing for one streamed response. Every sleep_after_s from
+	iter_writes() moves an absolute deadline counted from the stream start,
+	so send time, scheduling delay and sleep overshoot are taken out of the
+	next wait instead of adding up; a stream that fell behind writes what is
+	due back to back until it is on schedule again.
+	"""
+
+	__slots__ = ("start", "deadline", "trace")
+
+	def __init__(self) -> None:
+		self.start = self.deadline = time.perf_counter()
+		# (target_s, sent_s, bytes, tokens) per write, kept only for --pacing-trace
+		self.trace: list[tuple[float, float, int, int]] | None = [] if PACING_TRACE_FD is not None else None
+
+	def sent(self, nbytes: int, tokens: int) -> None:
+		if self.trace is not None:
+			self.trace.append((self.deadline - self.start, time.perf_counter() - self.start, nbytes, tokens))
+
+	def wait_s(self, sleep_s: float) -> float:
+		"""Seconds until the next write is due; <= 0 means it is already late."""
+		self.deadline += sleep_s
+		return self.deadline - time.perf_counter()
+
+	def finish(self, route: str) -> None:
+		if not self.trace or PACING_TRACE_FD is None:
+			return
+		head = {"pid": os.getpid(), "stream": next(PACING_STREAM_IDS), "route": route}
+		lines = [
+			json.dumps(
+				{
+					**head,
+					"seq": seq,
+					"target_ms": round(target_s * 1000.0, 3),
+					"sent_ms": round(sent_s * 1000.0, 3),
+					"error_ms": round((sent_s - target_s) * 1000.0, 3),
+					"bytes": nbytes,
+					"tokens": tokens,
+				}
+			)
+			for seq, (target_s, sent_s, nbytes, tokens) in enumerate(self.trace)
+		]
+		try:
+			os.write(PACING_TRACE_FD, ("\n".join(lines) + "\n").encode("utf-8"))
+		except OSError:
+			pass
+
+
+def open_pacing_trace(path: str) -> int:
+	"""Truncate the trace once, before --workers fork, so every process appends to the same file."""
+	return os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_APPEND, 0o644)
+
+
+# ---------------------------------------------------------------------------
+# metrics
+# ---------------------------------------------------------------------------
+
+METRIC_ROUTES = ("chat_completions", "embeddings", "messages", "generate_content", "models", "health", "metrics", "options", "unknown")
+METRIC_STATUS_CLASSES = ("1xx", "2xx", "3xx", "4xx", "5xx")
+METRIC_RESPONSE_KINDS = ("json", "stream")
+METRIC_COUNTERS = (
+	("streams_open", "gauge", "SSE streams currently being written."),
+	("streams_total", "counter", "SSE streams started."),
+	("bytes_sent_total", "counter", "Response body bytes written to sockets."),
+	("tokens_sent_total", "counter", "Completion tokens written to sockets."),
+	("client_disconnects_total", "counter", "Streams aborted by the client (broken pipe / connection reset)."),
+	("recorded_total", "counter", "Replies appended to the --record transcript store."),
+	("replay_hits_total", "counter", "Requests answered from the --replay transcript store."),
+	("replay_misses_total", "counter", "Requests with no recorded reply in the --replay transcript store."),
+	("errors_injected_total", "counter", "Requests answered with an injected error status (mock_error_rate)."),
+	("streams_cut_total", "counter", "Streams ended early by mock_cut_after_tokens."),
+	("stalls_injected_total", "counter", "Mid-stream stalls injected by mock_stall_rate."),
+	("streams_queued", "gauge", "Requests waiting for a --profiles max_concurrency slot."),
+	("queue_rejections_total", "counter", "Requests refused with 429 because their profile's max_queue was full."),
+)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+
+class Metrics:
+	"""
+	Process-wide counters for /metrics (Prometheus text exposition format).
+
+	Every series lives at a fixed offset in one flat row of doubles. With
+	--workers the rows live in one shared anonymous mmap (one row per worker,
+	written only by its owner); readers sum all rows slot by slot, so any
+	worker can answer /metrics and /health for the whole server.
+	"""
+
+	def __init__(self) -> None:
+		offsets: dict[tuple[str, ...], int] = {}
+		for route in METRIC_ROUTES:
+			offsets["requests", route] = len(offsets)
+		for status_class in METRIC_STATUS_CLASSES:
+			offsets["responses", status_class] = len(offsets)
+		for name in (*(counter[0] for counter in METRIC_COUNTERS), "worker_pid", "worker_started"):
+			offsets[(name,)] = len(offsets)
+		for kind in METRIC_RESPONSE_KINDS:
+			for i in range(len(DURATION_BUCKETS) + 1):
+				offsets["bucket", kind, str(i)] = len(offsets)
+			offsets["sum", kind] = len(offsets)
+			offsets["count", kind] = len(offsets)
+		self.offsets = offsets
+		self.values: array | memoryview = array("d", bytes(8 * len(offsets)))
+		self.rows: list[array | memoryview] = [self.values]
+		self.lock = threading.Lock()
+		self._shared: mmap.mmap | None = None
+		self.claim_row(0)
+
+	def share(self, workers: int) -> None:
+		"""Allocate one row per worker in memory inherited across fork()."""
+		row_bytes = 8 * len(self.offsets)
+		self._shared = mmap.mmap(-1, row_bytes * workers)
+		view = memoryview(self._shared)
+		self.rows = [view[i * row_bytes : (i + 1) * row_bytes].cast("d") for i in range(workers)]
+		self.values = self.rows[0]
+
+	def claim_row(self, index: int) -> None:
+		"""Called in the worker that owns row `index`."""
+		self.values = self.rows[index]
+		self.values[self.offsets["worker_pid",]] = os.getpid()
+		self.values[self.offsets["worker_started",]] = time.time()
+
+	def workers(self) -> list[dict[str, Any]]:
+		out = []
+		for index, row in enumerate(self.rows):
+			pid = int(row[self.offsets["worker_pid",]])
+			out.append(
+				{
+					"index": index,
+					"pid": pid,
+					"alive": pid > 0 and pid_alive(pid),
+					"streams_open": int(row[self.offsets["streams_open",]]),
+					"uptime_s": round(time.time() - row[self.offsets["worker_started",]], 3) if pid else 0.0,
+				}
+			)
+		return out
+
+	def add(self, key: tuple[str, ...], amount: float = 1.0) -> None:
+		with self.lock:
+			self.values[self.offsets[key]] += amount
+
+	def response_started(self, resp: MockResponse) -> None:
+		with self.lock:
+			values, offsets = self.values, self.offsets
+			values[offsets["requests", resp.route]] += 1
+			values[offsets["responses", f"{resp.status // 100}xx"]] += 1
+			if resp.events is not None:
+				values[offsets["streams_open",]] += 1
+				values[offsets["streams_total",]] += 1
+
+	def sent(self, nbytes: int, tokens: int) -> None:
+		with self.lock:
+			self.values[self.offsets["bytes_sent_total",]] += nbytes
+			self.values[self.offsets["tokens_sent_total",]] += tokens
+
+	def response_finished(self, resp: MockResponse, duration_s: float, disconnected: bool = False) -> None:
+		kind = "json" if resp.events is None else "stream"
+		bucket = bisect_left(DURATION_BUCKETS, duration_s)
+		with self.lock:
+			values, offsets = self.values, self.offsets
+			if resp.events is not None:
+				values[offsets["streams_open",]] -= 1
+			if disconnected:
+				values[offsets["client_disconnects_total",]] += 1
+			values[offsets["bucket", kind, str(bucket)]] += 1
+			values[offsets["sum", kind]] += duration_s
+			values[offsets["count", kind]] += 1
+
+	def snapshot(self) -> list[float]:
+		if len(self.rows) == 1:
+			with self.lock:
+				return self.values.tolist()
+		return [sum(column) for column in zip(*(row.tolist() for row in self.rows))]
+
+	def render(self, values: list[float] | None = None) -> str:
+		if values is None:
+			values = self.snapshot()
+		offsets = self.offsets
+
+		def num(value: float) -> str:
+			return str(int(value)) if value.is_integer() else repr(value)
+
+		out = [
+			"# HELP mock_requests_total Requests received, by route.",
+			"# TYPE mock_requests_total counter",
+		]
+		out += [f'mock_requests_total{{route="{route}"}} {num(values[offsets["requests", route]])}' for route in METRIC_ROUTES]
+		out += ["# HELP mock_responses_total Responses sent, by status class.", "# TYPE mock_responses_total counter"]
+		out += [f'mock_responses_total{{code="{c}"}} {num(values[offsets["responses", c]])}' for c in METRIC_STATUS_CLASSES]
+		for name, kind, help_text in METRIC_COUNTERS:
+			out += [f"# HELP mock_{name} {help_text}", f"# TYPE mock_{name} {kind}", f"mock_{name} {num(values[offsets[name,]])}"]
+		alive = sum(1 for worker in self.workers() if worker["alive"])
+		out += ["# HELP mock_workers Worker processes alive.", "# TYPE mock_workers gauge", f"mock_workers {alive}"]
+		out += [
+			"# HELP mock_request_duration_seconds Time from dispatch to the last byte written.",
+			"# TYPE mock_request_duration_seconds histogram",
+		]
+		for kind in METRIC_RESPONSE_KINDS:
+			cumulative = 0.0
+			for i, le in enumerate((*DURATION_BUCKETS, "+Inf")):
+				cumulative += values[offsets["bucket", kind, str(i)]]
+				out.append(f'mock_request_duration_seconds_bucket{{kind="{kind}",le="{le}"}} {num(cumulative)}')
+			out.append(f'mock_request_duration_seconds_sum{{kind="{kind}"}} {num(values[offsets["sum", kind]])}')
+			out.append(f'mock_request_duration_seconds_count{{kind="{kind}"}} {num(values[offsets["count", kind]])}')
+		return "\n".join(out) + "\n"
+
+
+def pid_alive(pid: int) -> bool:
+	if pid == os.getpid():
+		return True
+	try:
+		os.kill(pid, 0)
+	except ProcessLookupError:
+		return False
+	except OSError:
+		return True
+	return True
+
+
+METRICS = Metrics()
+
+
+def health_payload() -> dict[str, Any]:
+	if len(METRICS.rows) == 1:
+		return {"ok": True, "time": now_ts()}
+	workers = METRICS.workers()
+	return {"ok": all(w["alive"] for w in workers), "time": now_ts(), "pid": os.getpid(), "workers": workers}
+
+
+def metrics_response() -> MockResponse:
+	data = METRICS.render().encode("utf-8")
+	return MockResponse(
+		200,
+		[("Content-Type", "text/plain; version=0.0.4; charset=utf-8"), ("Content-Length", str(len(data)))],
+		body=data,
+	)
+
+
+# ---------------------------------------------------------------------------
+# model profiles (--profiles)
+# ---------------------------------------------------------------------------
+
+# Friendly profile keys; any mock_* key is accepted verbatim as well.
+PROFILE_FIELDS = {
+	"ttft_ms": "mock_ttft_ms",
+	"delay_ms": "mock_delay_ms",
+	"jitter_ms": "mock_jitter_ms",
+	"latency_dist": "mock_latency_dist",
+	"chunk_tokens": "mock_chunk_tokens",
+	"error_rate": "mock_error_rate",
+	"error_status": "mock_error_status",
+	"retry_after_s": "mock_retry_after_s",
+}
+PROFILE_LIMITS = ("tokens_per_s", "max_concurrency", "max_queue", "owned_by")
+
+
+class ConcurrencyGate:
+	"""
+	FIFO admission for one model profile: at most `limit` responses are
+	written at once, later ones wait for a slot. Blocking waiters (threading
+	engine) and awaitable ones (asyncio engine) share the queue; a finished
+	response hands its slot straight to the oldest waiter. With `max_queue`
+	set, a request that finds that many already waiting is refused: the
+	check and the enqueue happen under one lock, so concurrent arrivals
+	cannot overfill the queue.
+	"""
+
+	def __init__(self, name: str, limit: int, max_queue: int | None = None) -> None:
+		self.name = name
+		self.limit = limit
+		self.max_queue = max_queue
+		self.active = 0
+		self.waiters: deque[Callable[[], None]] = deque()
+		self.lock = threading.Lock()
+
+	@property
+	def queued(self) -> int:
+		return len(self.waiters)
+
+	def _try_enter(self, wake: Callable[[], None]) -> bool | None:
+		"""True: admitted now; False: queued, wake() runs on admission; None: the queue is full."""
+		with self.lock:
+			if self.active < self.limit:
+				self.active += 1
+				return True
+			if self.max_queue is not None and len(self.waiters) >= self.max_queue:
+				return None
+			self.waiters.append(wake)
+		METRICS.add(("streams_queued",))
+		return False
+
+	def leave(self) -> None:
+		with self.lock:
+			if not self.waiters:
+				self.active -= 1
+				return
+			wake = self.waiters.popleft()
+		METRICS.add(("streams_queued",), -1)
+		wake()
+
+	def enter(self) -> float | None:
+		"""Block until admitted; returns the seconds spent queued, or None (no slot held) when the queue is full."""
+		started = time.perf_counter()
+		admitted = threading.Event()
+		entered = self._try_enter(admitted.set)
+		if entered is None:
+			return None
+		if not entered:
+			admitted.wait()
+		return time.perf_counter() - started
+
+	async def enter_async(self) -> float | None:
+		started = time.perf_counter()
+		loop = asyncio.get_running_loop()
+		admitted: asyncio.Future[None] = loop.create_future()
+
+		def admit() -> None:
+			if admitted.cancelled():
+				self.leave()  # the waiter is gone; pass the slot on
+			else:
+				admitted.set_result(None)
+
+		entered = self._try_enter(lambda: loop.call_soon_threadsafe(admit))
+		if entered is None:
+			return None
+		if not entered:
+			try:
+				await admitted
+			except asyncio.CancelledError:
+				if admitted.done() and not admitted.cancelled():
+					self.leave()
+				raise
+		return time.perf_counter() - started
+
+	def rejection(self, route: str) -> MockResponse:
+		"""The 429 sent in place of a response that found the queue full."""
+		METRICS.add(("queue_rejections_total",))
+		message = f"Too many concurrent requests for {self.name!r} (mock profile queue full)"
+		resp = error_response(route, 429, {"message": message, "type": "rate_limit_exceeded", "param": None, "code": None})
+		resp.route = route
+		return resp
+
+
+class ModelProfile:
+	"""
+	Settings for every model name matching `pattern` (fnmatch glob): mock_*
+	defaults that sit between the request's own fields and the CLI ones, plus
+	an optional concurrency limit. `max_queue` bounds the waiting line; once
+	it is full, requests are refused with 429 right away.
+	"""
+
+	__slots__ = ("pattern", "settings", "options", "gate", "owned_by")
+
+	def __init__(self, pattern: str, settings: dict[str, Any]) -> None:
+		self.pattern = pattern
+		self.settings = settings
+		self.options: dict[str, Any] = {}
+		for key, value in settings.items():
+			if key in PROFILE_FIELDS:
+				self.options[PROFILE_FIELDS[key]] = value
+			elif key in MOCK_DEFAULTS:
+				self.options[key] = value
+			elif key not in PROFILE_LIMITS:
+				raise ValueError(f"profile {pattern!r}: unknown field {key!r}")
+		tokens_per_s = float(settings.get("tokens_per_s") or 0)
+		if tokens_per_s > 0:
+			self.options["mock_delay_ms"] = 1000.0 / tokens_per_s
+		limit = int(settings.get("max_concurrency") or 0)
+		max_queue = settings.get("max_queue")
+		self.gate = ConcurrencyGate(pattern, limit, None if max_queue is None else max(0, int(max_queue))) if limit > 0 else None
+		self.owned_by = str(settings.get("owned_by") or "mock")
+
+	def apply(self, req: dict[str, Any]) -> None:
+		for key, value in self.options.items():
+			if req.get(key) is None:
+				req[key] = value
+
+
+class ProfileRegistry:
+	"""
+	Profiles from a JSON object mapping model names or glob patterns to
+	settings. Exact names win over globs; globs are tried in file order.
+	"""
+
+	def __init__(self, profiles: dict[str, dict[str, Any]]) -> None:
+		self.profiles = [ModelProfile(pattern, settings) for pattern, settings in profiles.items()]
+		self.exact = {p.pattern: p for p in self.profiles if not any(c in p.pattern for c in "*?[")}
+		self.globs = [p for p in self.profiles if p.pattern not in self.exact]
+		self.created = now_ts()
+		self._matches: dict[str, ModelProfile | None] = {}
+
+	@classmethod
+	def load(cls, path: str) -> ProfileRegistry:
+		with open(path, encoding="utf-8") as f:
+			data = json.load(f)
+		if not isinstance(data, dict) or not all(isinstance(v, dict) for v in data.values()):
+			raise ValueError("expected a JSON object of {model or glob: {settings}}")
+		return cls(data)
+
+	def match(self, model: str) -> ModelProfile | None:
+		try:
+			return self._matches[model]
+		except KeyError:
+			pass
+		profile = self.exact.get(model) or next((p for p in self.globs if fnmatchcase(model, p.pattern)), None)
+		if len(self._matches) < 4096:
+			self._matches[model] = profile
+		return profile
+
+
+PROFILES: ProfileRegistry | None = None
+
+
+def request_model(route: str, req: dict[str, Any], path: str) -> str:
+	if route == "generate_content":
+		match = GEMINI_PATH_RE.fullmatch(urlsplit(path).path.rstrip("/"))
+		if match is not None:
+			return match.group(1)
+	return str(req.get("model") or "mock-model")
+
+
+def models_response(path: str) -> MockResponse:
+	"""GET /v1/models (OpenAI list) or /v1beta/models (Gemini list): every --profiles entry."""
+	profiles = PROFILES.profiles if PROFILES is not None else [ModelProfile("mock-model", {})]
+	created = PROFILES.created if PROFILES is not None else now_ts()
+	if path.startswith("/v1beta") or path.startswith("/v1alpha"):
+		methods = ["generateContent", "streamGenerateContent"]
+		models = [{"name": f"models/{p.pattern}", "displayName": p.pattern, "supportedGenerationMethods": methods} for p in profiles]
+		return json_response(200, {"models": models})
+	data = [{"id": p.pattern, "object": "model", "created": created, "owned_by": p.owned_by, "mock_profile": p.settings} for p in profiles]
+	return json_response(200, {"object": "list", "data": data})
+
+
+# ---------------------------------------------------------------------------
+# request bodies
+# ---------------------------------------------------------------------------
+
+JSON_WS_RE = re.compile(r"[ \t\n\r]*")
+# String contents up to the closing quote (or the end of the buffer); only
+# complete escapes are consumed, so a cut "\u12" waits for the next chunk.
+JSON_STRING_BODY_RE = re.compile(r'[^"\\\x00-\x1f]*(?:(?:\\["\\/bfnrt]|\\u[0-9a-fA-F]{4})[^"\\\x00-\x1f]*)*')
+JSON_HIGH_SURROGATE_RE = re.compile(r"\\u[dD][89abAB][0-9a-fA-F]{2}")
+JSON_NON_STRUCTURAL_RE = re.compile(r'[^"\[\]{}]*')
+JSON_SCALAR_RE = re.compile(r"[-+.\w]*")
+JSON_DECODER = json.JSONDecoder()
+JSON_VALUE_START = '"[{-0123456789tfnNI'
+REQUEST_READ_SIZE = 65536
+MAX_CHUNK_LINE = 4096
+
+
+class ChatRequestReader:
+	"""
+	Incremental parser for /v1/chat/completions bodies.
+
+	feed() takes body bytes as they arrive (any chunking); `messages` is
+	consumed message by message: prompt tokens are counted as each message
+	closes and only the last user message's text is kept, so a multi-MB
+	history never sits in memory as bytes, str and parsed JSON at once.
+	Every other top-level field is parsed normally. Fields the mock ignores
+	inside messages (images, tool calls, ...) are skipped without decoding.
+	Syntax errors carry json.loads-style messages and positions.
+
+	The parser is a generator that yields whenever it needs more input.
+	"""
+
+	def __init__(self) -> None:
+		self.decoder = codecs.getincrementaldecoder("utf-8")()
+		self.buf = ""
+		self.pos = 0
+		self.offset = 0  # chars dropped from the front of buf
+		self.lines = 0  # newlines in the dropped chars
+		self.line_start = 0  # absolute offset just past the last dropped newline
+		self.eof = False
+		self.empty = True
+		self.bytes_in = 0
+		self.error: ValueError | None = None
+		self.result: tuple[dict[str, Any], PromptSummary] | None = None
+		self.parser: Iterator[None] | None = self._document()
+
+	def feed(self, data: bytes) -> None:
+		if self.parser is None or not data:
+			return
+		self.empty = False
+		try:
+			self._append(self._decode(data))
+		except ValueError as e:
+			self._fail(e)
+			return
+		self._resume()
+
+	def _decode(self, data: bytes, final: bool = False) -> str:
+		"""UTF-8 decode one chunk; errors report the position within the whole body."""
+		pending = len(self.decoder.getstate()[0])
+		try:
+			return self.decoder.decode(data, final)
+		except UnicodeDecodeError as e:
+			start = self.bytes_in - pending + e.start
+			if e.end - e.start == 1:
+				where = f"byte 0x{e.object[e.start]:02x} in position {start}"
+			else:
+				where = f"bytes in position {start}-{start + e.end - e.start - 1}"
+			raise ValueError(f"'utf-8' codec can't decode {where}: {e.reason}") from None
+		finally:
+			self.bytes_in += len(data)
+
+	def close(self) -> tuple[dict[str, Any], PromptSummary]:
+		"""The parsed request (minus `messages`) and its prompt summary; raises ValueError."""
+		if self.parser is not None:
+			try:
+				self._append(self._decode(b"", final=True))
+			except ValueError as e:
+				self._fail(e)
+			self.eof = True
+			if self.parser is not None:
+				self._resume()
+		if self.error is not None:
+			raise self.error
+		if self.result is None:
+			raise ValueError("Unexpected end of request body")
+		return self.result
+
+	def _append(self, text: str) -> None:
+		dropped = self.pos
+		if dropped:
+			newlines = self.buf.count("\n", 0, dropped)
+			if newlines:
+				self.lines += newlines
+				self.line_start = self.offset + self.buf.rindex("\n", 0, dropped) + 1
+			self.offset += dropped
+		self.buf = self.buf[dropped:] + text
+		self.pos = 0
+
+	def _resume(self) -> None:
+		assert self.parser is not None
+		try:
+			next(self.parser)
+		except StopIteration:
+			self.parser = None
+		except ValueError as e:
+			self._fail(e)
+
+	def _fail(self, error: ValueError) -> None:
+		self.error = error
+		self.parser = None
+
+	def _line_col(self, at: int) -> tuple[int, int]:
+		"""Line and column of absolute offset `at`, which must not have been dropped yet."""
+		lineno, line_start = self.lines + 1, self.line_start
+		rel = at - self.offset
+		if rel > 0:
+			newlines = self.buf.count("\n", 0, rel)
+			if newlines:
+				lineno += newlines
+				line_start = self.offset + self.buf.rindex("\n", 0, rel) + 1
+		return lineno, at - line_start + 1
+
+	def _error(self, msg: str, at: int | None = None) -> ValueError:
+		"""ValueError formatted like json.JSONDecodeError; `at` is an absolute offset."""
+		at = self.offset + self.pos if at is None else at
+		lineno, colno = self._line_col(max(at, self.offset))
+		return ValueError(f"{msg}: line {lineno} column {colno} (char {at})")
+
+	# -- grammar ------------------------------------------------------------
+
+	def _peek(self) -> Iterator[None]:
+		"""Skip whitespace; returns the next character ('' at end of input)."""
+		while True:
+			self.pos = JSON_WS_RE.match(self.buf, self.pos).end()
+			if self.pos < len(self.buf) or self.eof:
+				return self.buf[self.pos : self.pos + 1]
+			yield
+
+	def _document(self) -> Iterator[None]:
+		c = yield from self._peek()
+		if c == "" and self.empty:
+			req: dict[str, Any] = {}
+			self.result = (req, PromptSummary.of([]))
+			return
+		if c != "{":
+			raise self._error("Expecting a JSON object" if c and c in JSON_VALUE_START else "Expecting value")
+		req = {}
+		prompt = PromptSummary()
+
+		def member(key: str) -> Iterator[None]:
+			nonlocal prompt
+			if key == "messages":
+				prompt = yield from self._messages()
+			else:
+				req[key] = yield from self._value()
+
+		yield from self._object(member)
+		if (yield from self._peek()) != "":
+			raise self._error("Extra data")
+		self.result = (req, prompt)
+
+	def _object(self, member: Callable[[str], Iterator[None]]) -> Iterator[None]:
+		"""Parse an object at the cursor, handing each value to member(key)."""
+		self.pos += 1
+		c = yield from self._peek()
+		if c == "}":
+			self.pos += 1
+			return
+		while True:
+			if c != '"':
+				raise self._error("Expecting property name enclosed in double quotes")
+			key = yield from self._string()
+			if (yield from self._peek()) != ":":
+				raise self._error("Expecting ':' delimiter")
+			self.pos += 1
+			if (yield from self._peek()) == "":
+				raise self._error("Expecting value")
+			yield from member(key)
+			c = yield from self._peek()
+			self.pos += 1
+			if c == "}":
+				return
+			if c != ",":
+				self.pos -= 1
+				raise self._error("Expecting ',' delimiter")
+			c = yield from self._peek()
+
+	def _array(self, item: Callable[[str], Iterator[None]]) -> Iterator[None]:
+		"""Parse an array at the cursor, calling item(first_char) for each element."""
+		self.pos += 1
+		c = yield from self._peek()
+		if c == "]":
+			self.pos += 1
+			return
+		while True:
+			if c == "":
+				raise self._error("Expecting value")
+			yield from item(c)
+			c = yield from self._peek()
+			self.pos += 1
+			if c == "]":
+				return
+			if c != ",":
+				self.pos -= 1
+				raise self._error("Expecting ',' delimiter")
+			c = yield from self._peek()
+
+	def _messages(self) -> Iterator[None]:
+		summary = PromptSummary()
+		if self.buf[self.pos] != "[":
+			# Not a list: keep it and let the buffered path make sense of it.
+			summary = PromptSummary.of((yield from self._value()))
+			return summary
+
+		def message(c: str) -> Iterator[None]:
+			if c != "{":
+				yield from self._skip()
+				return
+			fields: dict[str, Any] = {}
+
+			def member(key: str) -> Iterator[None]:
+				if key == "role":
+					fields["role"] = yield from self._value()
+				elif key == "content":
+					fields["content"] = yield from self._content()
+				else:
+					yield from self._skip()
+
+			yield from self._object(member)
+			text = fields.get("content", "")
+			summary.tokens += count_tokens(text)
+			if fields.get("role") == "user":
+				summary.last_user_text = text
+
+		yield from self._array(message)
+		return summary
+
+	def _content(self) -> Iterator[None]:
+		"""Message content reduced to its text, as extract_text_from_message_content does."""
+		c = self.buf[self.pos]
+		if c == '"':
+			return (yield from self._string())
+		if c != "[":
+			yield from self._skip()
+			return ""
+		parts: list[str] = []
+
+		def part(c: str) -> Iterator[None]:
+			if c != "{":
+				yield from self._skip()
+				return
+			fields: dict[str, Any] = {}
+
+			def member(key: str) -> Iterator[None]:
+				if key in ("type", "text"):
+					fields[key] = yield from self._value()
+				else:
+					yield from self._skip()
+
+			yield from self._object(member)
+			if fields.get("type") == "text":
+				parts.append(str(fields.get("text", "")))
+
+		yield from self._array(part)
+		return "".join(parts)
+
+	# -- values -------------------------------------------------------------
+
+	def _value(self) -> Iterator[None]:
+		c = self.buf[self.pos]
+		if c == '"':
+			return (yield from self._string())
+		if c not in "[{":
+			return (yield from self._scalar())
+		start = self.offset + self.pos
+		lineno, colno = self._line_col(start)
+		raw = yield from self._raw_container()
+		try:
+			return json.loads(raw)
+		except json.JSONDecodeError as e:
+			if e.lineno == 1:
+				e.colno += colno - 1
+			raise ValueError(f"{e.msg}: line {lineno + e.lineno - 1} column {e.colno} (char {start + e.pos})") from None
+
+	def _skip(self) -> Iterator[None]:
+		"""Validate and step over the value at the cursor without keeping it."""
+		c = self.buf[self.pos]
+		if c == '"':
+			yield from self._scan_string(None)
+		elif c == "{":
+			yield from self._object(lambda key: self._skip())
+		elif c == "[":
+			yield from self._array(lambda c: self._skip())
+		else:
+			yield from self._scalar()
+
+	def _scalar(self) -> Iterator[None]:
+		while JSON_SCALAR_RE.match(self.buf, self.pos).end() == len(self.buf) and not self.eof:
+			yield
+		try:
+			value, self.pos = JSON_DECODER.raw_decode(self.buf, self.pos)
+		except json.JSONDecodeError as e:
+			raise self._error(e.msg, self.offset + e.pos) from None
+		return value
+
+	def _string(self) -> Iterator[None]:
+		"""Decode the string at the cursor, piece by piece as its chunks arrive."""
+		parts: list[str] = []
+		yield from self._scan_string(lambda raw, at: parts.append(self._decode_piece(raw, at)), decode=True)
+		return parts[0] if len(parts) == 1 else "".join(parts)
+
+	def _decode_piece(self, raw: str, at: int) -> str:
+		try:
+			return scanstring(raw + '"', 0)[0]
+		except json.JSONDecodeError as e:
+			raise self._error(e.msg, at + e.pos) from None
+
+	def _scan_string(self, sink: Callable[[str, int], Any] | None, decode: bool = False) -> Iterator[None]:
+		"""
+		Walk the string at the cursor, passing its raw contents to sink(raw,
+		absolute_offset) in one or more pieces (quotes included unless
+		decoding). Pieces never split an escape or a surrogate pair.
+		"""
+		opened = self.offset + self.pos
+		self.pos += 1
+		if sink is not None and not decode:
+			sink('"', opened)
+		while True:
+			buf = self.buf
+			end = JSON_STRING_BODY_RE.match(buf, self.pos).end()
+			if end < len(buf):
+				c = buf[end]
+				if c == '"':
+					if sink is not None:
+						sink(buf[self.pos : end] + ("" if decode else '"'), self.offset + self.pos)
+					self.pos = end + 1
+					return
+				if c != "\\":
+					raise self._error("Invalid control character at", self.offset + end)
+				if self.eof and end + 1 == len(buf):
+					raise self._error("Unterminated string starting at", opened)
+				if len(buf) - end >= 6 or self.eof:
+					if buf[end + 1 : end + 2] == "u":
+						raise self._error("Invalid \\uXXXX escape", self.offset + end + 1)
+					raise self._error("Invalid \\escape", self.offset + end)
+			elif self.eof:
+				raise self._error("Unterminated string starting at", opened)
+			if decode and end - 6 >= self.pos and JSON_HIGH_SURROGATE_RE.fullmatch(buf, end - 6, end):
+				# Hold back a high surrogate escape until its low half arrives,
+				# unless its backslash is itself escaped.
+				run = end - 6
+				while run > self.pos and buf[run - 1] == "\\":
+					run -= 1
+				if (end - 6 - run) % 2 == 0:
+					end -= 6
+			if sink is not None and end > self.pos:
+				sink(buf[self.pos : end], self.offset + self.pos)
+			self.pos = end
+			yield
+
+	def _raw_container(self) -> Iterator[None]:
+		"""Raw text of the array / object at the cursor, for json.loads to parse and validate."""
+		pieces: list[str] = []
+		sink = lambda raw, at: pieces.append(raw)  # noqa: E731
+		depth = 0
+		while True:
+			start = self.pos
+			self.pos = JSON_NON_STRUCTURAL_RE.match(self.buf, self.pos).end()
+			pieces.append(self.buf[start : self.pos])
+			if self.pos == len(self.buf):
+				if self.eof:
+					return "".join(pieces)
+				yield
+				continue
+			c = self.buf[self.pos]
+			if c == '"':
+				yield from self._scan_string(sink)
+				continue
+			self.pos += 1
+			pieces.append(c)
+			depth += 1 if c in "[{" else -1
+			if depth == 0:
+				return "".join(pieces)
+
+
+def iter_request_body(rfile: Any, headers: Mapping[str, str]) -> Iterator[bytes]:
+	"""Yield request body bytes from a blocking file, for Content-Length or chunked framing."""
+	if "chunked" in (headers.get("transfer-encoding") or "").lower():
+		while True:
+			size_line = rfile.readline(MAX_CHUNK_LINE)
+			if not size_line:
+				raise ConnectionResetError("connection closed inside chunked body")
+			size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+			if size == 0:
+				while rfile.readline(MAX_CHUNK_LINE) not in (b"\r\n", b"\n", b""):
+					pass  # trailers
+				return
+			while size > 0:
+				data = rfile.read(min(size, REQUEST_READ_SIZE))
+				if not data:
+					raise ConnectionResetError("connection closed inside chunked body")
+				size -= len(data)
+				yield data
+			rfile.readline(MAX_CHUNK_LINE)
+	remaining = int(headers.get("content-length") or 0)
+	while remaining > 0:
+		data = rfile.read(min(remaining, REQUEST_READ_SIZE))
+		if not data:
+			raise ConnectionResetError("connection closed before Content-Length was reached")
+		remaining -= len(data)
+		yield data
+
+
+def request_reader(route: str) -> ChatRequestReader | None:
+	"""A streaming parser for this request, or None to buffer the raw body (record / replay keys on it)."""
+	if route == "chat_completions" and TRANSCRIPTS is None:
+		return ChatRequestReader()
+	return None
+
+
+# ---------------------------------------------------------------------------
+# record / replay
+# ---------------------------------------------------------------------------
+
+# transcripts.dat: append-only entries
+#   ENTRY_HEAD, headers JSON, n_chunks x CHUNK_ROW, concatenated chunk bytes
+# transcripts.idx: append-only INDEX_ROW per entry (a later row for the same
+#   key supersedes earlier ones)
+TRANSCRIPT_MAGIC = b"MTR1"
+TRANSCRIPT_STREAM = 1
+ENTRY_HEAD = struct.Struct("<4sHHIIQ")  # magic, status, flags, n_chunks, headers_len, body_len
+CHUNK_ROW = struct.Struct("<QII")  # send offset (us since first chunk), length, tokens
+INDEX_ROW = struct.Struct("<32sQQ")  # sha256(request), entry offset, entry length
+TRANSCRIPT_ROUTES = ("chat_completions", "embeddings", "messages", "generate_content")
+HOP_BY_HOP_HEADERS = {"connection", "content-length", "transfer-encoding", "keep-alive"}
+
+
+def transcript_key(method: str, path: str, raw: bytes) -> bytes:
+	"""sha256 of the route plus the request body re-serialized with sorted keys and no whitespace."""
+	try:
+		body = json.dumps(json.loads(raw or b"{}"), sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+	except ValueError:
+		body = raw
+	return hashlib.sha256(f"{method} {path.rstrip('/')}\n".encode("utf-8") + body).digest()
+
+
+# client headers relayed to the upstream as-is, and where --upstream-key goes per route
+PROXY_FORWARD_HEADERS = ("authorization", "x-api-key", "anthropic-version", "anthropic-beta", "x-goog-api-key", "x-goog-api-client")
+UPSTREAM_KEY_HEADERS = {
+	"messages": ("x-api-key", "{}"),
+	"generate_content": ("x-goog-api-key", "{}"),
+}
+
+
+class TranscriptStore:
+	"""
+	--record: persist every complete 2xx reply (synthesized, or proxied from
+	--upstream); streams cut short by mock_cut_after_tokens are not stored.
+	--replay: serve stored replies straight out of a read-only mmap of the
+	data file; lookups go through a dict built once from the index file, and
+	every write is a memoryview slice of the mapping (no copies, no JSON).
+	"""
+
+	def __init__(self, directory: str, mode: str, timing: str = "none", upstream: str | None = None, upstream_key: str | None = None) -> None:
+		self.mode = mode
+		self.timing = timing
+		self.upstream = urlsplit(upstream) if upstream else None
+		self.upstream_key = upstream_key
+		self.data_path = os.path.join(directory, "transcripts.dat")
+		self.index_path = os.path.join(directory, "transcripts.idx")
+		self.lock = threading.Lock()
+		self.index: dict[bytes, tuple[int, int]] = {}
+		self.view: memoryview | None = None
+		if mode == "record":
+			os.makedirs(directory, exist_ok=True)
+		else:
+			self._load()
+
+	def _load(self) -> None:
+		with open(self.index_path, "rb") as f:
+			index_bytes = f.read()
+		for key, offset, length in INDEX_ROW.iter_unpack(index_bytes[: len(index_bytes) - len(index_bytes) % INDEX_ROW.size]):
+			self.index[key] = (offset, length)
+		with open(self.data_path, "rb") as f:
+			if os.fstat(f.fileno()).st_size:
+				self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+				self.view = memoryview(self._map)
+
+	def __len__(self) -> int:
+		return len(self.index)
+
+	@property
+	def blocking(self) -> bool:
+		"""True when replies come from a blocking upstream connection."""
+		return self.mode == "record" and self.upstream is not None
+
+	def handle(self, route: str, method: str, path: str, raw: bytes, headers: Mapping[str, str] | None) -> MockResponse:
+		key = transcript_key(method, path, raw)
+		if self.mode == "replay":
+			resp = self.replay(key)
+			if resp is None:
+				METRICS.add(("replay_misses_total",))
+				return json_response(404, {"error": {"message": "No recorded response for this request", "type": "replay_miss"}})
+			METRICS.add(("replay_hits_total",))
+			return resp
+		resp = self.proxy(route, method, path, raw, headers) if self.upstream else dispatch_route(route, method, raw, path=path)
+		# A fault-cut stream would otherwise be stored (and replayed) as a complete reply.
+		return self.record(key, resp) if 200 <= resp.status < 300 and not resp.truncated else resp
+
+	# -- record -------------------------------------------------------------
+
+	def record(self, key: bytes, resp: MockResponse) -> MockResponse:
+		headers = [(name, value) for name, value in resp.headers if name.lower() not in HOP_BY_HOP_HEADERS]
+		if resp.events is None:
+			self.append(key, resp.status, 0, headers, [(0, bytes(resp.body), resp.tokens)])
+			return resp
+		resp.events = self._tee(key, resp.status, headers, resp.events)
+		return resp
+
+	def _tee(
+		self,
+		key: bytes,
+		status: int,
+		headers: list[tuple[str, str]],
+		events: Iterator[tuple[bytes, float, int]],
+	) -> Iterator[tuple[bytes, float, int]]:
+		chunks: list[tuple[int, bytes, int]] = []
+		started: float | None = None
+		for data, delay_s, tokens in events:
+			now = time.perf_counter()
+			started = now if started is None else started
+			chunks.append((int((now - started) * 1e6), bytes(data), tokens))
+			yield data, delay_s, tokens
+		# Only reached when the engine wrote every event, so streams aborted by a
+		# client disconnect are not stored; fault-cut streams never get here (handle()).
+		self.append(key, status, TRANSCRIPT_STREAM, headers, chunks)
+
+	def append(self, key: bytes, status: int, flags: int, headers: list[tuple[str, str]], chunks: list[tuple[int, bytes, int]]) -> None:
+		header_bytes = json.dumps(headers, ensure_ascii=False).encode("utf-8")
+		body = b"".join(data for _, data, _ in chunks)
+		entry = b"".join(
+			(
+				ENTRY_HEAD.pack(TRANSCRIPT_MAGIC, status, flags, len(chunks), len(header_bytes), len(body)),
+				header_bytes,
+				b"".join(CHUNK_ROW.pack(t_us, len(data), tokens) for t_us, data, tokens in chunks),
+				body,
+			)
+		)
+		with self.lock, open(self.data_path, "ab") as data_file, open(self.index_path, "ab") as index_file:
+			# flock serializes appends from --workers processes sharing the directory.
+			if fcntl is not None:
+				fcntl.flock(data_file.fileno(), fcntl.LOCK_EX)
+			try:
+				offset = os.fstat(data_file.fileno()).st_size
+				data_file.write(entry)
+				data_file.flush()
+				index_file.write(INDEX_ROW.pack(key, offset, len(entry)))
+				index_file.flush()
+			finally:
+				if fcntl is not None:
+					fcntl.flock(data_file.fileno(), fcntl.LOCK_UN)
+		METRICS.add(("recorded_total",))
+
+	def proxy(self, route: str, method: str, path: str, raw: bytes, headers: Mapping[str, str] | None) -> MockResponse:
+		upstream = self.upstream
+		assert upstream is not None
+		conn_cls = http.client.HTTPSConnection if upstream.scheme == "https" else http.client.HTTPConnection
+		conn = conn_cls(upstream.hostname or "127.0.0.1", upstream.port, timeout=300)
+		headers = headers or {}
+		forward = {"Content-Type": "application/json", "Accept": headers.get("accept") or "*/*"}
+		forward.update((name, value) for name in PROXY_FORWARD_HEADERS if (value := headers.get(name)))
+		if self.upstream_key:
+			key_header, key_format = UPSTREAM_KEY_HEADERS.get(route, ("authorization", "Bearer {}"))
+			forward[key_header] = key_format.format(self.upstream_key)
+		try:
+			conn.request(method, upstream.path.rstrip("/") + path, body=raw, headers=forward)
+			upstream_resp = conn.getresponse()
+		except OSError as e:
+			conn.close()
+			return json_response(502, {"error": {"message": f"Upstream request failed: {e}"}})
+		resp_headers = [(name, value) for name, value in upstream_resp.getheaders() if name.lower() not in HOP_BY_HOP_HEADERS]
+		if "text/event-stream" not in (upstream_resp.getheader("Content-Type") or ""):
+			body = upstream_resp.read()
+			conn.close()
+			return MockResponse(upstream_resp.status, [*resp_headers, ("Content-Length", str(len(body)))], body=body)
+
+		def relay() -> Iterator[tuple[bytes, float, int]]:
+			try:
+				while data := upstream_resp.read1(65536):
+					yield data, 0.0, 0
+			finally:
+				conn.close()
+
+		resp = MockResponse(upstream_resp.status, [*resp_headers, ("Connection", "close")], events=relay())
+		resp.blocking = True
+		return resp
+
+	# -- replay -------------------------------------------------------------
+
+	def replay(self, key: bytes) -> MockResponse | None:
+		location = self.index.get(key)
+		if location is None or self.view is None:
+			return None
+		view = self.view
+		offset = location[0]
+		magic, status, flags, n_chunks, headers_len, body_len = ENTRY_HEAD.unpack_from(view, offset)
+		if magic != TRANSCRIPT_MAGIC:
+			return None
+		pos = offset + ENTRY_HEAD.size
+		headers = [tuple(pair) for pair in json.loads(view[pos : pos + headers_len].tobytes())]
+		pos += headers_len
+		table = list(CHUNK_ROW.iter_unpack(view[pos : pos + n_chunks * CHUNK_ROW.size]))
+		pos += n_chunks * CHUNK_ROW.size
+		body = view[pos : pos + body_len]
+		tokens = sum(row[2] for row in table)
+		if not flags & TRANSCRIPT_STREAM:
+			return MockResponse(status, [*headers, ("Content-Length", str(body_len))], body=body, tokens=tokens)
+		if self.timing == "original":
+			events = self._paced(body, table)
+		else:
+			events = iter(((body, 0.0, tokens),))
+		return MockResponse(status, [*headers, ("Connection", "close")], events=events)
+
+	@staticmethod
+	def _paced(body: memoryview, table: list[tuple[int, int, int]]) -> Iterator[tuple[bytes, float, int]]:
+		pos = 0
+		for i, (t_us, length, tokens) in enumerate(table):
+			delay_s = (table[i + 1][0] - t_us) / 1e6 if i + 1 < len(table) else 0.0
+			yield body[pos : pos + length], max(0.0, delay_s), tokens
+			pos += length
+
+
+TRANSCRIPTS: TranscriptStore | None = None
+
+
+def route_name(method: str, path: str) -> str:
+	path = path.split("?", 1)[0].rstrip("/")
+	if method == "OPTIONS":
+		return "options"
+	if method == "GET" and path in ("/health", "/healthz"):
+		return "health"
+	if method == "GET" and path == "/metrics":
+		return "metrics"
+	if method == "GET" and path in ("/v1/models", "/v1beta/models", "/v1alpha/models"):
+		return "models"
+	if method == "POST" and path == "/v1/chat/completions":
+		return "chat_completions"
+	if method == "POST" and path == "/v1/embeddings":
+		return "embeddings"
+	if method == "POST" and path == "/v1/messages":
+		return "messages"
+	if method == "POST" and GEMINI_PATH_RE.fullmatch(path):
+		return "generate_content"
+	return "unknown"
+
+
+def dispatch(
+	method: str,
+	path: str,
+	raw: bytes,
+	headers: Mapping[str, str] | None = None,
+	body: ChatRequestReader | None = None,
+) -> MockResponse:
+	"""
+	Route one request; shared by every serving engine. `body` is the
+	request_reader() the engine fed the body into, in place of `raw`.
+	"""
+	route = route_name(method, path)
+	if TRANSCRIPTS is not None and route in TRANSCRIPT_ROUTES:
+		resp = TRANSCRIPTS.handle(route, method, path, raw, headers)
+	else:
+		resp = dispatch_route(route, method, raw, body, path)
+	resp.route = route
+	return resp
+
+
+def dispatch_route(route: str, method: str, raw: bytes, body: ChatRequestReader | None = None, path: str = "") -> MockResponse:
+	if route == "options":
+		return MockResponse(204, [("Content-Length", "0")])
+	if route == "health":
+		return json_response(200, health_payload())
+	if route == "metrics":
+		return metrics_response()
+	if route == "models":
+		return models_response(path)
+	if route == "unknown":
+		return json_response(404, {"error": {"message": "Not Found" if method == "GET" else "Unknown endpoint"}})
+
+	prompt = None
+	try:
+		if body is not None:
+			req, prompt = body.close()
+		else:
+			req = json.loads((raw or b"{}").decode("utf-8"))
+	except Exception as e:
+		return error_response(route, 400, {"message": f"Invalid JSON: {e}"})
+	if not isinstance(req, dict):
+		return error_response(route, 400, {"message": "Invalid JSON: request body must be a JSON object"})
+	profile = PROFILES.match(request_model(route, req, path)) if PROFILES is not None else None
+	if profile is not None:
+		profile.apply(req)
+	faults = FaultPlan.of(req)
+	if faults is not None and (error := faults.error_response(route)) is not None:
+		return error
+	if route == "embeddings":
+		resp = embeddings_response(req)
+	elif route == "messages":
+		resp = anthropic_messages_response(req)
+	elif route == "generate_content":
+		resp = gemini_response(req, path)
+	else:
+		resp = chat_completion_response(req, prompt)
+	resp.time_scale = request_time_scale(req)
+	resp.flush = str(mock_option(req, "mock_flush"))
+	if profile is not None:
+		resp.gate = profile.gate
+	return resp if faults is None else faults.apply(resp, resp.tokens)
+
+
+class OpenAIMockHandler(BaseHTTPRequestHandler):
+	server_version = "OpenAIMock/1.0"
+	protocol_version = "HTTP/1.1"
+
+	def setup(self) -> None:
+		super().setup()
+		apply_tcp_nodelay(self.connection)
+
+	def address_string(self) -> str:
+		# AF_UNIX peers have no address (client_address is "").
+		return self.client_address[0] if self.client_address else "unix"
+
+	def _respond(self, resp: MockResponse) -> None:
+		started = time.perf_counter()
+		if resp.gate is not None:
+			if (queued_s := resp.gate.enter()) is None:
+				resp = resp.gate.rejection(resp.route)
+			else:
+				resp.headers.append(("x-mock-queue-ms", f"{queued_s * 1000.0:.1f}"))
+		METRICS.response_started(resp)
+		disconnected = False
+		pacer = None
+		try:
+			self.send_response(resp.status)
+			for name, value in CORS_HEADERS:
+				self.send_header(name, value)
+			for name, value in resp.headers:
+				self.send_header(name, value)
+			self.end_headers()
+			if resp.events is None:
+				if resp.body:
+					self.wfile.write(resp.body)
+				METRICS.sent(len(resp.body), resp.tokens)
+				return
+			pacer = StreamPacer()
+			for buffers, tokens, sleep_s in iter_writes(resp):
+				if buffers:
+					send_buffers(self.connection, buffers)
+					nbytes = sum(len(buf) for buf in buffers)
+					METRICS.sent(nbytes, tokens)
+					pacer.sent(nbytes, tokens)
+				if sleep_s > 0 and (wait_s := pacer.wait_s(sleep_s)) > 0:
+					time.sleep(wait_s)
+		except (BrokenPipeError, ConnectionResetError):
+			# Client disconnected; only counted in /metrics.
+			disconnected = True
+			self.close_connection = True
+		finally:
+			if resp.gate is not None:
+				resp.gate.leave()
+			if pacer is not None:
+				pacer.finish(resp.route)
+			METRICS.response_finished(resp, time.perf_counter() - started, disconnected)
+
+	def do_OPTIONS(self) -> None:  # noqa: N802
+		self._respond(dispatch("OPTIONS", self.path, b""))
+
+	def do_GET(self) -> None:  # noqa: N802
+		self._respond(dispatch("GET", self.path, b""))
+
+	def do_POST(self) -> None:  # noqa: N802
+		raw = b""
+		route = route_name("POST", self.path)
+		body = request_reader(route)
+		try:
+			if body is None:
+				raw = b"".join(iter_request_body(self.rfile, self.headers))
+			else:
+				for data in iter_request_body(self.rfile, self.headers):
+					body.feed(data)
+		except Exception as e:
+			self.close_connection = True
+			self._respond(error_response(route, 400, {"message": f"Invalid JSON: {e}"}))
+			return
+		self._respond(dispatch("POST", self.path, raw, self.headers, body))
+
+
+# ---------------------------------------------------------------------------
+# asyncio engine
+# ---------------------------------------------------------------------------
+
+MAX_HEADER_LINES = 100
+
+
+def raise_nofile_limit() -> None:
+	"""Lift the soft fd limit to the hard limit so thousands of streams fit."""
+	try:
+		import resource
+	except ImportError:
+		return
+	soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+	for target in (hard, 65536):
+		if target != resource.RLIM_INFINITY and target <= soft:
+			continue
+		try:
+			resource.setrlimit(resource.RLIMIT_NOFILE, (target, hard))
+			return
+		except (ValueError, OSError):
+			continue
+
+
+def encode_response_head(status: int, headers: list[tuple[str, str]], keep_alive: bool) -> bytes:
+	try:
+		phrase = HTTPStatus(status).phrase
+	except ValueError:
+		phrase = ""
+	lines = [
+		f"HTTP/1.1 {status} {phrase}",
+		f"Server: {OpenAIMockHandler.server_version} Python/{sys.version.split()[0]}",
+		f"Date: {formatdate(usegmt=True)}",
+	]
+	lines += [f"{name}: {value}" for name, value in CORS_HEADERS]
+	lines += [f"{name}: {value}" for name, value in headers]
+	if not keep_alive and not any(name.lower() == "connection" for name, _ in headers):
+		lines.append("Connection: close")
+	return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def iterate_inline(writes: Iterator[tuple[list[Any], int, float]]) -> AsyncIterator[tuple[list[Any], int, float]]:
+	for write in writes:
+		yield write
+
+
+async def iterate_in_thread(writes: Iterator[tuple[list[Any], int, float]]) -> AsyncIterator[tuple[list[Any], int, float]]:
+	"""Pull a blocking iterator from a worker thread so the loop stays free."""
+	done = object()
+	while (write := await asyncio.to_thread(next, writes, done)) is not done:
+		yield write
+
+
+async def write_async_response(writer: asyncio.StreamWriter, resp: MockResponse, keep_alive: bool) -> bool:
+	"""Write one response; returns False if the client went away."""
+	started = time.perf_counter()
+	if resp.gate is not None:
+		if (queued_s := await resp.gate.enter_async()) is None:
+			resp = resp.gate.rejection(resp.route)
+		else:
+			resp.headers.append(("x-mock-queue-ms", f"{queued_s * 1000.0:.1f}"))
+	METRICS.response_started(resp)
+	disconnected = False
+	pacer = None
+	try:
+		writer.write(encode_response_head(resp.status, resp.headers, keep_alive))
+		if resp.events is None:
+			if resp.body:
+				writer.write(resp.body)
+			await writer.drain()
+			METRICS.sent(len(resp.body), resp.tokens)
+			return True
+		if resp.blocking:
+			writes = iterate_in_thread(iter_writes(resp))
+		else:
+			writes = iterate_inline(iter_writes(resp))
+		pacer = StreamPacer()
+		async for buffers, tokens, sleep_s in writes:
+			if buffers:
+				writer.writelines(buffers)
+				await writer.drain()
+				nbytes = sum(len(buf) for buf in buffers)
+				METRICS.sent(nbytes, tokens)
+				pacer.sent(nbytes, tokens)
+			if sleep_s > 0 and (wait_s := pacer.wait_s(sleep_s)) > 0:
+				await asyncio.sleep(wait_s)
+		return True
+	except (BrokenPipeError, ConnectionResetError):
+		disconnected = True
+		return False
+	finally:
+		if resp.gate is not None:
+			resp.gate.leave()
+		if pacer is not None:
+			pacer.finish(resp.route)
+		METRICS.response_finished(resp, time.perf_counter() - started, disconnected)
+
+
+async def handle_async_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+	apply_tcp_nodelay(writer.get_extra_info("socket"))
+	try:
+		while True:
+			request_line = await reader.readline()
+			if not request_line:
+				return
+			try:
+				method, target, version = request_line.decode("latin-1").split()
+			except ValueError:
+				writer.write(encode_response_head(400, [("Content-Length", "0")], False))
+				return
+			headers: dict[str, str] = {}
+			for _ in range(MAX_HEADER_LINES):
+				line = await reader.readline()
+				if line in (b"\r\n", b"\n", b""):
+					break
+				name, _, value = line.decode("latin-1").partition(":")
+				headers[name.strip().lower()] = value.strip()
+
+			raw = b""
+			route = route_name(method.upper(), target)
+			body = request_reader(route)
+			if "content-length" in headers or "transfer-encoding" in headers:
+				if headers.get("expect", "").lower() == "100-continue":
+					writer.write(b"HTTP/1.1 100 Continue\r\n\r\n")
+				try:
+					if body is None:
+						raw = b"".join([data async for data in iter_http_body(reader, headers)])
+					else:
+						async for data in iter_http_body(reader, headers):
+							body.feed(data)
+				except ValueError as e:
+					# Bad framing (Content-Length / chunk size): answer 400 like do_POST, then close.
+					await write_async_response(writer, error_response(route, 400, {"message": f"Invalid JSON: {e}"}), False)
+					return
+			if TRANSCRIPTS is not None and TRANSCRIPTS.blocking:
+				resp = await asyncio.to_thread(dispatch, method.upper(), target, raw, headers)
+			else:
+				resp = dispatch(method.upper(), target, raw, headers, body)
+
+			connection = headers.get("connection", "").lower()
+			keep_alive = resp.events is None and (connection == "keep-alive" if version == "HTTP/1.0" else connection != "close")
+			if not await write_async_response(writer, resp, keep_alive) or not keep_alive:
+				return
+	except (BrokenPipeError, ConnectionResetError, asyncio.IncompleteReadError):
+		# Client disconnected; nothing left to answer.
+		return
+	finally:
+		writer.close()
+		try:
+			await writer.wait_closed()
+		except (BrokenPipeError, ConnectionResetError):
+			pass
+
+
+async def serve_asyncio(
+	host: str,
+	port: int,
+	backlog: int,
+	reuse_port: bool = False,
+	unix_sock: socket.socket | None = None,
+	tcp: bool = True,
+) -> None:
+	servers: list[asyncio.Server] = []
+	try:
+		if tcp:
+			servers.append(
+				await asyncio.start_server(
+					handle_async_connection, host, port, backlog=backlog, reuse_address=True, reuse_port=reuse_port or None
+				)
+			)
+		if unix_sock is not None:
+			# The socket file belongs to the parent process (see bind_unix_socket).
+			cleanup = {"cleanup_socket": False} if sys.version_info >= (3, 13) else {}
+			servers.append(await asyncio.start_unix_server(handle_async_connection, sock=unix_sock, **cleanup))
+		await asyncio.gather(*(server.serve_forever() for server in servers))
+	finally:
+		for server in servers:
+			server.close()
+
+
+# ---------------------------------------------------------------------------
+# micro-benchmarks
+# ---------------------------------------------------------------------------
+
+MICROBENCH_SAMPLE = "Mock reply: The quick brown fox 跳过了懒狗 🦊🐶, \"quoted\"\tand\nescaped! "
+
+
+def bench_loop(fn: Callable[[], Any], min_seconds: float) -> float:
+	"""Run fn repeatedly for at least min_seconds; return seconds per call."""
+	fn()
+	calls = 0
+	started = time.perf_counter()
+	while True:
+		fn()
+		calls += 1
+		elapsed = time.perf_counter() - started
+		if elapsed >= min_seconds:
+			return elapsed / calls
+
+
+def microbench_chunk_encoder(tokens: int, top_n: int, min_seconds: float) -> list[dict[str, Any]]:
+	"""Compare per-token json.dumps against ChunkEncoder for one stream of `tokens` tokens."""
+	sample = split_tokens(MICROBENCH_SAMPLE * (tokens // len(MICROBENCH_SAMPLE) + 1))[:tokens]
+	completion_id, created, model = "chatcmpl-mock-0123456789ab", 1700000000, "mock-model"
+	rows: list[dict[str, Any]] = []
+	for with_logprobs in (False, True):
+		rng = random.Random(0)
+		logprobs = [make_logprob_item(t, top_n, rng) for t in sample] if with_logprobs else []
+
+		def reference() -> list[bytes]:
+			out = []
+			for i, token in enumerate(sample):
+				chunk: dict[str, Any] = {
+					"id": completion_id,
+					"object": "chat.completion.chunk",
+					"created": created,
+					"model": model,
+					"choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+				}
+				if with_logprobs:
+					chunk["choices"][0]["logprobs"] = {"content": [logprobs[i]]}
+				out.append(sse_bytes(chunk))
+			return out
+
+		def templated() -> list[bytes]:
+			encoder = ChunkEncoder(completion_id, created, model)
+			return [encoder.content(token, logprobs[i : i + 1] if with_logprobs else None) for i, token in enumerate(sample)]
+
+		if reference() != templated():
+			raise AssertionError("ChunkEncoder output differs from json.dumps output")
+		before = len(sample) / bench_loop(reference, min_seconds)
+		after = len(sample) / bench_loop(templated, min_seconds)
+		rows.append(
+			{
+				"case": f"chunk-encode logprobs={'top' + str(top_n) if with_logprobs else 'off'}",
+				"unit": "tok",
+				"before_per_s": round(before),
+				"after_per_s": round(after),
+				"speedup": round(after / before, 2),
+			}
+		)
+	return rows
+
+
+def synthetic_fount_prompt(size_bytes: int) -> list[dict[str, Any]]:
+	"""A fount-style chat log: one user message wrapping many transport-marked turns."""
+	turn = (
+		'<message owner="char">\n<sender>Alice</sender>\n<content><p>The quick brown fox 跳过了懒狗 🦊🐶, '
+		"and the <b>lazy</b> dog barks back at the moon.</p>\n<p>Second paragraph of the reply.</p></content>\n</message>\n"
+	)
+	log = turn * (size_bytes // len(turn.encode("utf-8")) + 1)
+	last = '<message owner="user"><sender>Bob</sender><content><p>Hi 你好😀</p></content></message>'
+	return [{"role": "system", "content": "You are a helpful character."}, {"role": "user", "content": log + last}]
+
+
+def microbench_prompt(prompt_mb: float, min_seconds: float) -> list[dict[str, Any]]:
+	"""Markup stripping and prompt usage over a synthetic multi-megabyte fount prompt."""
+	messages = synthetic_fount_prompt(int(prompt_mb * 1024 * 1024))
+	user_text = messages[-1]["content"]
+	size_mb = sum(len(m["content"].encode("utf-8")) for m in messages) / (1024 * 1024)
+
+	def reference_strip() -> str:
+		text = user_text
+		content_blocks = re.findall(r"<content>([\s\S]*?)</content>", text, flags=re.IGNORECASE)
+		if content_blocks:
+			text = content_blocks[-1]
+		text = re.sub(r"</sender>\s*<content>", "\n", text, flags=re.IGNORECASE)
+		text = re.sub(r"</content>\s*</message[^>]*>", "", text, flags=re.IGNORECASE)
+		text = re.sub(r"</?message[^>]*>", "", text, flags=re.IGNORECASE)
+		text = re.sub(r"</?sender[^>]*>", "", text, flags=re.IGNORECASE)
+		text = re.sub(r"</?content[^>]*>", "", text, flags=re.IGNORECASE)
+		text = re.sub(r"</?p[^>]*>", "", text, flags=re.IGNORECASE)
+		text = re.sub(r"<[^>]+>", "", text)
+		return text.strip()
+
+	def stripped() -> str:
+		return strip_transport_markup(user_text)
+
+	def reference_usage() -> int:
+		completion = count_tokens("Mock reply: Hi 你好😀")
+		return count_prompt_tokens(messages) + completion + count_prompt_tokens(messages)
+
+	def usage() -> int:
+		return count_prompt_tokens(messages) + count_tokens("Mock reply: Hi 你好😀")
+
+	if reference_strip() != stripped():
+		raise AssertionError("single-pass stripper output differs from the per-tag re.sub passes")
+	rows: list[dict[str, Any]] = []
+	for case, reference, current in (("strip-markup", reference_strip, stripped), ("prompt-usage", reference_usage, usage)):
+		before = size_mb / bench_loop(reference, min_seconds)
+		after = size_mb / bench_loop(current, min_seconds)
+		rows.append(
+			{
+				"case": f"{case} {size_mb:.1f}MB",
+				"unit": "MB",
+				"before_per_s": round(before, 1),
+				"after_per_s": round(after, 1),
+				"speedup": round(after / before, 2),
+			}
+		)
+	return rows
+
+
+def run_microbench(args: argparse.Namespace) -> None:
+	rows = microbench_chunk_encoder(args.tokens, args.top_logprobs, args.min_seconds)
+	rows += microbench_prompt(args.prompt_mb, args.min_seconds)
+	if args.json:
+		print(json.dumps(rows, ensure_ascii=False, indent=2))
+		return
+	print(f"{'case':<36} {'before/s':>14} {'after/s':>14} {'speedup':>8}")
+	for row in rows:
+		before = f"{row['before_per_s']} {row['unit']}"
+		after = f"{row['after_per_s']} {row['unit']}"
+		print(f"{row['case']:<36} {before:>14} {after:>14} {row['speedup']:>7}x")
+
+
+# ---------------------------------------------------------------------------
+# self-test
+# ---------------------------------------------------------------------------
+
+
+class QuietMockHandler(OpenAIMockHandler):
+	def log_message(self, format: str, *args: Any) -> None:  # noqa: A002
+		pass
+
+
+class SelfTestServer:
+	"""Threading-engine server on a free loopback port, for the self-test checks."""
+
+	def __init__(self) -> None:
+		self.server = ThreadingHTTPServer(("127.0.0.1", 0), QuietMockHandler)
+		self.port = self.server.server_address[1]
+		threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+	def __enter__(self) -> SelfTestServer:
+		return self
+
+	def __exit__(self, *exc: object) -> None:
+		self.server.shutdown()
+		self.server.server_close()
+
+	def stream(self, body: dict[str, Any]) -> tuple[int, list[float]]:
+		"""POST a streamed chat request; returns (status, arrival time of each content chunk)."""
+		conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=30)
+		try:
+			conn.request("POST", "/v1/chat/completions", json.dumps({"stream": True, **body}), {"Content-Type": "application/json"})
+			resp = conn.getresponse()
+			arrivals: list[float] = []
+			for line in resp:
+				if not line.startswith(b"data: {"):
+					continue
+				choices = json.loads(line[6:]).get("choices") or [{}]
+				if (choices[0].get("delta") or {}).get("content"):
+					arrivals.append(time.perf_counter())
+			return resp.status, arrivals
+		finally:
+			conn.close()
+
+
+def self_test_profile_pacing() -> str | None:
+	"""tokens_per_s profiles pace at that rate, including fractional and sub-millisecond per-token delays."""
+	global PROFILES
+	saved = PROFILES
+	PROFILES = ProfileRegistry({"slow": {"tokens_per_s": 150}, "fast": {"tokens_per_s": 2000}})
+	try:
+		with SelfTestServer() as server:
+			for model, tokens_per_s, tokens in (("slow", 150, 150), ("fast", 2000, 600)):
+				status, arrivals = server.stream({"model": model, "messages": [{"role": "user", "content": "x" * tokens}]})
+				if status != 200 or len(arrivals) < tokens:
+					return f"profile {model}: status {status}, {len(arrivals)} content chunks"
+				rate = (len(arrivals) - 1) / (arrivals[-1] - arrivals[0])
+				if abs(rate / tokens_per_s - 1) > 0.07:
+					return f"profile {model}: measured {rate:.0f} tok/s, expected {tokens_per_s}"
+	finally:
+		PROFILES = saved
+	return None
+
+
+def self_test_queue_limit() -> str | None:
+	"""max_queue holds under concurrent arrivals, in the gate itself and through the threading engine."""
+	gate = ConcurrencyGate("gate", 1, 1)
+	if gate.enter() is None:
+		return "gate: first request refused"
+	start = threading.Barrier(33)
+	results: list[float | None] = []
+
+	def arrive() -> None:
+		start.wait()
+		results.append(gate.enter())
+
+	threads = [threading.Thread(target=arrive) for _ in range(32)]
+	for thread in threads:
+		thread.start()
+	start.wait()
+	deadline = time.monotonic() + 5
+	while len(results) < 31 and time.monotonic() < deadline:
+		time.sleep(0.01)
+	if results.count(None) != 31 or gate.queued != 1:
+		return f"gate: {results.count(None)} of 32 refused, {gate.queued} queued (want 31 and 1)"
+	gate.leave()  # the queued request takes the slot
+	for thread in threads:
+		thread.join(5)
+	gate.leave()
+	if gate.active or gate.queued:
+		return f"gate: {gate.active} active / {gate.queued} queued after everyone left"
+
+	global PROFILES
+	saved = PROFILES
+	PROFILES = ProfileRegistry({"queued": {"max_concurrency": 1, "max_queue": 1, "tokens_per_s": 100}})
+	statuses: list[int] = []
+	try:
+		with SelfTestServer() as server:
+			body = {"model": "queued", "messages": [{"role": "user", "content": "x" * 20}]}
+			threads = [threading.Thread(target=lambda: statuses.append(server.stream(body)[0])) for _ in range(8)]
+			for thread in threads:
+				thread.start()
+			for thread in threads:
+				thread.join(30)
+	finally:
+		PROFILES = saved
+	if sorted(statuses) != [200, 200] + [429] * 6:
+		return f"server: statuses {sorted(statuses)}, want 2 x 200 and 6 x 429"
+	return None
+
+
+def self_test_record_faults() -> str | None:
+	"""--record stores complete streams only: a mock_cut_after_tokens stream is not persisted."""
+	global TRANSCRIPTS
+	saved = TRANSCRIPTS
+	with tempfile.TemporaryDirectory() as directory:
+		TRANSCRIPTS = TranscriptStore(directory, "record")
+		try:
+			with SelfTestServer() as server:
+				for content, cut in (("cut", 3), ("whole", 0)):
+					status, arrivals = server.stream({"messages": [{"role": "user", "content": content}], "mock_delay_ms": 0, "mock_cut_after_tokens": cut})
+					if status != 200 or (len(arrivals) != 3 if cut else len(arrivals) <= 3):
+						return f"{content}: status {status}, {len(arrivals)} content chunks"
+				# The whole stream is appended once the engine has written its last event.
+				deadline = time.monotonic() + 5
+				while not os.path.exists(TRANSCRIPTS.index_path) and time.monotonic() < deadline:
+					time.sleep(0.01)
+		finally:
+			TRANSCRIPTS = saved
+		stored = len(TranscriptStore(directory, "replay")) if os.path.exists(os.path.join(directory, "transcripts.idx")) else 0
+	if stored != 1:
+		return f"{stored} transcripts recorded, want 1 (the cut stream must not be stored)"
+	return None
+
+
+SELF_TEST_BODIES: list[str] = [
+	json.dumps({"model": "m", "messages": [{"role": "user", "content": "hi"}]}),
+	json.dumps(
+		{
+			"model": "gpt-4o",
+			"stream": True,
+			"temperature": -1.5e-3,
+			"stop": None,
+			"n": 2,
+			"metadata": {"nested": [1, [2, {"x": False}]], "empty": {}},
+			"messages": [
+				{"role": "system", "content": "你好，世界 👨\u200d👩\u200d👧 \"quoted\" \\ back"},
+				{"role": "user", "content": [{"type": "text", "text": "part one "}, {"type": "image_url", "image_url": {"url": "data:;base64,AAAA"}}, {"type": "text", "text": "émoji 😀"}]},
+				{"role": "assistant", "content": None, "tool_calls": [{"id": "c1", "type": "function", "function": {"name": "f", "arguments": "{\"a\": [1, 2]}"}}]},
+				{"role": "tool", "tool_call_id": "c1", "content": "done"},
+				{"role": "user", "content": "last\nline\ttab"},
+				{"role": "assistant", "content": "trailing reply"},
+			],
+			"tools": [],
+		},
+		ensure_ascii=False,
+		indent="\t",
+	),
+	'{ "messages" : [ ] , "model" : "\\u00e9 \\ud83d\\ude00" , "seed" : 7 }',
+	'{"messages":[{"role":"user","content":"\\ud83d\\ude00\\u00e9\\/"}],"x":[true,false,null,0,-0.0,1E+2]}',
+]
+SELF_TEST_BAD_BODIES: list[str] = [
+	'{"a":1,',
+	'{"a" 1}',
+	'{"messages":[{"role":"user","content":"x"}',
+	'{"a":tru}',
+	'{"a":"\\x"}',
+	'{"a":1} x',
+	'{"a":01}',
+	'{"messages":[{"role":"user","content":"a\nb"}]}',
+]
+
+
+def parse_in_chunks(body: bytes, sizes: Iterator[int]) -> tuple[dict[str, Any], PromptSummary] | str:
+	reader = ChatRequestReader()
+	pos = 0
+	while pos < len(body):
+		size = next(sizes)
+		reader.feed(body[pos : pos + size])
+		pos += size
+	try:
+		return reader.close()
+	except ValueError as e:
+		return str(e)
+
+
+def self_test_request_parser() -> str | None:
+	"""ChatRequestReader matches json.loads + PromptSummary.of for any chunking, and json.loads' error messages."""
+	rng = random.Random(9)
+	for number, text in enumerate(SELF_TEST_BODIES):
+		body = text.encode("utf-8")
+		doc = json.loads(text)
+		summary = PromptSummary.of(doc.get("messages"))
+		want = ({key: value for key, value in doc.items() if key != "messages"}, summary.tokens, summary.last_user_text)
+		chunkings = [("whole", iter((len(body),)))]
+		chunkings += [(f"split at {at}", iter((at, len(body)))) for at in range(1, len(body))]
+		chunkings += [(f"random chunks #{trial}", iter(lambda: rng.randint(1, 7), None)) for trial in range(20)]
+		for label, sizes in chunkings:
+			result = parse_in_chunks(body, sizes)
+			if isinstance(result, str):
+				return f"body {number}, {label}: {result}"
+			req, prompt = result
+			if (req, prompt.tokens, prompt.last_user_text) != want:
+				return f"body {number}, {label}: got {(req, prompt.tokens, prompt.last_user_text)!r}, want {want!r}"
+	for text in SELF_TEST_BAD_BODIES:
+		try:
+			json.loads(text)
+		except ValueError as e:
+			expected = str(e)
+		body = text.encode("utf-8")
+		for label, sizes in (("whole", iter((len(body),))), ("bytewise", iter(lambda: 1, None))):
+			result = parse_in_chunks(body, sizes)
+			if result != expected:
+				return f"{text!r} ({label}): {result!r}, json.loads says {expected!r}"
+	return None
+
+
+def self_test_bpe() -> str | None:
+	"""BPE pieces round-trip to the input text, and count() matches encode() (including windowed counts)."""
+	tokenizer = BPETokenizer.load()
+	texts = [
+		"The quick brown fox jumps over the lazy dog. It's 2024; we'll see 1,234,567 tokens!",
+		"深度学习模型的分词器需要正确处理中文、日本語のテキスト、그리고 한국어.",
+		"Family 👨‍👩‍👧‍👦, flags 🇯🇵🇺🇳, skin tones 👍🏽 and keycaps 1️⃣ stay whole.",
+		"def f(x):\n\tif x  >=  0:\n\t\treturn {'a': [1, 2]}\n\n\n    # trailing   \n",
+		"",
+		" ",
+		"emoji😀glued中文glued123glued",
+		("lorem ipsum 多语言 😀 " * 4000) + "tail",
+	]
+	for text in texts:
+		pieces = tokenizer.pieces(text)
+		ids = tokenizer.encode(text)
+		label = repr(text[:24])
+		if "".join(pieces) != text:
+			return f"{label}: pieces do not round-trip"
+		if b"".join(tokenizer.vocab[tid] for tid in ids) != text.encode("utf-8"):
+			return f"{label}: token bytes do not round-trip"
+		if tokenizer.count(text) != len(ids):
+			return f"{label}: count() {tokenizer.count(text)} != {len(ids)} tokens"
+		if not len(text.encode("utf-8")) >= len(ids) >= len(pieces) >= (1 if text else 0):
+			return f"{label}: {len(ids)} tokens, {len(pieces)} pieces for {len(text)} chars"
+	if len(tokenizer.encode("hello world")) >= len("hello world"):
+		return "merges not applied to plain English"
+	return None
+
+
+SELF_TEST_BAD_FRAMING: list[bytes] = [
+	b"POST /v1/chat/completions HTTP/1.1\r\nHost: x\r\nContent-Length: abc\r\n\r\n{}",
+	b"POST /v1/chat/completions HTTP/1.1\r\nHost: x\r\nTransfer-Encoding: chunked\r\n\r\nzz\r\n{}\r\n0\r\n\r\n",
+]
+
+
+def self_test_bad_framing() -> str | None:
+	"""A bad Content-Length or chunk size gets a 400 from both engines, not a silently closed socket."""
+
+	async def asyncio_replies() -> list[bytes]:
+		server = await asyncio.start_server(handle_async_connection, "127.0.0.1", 0)
+		port = server.sockets[0].getsockname()[1]
+		replies = []
+		try:
+			for request in SELF_TEST_BAD_FRAMING:
+				reader, writer = await asyncio.open_connection("127.0.0.1", port)
+				writer.write(request)
+				replies.append(await asyncio.wait_for(reader.read(), 5))
+				writer.close()
+		finally:
+			server.close()
+		return replies
+
+	def threading_replies() -> list[bytes]:
+		replies = []
+		with SelfTestServer() as server:
+			for request in SELF_TEST_BAD_FRAMING:
+				with socket.create_connection(("127.0.0.1", server.port), timeout=5) as sock:
+					sock.sendall(request)
+					replies.append(b"".join(iter(lambda: sock.recv(65536), b"")))
+		return replies
+
+	for engine, replies in (("threading", threading_replies()), ("asyncio", asyncio.run(asyncio_replies()))):
+		for request, reply in zip(SELF_TEST_BAD_FRAMING, replies):
+			if not reply.startswith(b"HTTP/1.1 400 ") or b'"Invalid JSON: ' not in reply:
+				framing = request.splitlines()[2]
+				return f"{engine}: {framing!r} got {reply[:80]!r}, want a 400 error"
+	return None
+
+
+SELF_TESTS: list[Callable[[], str | None]] = [
+	self_test_request_parser,
+	self_test_bpe,
+	self_test_profile_pacing,
+	self_test_queue_limit,
+	self_test_record_faults,
+	self_test_bad_framing,
+]
+
+
+def run_self_test(args: argparse.Namespace) -> int:
+	"""Run every SELF_TESTS check; each returns None or a failure message."""
+	global TOKENIZER
+	TOKENIZER = CharTokenizer()
+	MOCK_DEFAULTS.update(mock_ttft_ms=0)
+	failures = 0
+	for check in SELF_TESTS:
+		started = time.perf_counter()
+		error = check()
+		status = "ok" if error is None else f"FAIL: {error}"
+		print(f"[mock-openai] self-test {check.__name__}: {status} ({time.perf_counter() - started:.2f}s)", file=sys.stderr if error else sys.stdout)
+		failures += error is not None
+	print(json.dumps({"ok": not failures, "checks": len(SELF_TESTS), "failed": failures}))
+	return 1 if failures else 0
+
+
+# ---------------------------------------------------------------------------
+# load generator (bench subcommand)
+# ---------------------------------------------------------------------------
+
+
+class StreamResult:
+	__slots__ = ("ok", "error", "started", "ttft_s", "gaps_s", "tokens", "finished")
+
+	def __init__(self, started: float) -> None:
+		self.ok = False
+		self.error = ""
+		self.started = started
+		self.ttft_s: float | None = None
+		self.gaps_s: list[float] = []
+		self.tokens = 0
+		self.finished = started
+
+
+BENCH_PROTOCOLS = ("openai", "anthropic", "gemini")
+
+
+def resolve_bench_target(url: str, protocol: str = "openai", model: str = "mock-model") -> tuple[str, str, int, str]:
+	"""
+	Return (scheme, host, port, path); bare base URLs get the protocol's
+	streaming endpoint appended (/v1/chat/completions, /v1/messages or
+	/v1beta/models/{model}:streamGenerateContent?alt=sse).
+	"""
+	parts = urlsplit(url if "://" in url else f"http://{url}")
+	scheme = parts.scheme or "http"
+	port = parts.port or (443 if scheme == "https" else 80)
+	path = parts.path.rstrip("/")
+	query = parts.query
+	if protocol == "gemini":
+		if ":streamGenerateContent" not in path:
+			base = path if re.search(r"/v1(?:alpha|beta)?$", path) else f"{path}/v1beta"
+			path = f"{base}/models/{model}:streamGenerateContent"
+		if "alt=" not in query:
+			query = f"{query}&alt=sse" if query else "alt=sse"
+	else:
+		endpoint = "/messages" if protocol == "anthropic" else "/chat/completions"
+		if not path.endswith(endpoint):
+			path = (path if path.endswith("/v1") else f"{path}/v1") + endpoint
+	if query:
+		path = f"{path}?{query}"
+	return scheme, parts.hostname or "127.0.0.1", port, path
+
+
+def bench_request_body(protocol: str, model: str, prompt: str) -> dict[str, Any]:
+	if protocol == "anthropic":
+		return {"model": model, "max_tokens": 4096, "stream": True, "messages": [{"role": "user", "content": prompt}]}
+	if protocol == "gemini":
+		return {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+	return {"model": model, "stream": True, "messages": [{"role": "user", "content": prompt}]}
+
+
+def bench_auth_headers(protocol: str, api_key: str) -> list[str]:
+	if protocol == "anthropic":
+		return [f"x-api-key: {api_key}", "anthropic-version: 2023-06-01"]
+	if protocol == "gemini":
+		return [f"x-goog-api-key: {api_key}"]
+	return [f"Authorization: Bearer {api_key}"]
+
+
+def read_bench_chunk(protocol: str, chunk: dict[str, Any]) -> tuple[bool, int | None, bool]:
+	"""(carries content, reported completion tokens or None, marks a finished stream) for one SSE payload."""
+	if protocol == "anthropic":
+		kind = chunk.get("type")
+		if kind == "content_block_delta":
+			return bool((chunk.get("delta") or {}).get("text")), None, False
+		if kind == "message_delta":
+			usage = chunk.get("usage") or {}
+			return False, int(usage["output_tokens"]) if "output_tokens" in usage else None, False
+		return False, None, kind == "message_stop"
+	if protocol == "gemini":
+		candidates = chunk.get("candidates") or []
+		content = any(part.get("text") for candidate in candidates for part in (candidate.get("content") or {}).get("parts") or [])
+		usage = chunk.get("usageMetadata") or {}
+		tokens = int(usage["candidatesTokenCount"]) if "candidatesTokenCount" in usage else None
+		return content, tokens, any(candidate.get("finishReason") for candidate in candidates)
+	usage = chunk.get("usage")
+	tokens = int(usage["completion_tokens"]) if isinstance(usage, dict) and "completion_tokens" in usage else None
+	return any((choice.get("delta") or {}).get("content") for choice in chunk.get("choices") or []), tokens, False
+
+
+async def iter_http_body(reader: asyncio.StreamReader, headers: dict[str, str]) -> AsyncIterator[bytes]:
+	"""Yield raw body bytes, honouring chunked / Content-Length / read-until-close framing."""
+	if "chunked" in headers.get("transfer-encoding", "").lower():
+		while True:
+			size_line = await reader.readline()
+			if not size_line:
+				raise ConnectionResetError("connection closed inside chunked body")
+			size = int(size_line.split(b";", 1)[0].strip() or b"0", 16)
+			if size == 0:
+				await reader.readline()
+				return
+			yield await reader.readexactly(size)
+			await reader.readexactly(2)
+	if "content-length" in headers:
+		remaining = int(headers["content-length"])
+		while remaining > 0:
+			data = await reader.read(min(remaining, 65536))
+			if not data:
+				raise ConnectionResetError("connection closed before Content-Length was reached")
+			remaining -= len(data)
+			yield data
+		return
+	while data := await reader.read(65536):
+		yield data
+
+
+async def bench_one_stream(
+	target: tuple[str, str, int, str],
+	request_bytes: bytes,
+	timeout_s: float,
+	unix: str | None = None,
+	protocol: str = "openai",
+) -> StreamResult:
+	result = StreamResult(time.perf_counter())
+	writers: list[asyncio.StreamWriter] = []
+	try:
+		await asyncio.wait_for(read_bench_stream(target, request_bytes, result, writers, unix, protocol), timeout_s)
+		if not result.ok and not result.error:
+			result.error = "incomplete_stream"
+	except asyncio.TimeoutError:
+		result.error = "timeout"
+	except (OSError, asyncio.IncompleteReadError) as e:
+		result.error = f"disconnect:{type(e).__name__}" if writers else "connect"
+	except (ValueError, IndexError):
+		result.error = "bad_response"
+	finally:
+		result.finished = time.perf_counter()
+		for writer in writers:
+			writer.close()
+	return result
+
+
+async def read_bench_stream(
+	target: tuple[str, str, int, str],
+	request_bytes: bytes,
+	result: StreamResult,
+	writers: list[asyncio.StreamWriter],
+	unix: str | None = None,
+	protocol: str = "openai",
+) -> None:
+	scheme, host, port, _ = target
+	if unix:
+		reader, writer = await asyncio.open_unix_connection(unix)
+	else:
+		reader, writer = await asyncio.open_connection(host, port, ssl=scheme == "https" or None)
+	writers.append(writer)
+	writer.write(request_bytes)
+	await writer.drain()
+
+	status_line = await reader.readline()
+	status = int(status_line.split()[1]) if status_line else 0
+	headers: dict[str, str] = {}
+	while (line := await reader.readline()) not in (b"\r\n", b"\n", b""):
+		name, _, value = line.decode("latin-1").partition(":")
+		headers[name.strip().lower()] = value.strip()
+	if status != 200:
+		result.error = f"http_{status}" if status else "bad_response"
+		return
+
+	buffer = b""
+	last_event: float | None = None
+	usage_tokens: int | None = None
+	events = 0
+	async for data in iter_http_body(reader, headers):
+		buffer += data
+		*lines, buffer = buffer.split(b"\n")
+		for line in lines:
+			if not line.startswith(b"data:"):
+				continue
+			payload = line[5:].strip()
+			if payload == b"[DONE]":
+				result.ok = True
+				continue
+			content, tokens, done = read_bench_chunk(protocol, json.loads(payload))
+			if tokens is not None:
+				usage_tokens = tokens
+			if done:
+				result.ok = True
+			if not content:
+				continue
+			now = time.perf_counter()
+			if last_event is None:
+				result.ttft_s = now - result.started
+			else:
+				result.gaps_s.append(now - last_event)
+			last_event = now
+			events += 1
+	result.tokens = usage_tokens if usage_tokens is not None else events
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+	"""Linear-interpolated percentile of an already sorted list."""
+	if not sorted_values:
+		return 0.0
+	pos = (len(sorted_values) - 1) * q
+	low = int(pos)
+	high = min(low + 1, len(sorted_values) - 1)
+	return sorted_values[low] + (sorted_values[high] - sorted_values[low]) * (pos - low)
+
+
+def latency_summary_ms(values_s: list[float]) -> dict[str, float]:
+	values = sorted(v * 1000.0 for v in values_s)
+	return {
+		"count": len(values),
+		"mean": round(sum(values) / len(values), 3) if values else 0.0,
+		"p50": round(percentile(values, 0.50), 3),
+		"p95": round(percentile(values, 0.95), 3),
+		"p99": round(percentile(values, 0.99), 3),
+		"max": round(values[-1], 3) if values else 0.0,
+	}
+
+
+async def run_bench_async(args: argparse.Namespace) -> dict[str, Any]:
+	target = resolve_bench_target(args.url, args.protocol, args.model)
+	scheme, host, port, path = target
+	body = bench_request_body(args.protocol, args.model, args.prompt)
+	if args.body:
+		body.update(json.loads(args.body))
+	payload = json.dumps(body, ensure_ascii=False).encode("utf-8")
+	head = [
+		f"POST {path} HTTP/1.1",
+		f"Host: {host}:{port}",
+		"Content-Type: application/json",
+		"Accept: text/event-stream",
+		f"Content-Length: {len(payload)}",
+		"Connection: close",
+	]
+	if args.api_key:
+		head += bench_auth_headers(args.protocol, args.api_key)
+	request_bytes = ("\r\n".join(head) + "\r\n\r\n").encode("latin-1") + payload
+
+	results: list[StreamResult] = []
+	started = time.perf_counter()
+	deadline = started + args.duration
+
+	async def worker() -> None:
+		while time.perf_counter() < deadline:
+			results.append(await bench_one_stream(target, request_bytes, args.timeout, args.unix, args.protocol))
+
+	await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+	elapsed = time.perf_counter() - started
+
+	ok = [r for r in results if r.ok]
+	errors: dict[str, int] = {}
+	for r in results:
+		if not r.ok:
+			errors[r.error] = errors.get(r.error, 0) + 1
+	tokens = sum(r.tokens for r in ok)
+	return {
+		"target": f"unix:{args.unix} {path}" if args.unix else f"{scheme}://{host}:{port}{path}",
+		"concurrency": args.concurrency,
+		"duration_s": round(elapsed, 3),
+		"requests": len(results),
+		"ok": len(ok),
+		"errors": dict(sorted(errors.items())),
+		"requests_per_s": round(len(results) / elapsed, 3) if elapsed else 0.0,
+		"tokens": tokens,
+		"tokens_per_s": round(tokens / elapsed, 3) if elapsed else 0.0,
+		"ttft_ms": latency_summary_ms([r.ttft_s for r in ok if r.ttft_s is not None]),
+		"itl_ms": latency_summary_ms([gap for r in ok for gap in r.gaps_s]),
+		"stream_ms": latency_summary_ms([r.finished - r.started for r in ok]),
+	}
+
+
+def format_bench_report(report: dict[str, Any]) -> str:
+	lines = [
+		f"target       {report['target']}",
+		f"concurrency  {report['concurrency']}    duration {report['duration_s']}s",
+		f"requests     {report['requests']} ({report['ok']} ok, {report['requests_per_s']}/s)",
+		f"tokens       {report['tokens']} ({report['tokens_per_s']} tok/s)",
+		f"errors       {', '.join(f'{k}={v}' for k, v in report['errors'].items()) or 'none'}",
+		"",
+		f"{'latency (ms)':<14} {'count':>8} {'mean':>10} {'p50':>10} {'p95':>10} {'p99':>10} {'max':>10}",
+	]
+	for label, key in (("ttft", "ttft_ms"), ("inter-token", "itl_ms"), ("stream total", "stream_ms")):
+		row = report[key]
+		lines.append(f"{label:<14} {row['count']:>8} {row['mean']:>10} {row['p50']:>10} {row['p95']:>10} {row['p99']:>10} {row['max']:>10}")
+	return "\n".join(lines)
+
+
+def run_bench(args: argparse.Namespace) -> None:
+	raise_nofile_limit()
+	report = asyncio.run(run_bench_async(args))
+	if args.output:
+		with open(args.output, "w", encoding="utf-8") as f:
+			json.dump(report, f, ensure_ascii=False, indent=2)
+	print(json.dumps(report, ensure_ascii=False, indent=2) if args.json else format_bench_report(report))
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+	"""ThreadingHTTPServer's AF_UNIX twin, serving an already bound and listening socket."""
+
+	daemon_threads = True
+
+	def __init__(self, sock: socket.socket) -> None:
+		super().__init__(sock.getsockname(), OpenAIMockHandler, bind_and_activate=False)
+		self.socket.close()
+		self.socket = sock
+
+
+def bind_unix_socket(path: str, backlog: int) -> socket.socket:
+	"""
+	Bind and listen on an AF_UNIX path. Done once in the parent, before
+	--workers forks, so every worker accepts on the same socket (AF_UNIX has
+	no SO_REUSEPORT). A stale socket file is replaced; anything else is not.
+	"""
+	if not hasattr(socket, "AF_UNIX"):
+		raise SystemExit("[mock-openai] --unix needs AF_UNIX sockets")
+	try:
+		if stat.S_ISSOCK(os.stat(path).st_mode):
+			os.unlink(path)
+		else:
+			raise SystemExit(f"[mock-openai] --unix {path}: exists and is not a socket")
+	except FileNotFoundError:
+		pass
+	sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+	try:
+		sock.bind(path)
+		sock.listen(backlog)
+	except OSError:
+		sock.close()
+		raise
+	return sock
+
+
+def run_engine(args: argparse.Namespace, reuse_port: bool = False, unix_sock: socket.socket | None = None) -> None:
+	if args.engine == "asyncio":
+		try:
+			asyncio.run(serve_asyncio(args.host, args.port, args.backlog, reuse_port, unix_sock, tcp=not args.no_tcp))
+		except KeyboardInterrupt:
+			pass
+		return
+
+	servers: list[socketserver.BaseServer] = []
+	try:
+		if unix_sock is not None:
+			servers.append(ThreadingUnixHTTPServer(unix_sock))
+		if not args.no_tcp:
+			server = ThreadingHTTPServer((args.host, args.port), OpenAIMockHandler, bind_and_activate=False)
+			server.request_queue_size = args.backlog
+			servers.append(server)
+			if reuse_port:
+				server.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+			server.server_bind()
+			server.server_activate()
+	except Exception:
+		for server in servers:
+			server.server_close()
+		raise
+	try:
+		for server in servers[:-1]:
+			threading.Thread(target=server.serve_forever, daemon=True).start()
+		servers[-1].serve_forever()
+	except KeyboardInterrupt:
+		pass
+	finally:
+		for server in servers:
+			server.server_close()
+
+
+def run_workers(args: argparse.Namespace, unix_sock: socket.socket | None = None) -> None:
+	"""Fork --workers processes that share the port through SO_REUSEPORT (and the inherited --unix socket)."""
+	if not hasattr(os, "fork") or not hasattr(socket, "SO_REUSEPORT"):
+		raise SystemExit("[mock-openai] --workers needs fork() and SO_REUSEPORT (Linux / BSD / macOS)")
+	METRICS.share(args.workers)
+	children: list[int] = []
+	for index in range(args.workers):
+		pid = os.fork()
+		if pid == 0:
+			code = 0
+			try:
+				METRICS.claim_row(index)
+				seed_faults(args.fault_seed, index)
+				run_engine(args, reuse_port=True, unix_sock=unix_sock)
+			except BaseException as e:  # noqa: BLE001 — never fall back into the parent's loop
+				if not isinstance(e, KeyboardInterrupt):
+					print(f"[mock-openai] worker {index} failed: {e}", file=sys.stderr)
+					code = 1
+			finally:
+				os._exit(code)
+		children.append(pid)
+	print(f"[mock-openai] workers:  {args.workers} (pids {', '.join(map(str, children))})")
+
+	try:
+		for pid in children:
+			os.waitpid(pid, 0)
+	except KeyboardInterrupt:
+		pass
+	finally:
+		for pid in children:
+			try:
+				os.kill(pid, signal.SIGTERM)
+			except ProcessLookupError:
+				pass
+		for pid in children:
+			try:
+				os.waitpid(pid, 0)
+			except ChildProcessError:
+				pass
+
+
+def flush_spec(value: str) -> str:
+	try:
+		FlushPolicy.parse(value)
+	except ValueError as e:
+		raise argparse.ArgumentTypeError(str(e)) from None
+	return value
+
+
+def run_build_vocab(args: argparse.Namespace) -> None:
+	texts = list(vocab_corpus(os.path.abspath(args.root)))
+	print(f"[mock-openai] corpus: {len(texts)} texts, {sum(map(len, texts))} chars")
+	started = time.perf_counter()
+	merges = train_bpe(texts, args.merges)
+	with open(args.output, "w", encoding="utf-8") as f:
+		json.dump({"format": VOCAB_FORMAT, "merges": merges}, f, separators=(",", ":"))
+	print(f"[mock-openai] wrote {len(merges)} merges to {args.output} in {time.perf_counter() - started:.1f}s")
+
+
+def serve(args: argparse.Namespace) -> None:
+	MOCK_DEFAULTS.update(
+		mock_delay_ms=args.delay_ms,
+		mock_ttft_ms=args.ttft_ms,
+		mock_jitter_ms=args.jitter_ms,
+		mock_latency_dist=args.latency_dist,
+		mock_chunk_tokens=args.chunk_tokens,
+		mock_error_rate=args.error_rate,
+		mock_error_status=args.error_status,
+		mock_retry_after_s=args.retry_after,
+		mock_cut_after_tokens=args.cut_after_tokens,
+		mock_stall_rate=args.stall_rate,
+		mock_stall_ms=args.stall_ms,
+		mock_write_bps=args.write_bps,
+		mock_embedding_dim=args.embedding_dim,
+		mock_tool_args_bytes=args.tool_args_bytes,
+		mock_time_scale=0.0 if args.no_sleep else max(0.0, args.time_scale),
+		mock_flush=args.flush,
+		mock_reply=args.reply,
+	)
+	global TCP_NODELAY, PACING_TRACE_FD
+	TCP_NODELAY = {"on": True, "off": False}.get(args.tcp_nodelay)
+	if args.pacing_trace:
+		PACING_TRACE_FD = open_pacing_trace(args.pacing_trace)
+	seed_faults(args.fault_seed)
+	global TRANSCRIPTS
+	if args.record:
+		TRANSCRIPTS = TranscriptStore(args.record, "record", upstream=args.upstream, upstream_key=args.upstream_key)
+	elif args.replay:
+		try:
+			TRANSCRIPTS = TranscriptStore(args.replay, "replay", timing=args.replay_timing)
+		except FileNotFoundError as e:
+			raise SystemExit(f"[mock-openai] no transcript store to replay: {e.filename}")
+	elif args.upstream:
+		raise SystemExit("[mock-openai] --upstream needs --record DIR")
+	global PROFILES
+	if args.profiles:
+		try:
+			PROFILES = ProfileRegistry.load(args.profiles)
+		except (OSError, ValueError) as e:
+			raise SystemExit(f"[mock-openai] --profiles {args.profiles}: {e}")
+	global TOKENIZER
+	TOKENIZER = CharTokenizer() if args.tokenizer == "char" else BPETokenizer.load(args.vocab)
+	raise_nofile_limit()
+	if args.no_tcp and not args.unix:
+		raise SystemExit("[mock-openai] --no-tcp needs --unix PATH")
+	unix_sock = bind_unix_socket(args.unix, args.backlog) if args.unix else None
+	if not args.no_tcp:
+		print(f"[mock-openai] listening on http://{args.host}:{args.port} ({args.engine})")
+	if args.unix:
+		print(f"[mock-openai] listening on unix:{args.unix} ({args.engine})")
+	print("[mock-openai] endpoint: POST /v1/chat/completions")
+	print("[mock-openai] endpoint: POST /v1/embeddings")
+	print("[mock-openai] endpoint: POST /v1/messages")
+	print("[mock-openai] endpoint: POST /v1beta/models/{model}:generateContent | :streamGenerateContent")
+	print("[mock-openai] models:   GET  /v1/models")
+	if PROFILES is not None:
+		print(f"[mock-openai] profiles: {len(PROFILES.profiles)} from {args.profiles} ({', '.join(p.pattern for p in PROFILES.profiles)})")
+	print("[mock-openai] health:   GET  /health")
+	print("[mock-openai] metrics:  GET  /metrics")
+	if args.pacing_trace:
+		print(f"[mock-openai] pacing:   trace -> {args.pacing_trace}")
+	if isinstance(TOKENIZER, BPETokenizer):
+		print(f"[mock-openai] tokens:   bpe ({len(TOKENIZER.vocab)} ids, {args.vocab})")
+	if args.record:
+		print(f"[mock-openai] record:   {args.record}" + (f" (proxy -> {args.upstream})" if args.upstream else ""))
+	elif args.replay:
+		print(f"[mock-openai] replay:   {args.replay} ({len(TRANSCRIPTS)} entries, timing={args.replay_timing})")
+
+	try:
+		if args.workers > 1:
+			run_workers(args, unix_sock)
+		else:
+			run_engine(args, unix_sock=unix_sock)
+	finally:
+		if unix_sock is not None:
+			unix_sock.close()
+			try:
+				os.unlink(args.unix)
+			except OSError:
+				pass
+	print("[mock-openai] stopped")
+
+
+def main() -> None:
+	parser = argparse.ArgumentParser(description="OpenAI-compatible mock chat server")
+	parser.add_argument("--host", default="127.0.0.1", help="Bind host")
+	parser.add_argument("--port", type=int, default=18000, help="Bind port")
+	parser.add_argument(
+		"--engine",
+		choices=("threading", "asyncio"),
+		default="threading",
+		help="threading: one OS thread per connection; asyncio: one event loop for thousands of concurrent streams",
+	)
+	parser.add_argument(
+		"--unix",
+		metavar="PATH",
+		help="Also serve on this AF_UNIX socket (fount's proxy AI source fetch()es an http:// URL, so it keeps using TCP)",
+	)
+	parser.add_argument("--no-tcp", action="store_true", help="With --unix: do not listen on --host/--port")
+	parser.add_argument("--backlog", type=int, default=4096, help="Listen backlog")
+	parser.add_argument("--workers", type=int, default=1, help="Worker processes sharing the port via SO_REUSEPORT")
+	transcripts = parser.add_argument_group("record / replay")
+	transcript_dir = transcripts.add_mutually_exclusive_group()
+	transcript_dir.add_argument("--record", metavar="DIR", help="Append every 2xx reply to the transcript store in DIR")
+	transcript_dir.add_argument("--replay", metavar="DIR", help="Serve replies from the transcript store in DIR (misses get 404)")
+	transcripts.add_argument("--upstream", metavar="URL", help="With --record: proxy to this origin instead of synthesizing replies")
+	transcripts.add_argument("--upstream-key", help="With --upstream: Authorization bearer token (default: forward the client's)")
+	transcripts.add_argument(
+		"--replay-timing",
+		choices=("none", "original"),
+		default="none",
+		help="none: write each stored stream in one go; original: keep the recorded gaps between chunks",
+	)
+	latency = parser.add_argument_group("stream timing defaults (per-request mock_* fields override)")
+	latency.add_argument("--delay-ms", type=float, default=MOCK_DEFAULTS["mock_delay_ms"], help="Mean per-token delay (mock_delay_ms)")
+	latency.add_argument("--ttft-ms", type=int, default=MOCK_DEFAULTS["mock_ttft_ms"], help="Time to first content chunk (mock_ttft_ms)")
+	latency.add_argument("--jitter-ms", type=int, default=MOCK_DEFAULTS["mock_jitter_ms"], help="Per-token delay spread (mock_jitter_ms)")
+	latency.add_argument(
+		"--latency-dist",
+		choices=LATENCY_DISTRIBUTIONS,
+		default=MOCK_DEFAULTS["mock_latency_dist"],
+		help="Per-token delay distribution (mock_latency_dist)",
+	)
+	latency.add_argument("--chunk-tokens", type=int, default=MOCK_DEFAULTS["mock_chunk_tokens"], help="Tokens per SSE event (mock_chunk_tokens)")
+	latency.add_argument(
+		"--time-scale",
+		type=float,
+		default=MOCK_DEFAULTS["mock_time_scale"],
+		help="Multiply every stream delay by this factor; != 1 runs streams on a virtual clock (mock_time_scale)",
+	)
+	latency.add_argument("--no-sleep", action="store_true", help="Same as --time-scale 0: never sleep, only report simulated time")
+	writes = parser.add_argument_group("socket writes")
+	writes.add_argument(
+		"--flush",
+		type=flush_spec,
+		default=MOCK_DEFAULTS["mock_flush"],
+		help='Default flush policy (mock_flush): "event", every N events ("16"), every T ms ("20ms") or both ("16,20ms")',
+	)
+	writes.add_argument(
+		"--tcp-nodelay",
+		choices=("default", "on", "off"),
+		default="default",
+		help="TCP_NODELAY on accepted sockets; default keeps the engine's own setting",
+	)
+	writes.add_argument(
+		"--pacing-trace",
+		metavar="FILE",
+		help="Write one JSONL record per stream write: scheduled vs actual send offset (target_ms, sent_ms, error_ms)",
+	)
+	parser.add_argument(
+		"--reply",
+		choices=("mock", "echo"),
+		default=MOCK_DEFAULTS["mock_reply"],
+		help='Reply text (mock_reply): "mock" prefixes the stripped user text with "Mock reply:", "echo" returns the last user message verbatim',
+	)
+	parser.add_argument(
+		"--embedding-dim",
+		type=int,
+		default=MOCK_DEFAULTS["mock_embedding_dim"],
+		help="/v1/embeddings vector size when the request sets no `dimensions` (mock_embedding_dim)",
+	)
+	parser.add_argument(
+		"--tool-args-bytes",
+		type=int,
+		default=MOCK_DEFAULTS["mock_tool_args_bytes"],
+		help="Size of generated tool call arguments with mock_tool_calls (mock_tool_args_bytes)",
+	)
+	faults = parser.add_argument_group("fault injection defaults (per-request mock_* fields override)")
+	faults.add_argument("--error-rate", type=float, default=MOCK_DEFAULTS["mock_error_rate"], help="Share of requests failed with --error-status (mock_error_rate)")
+	faults.add_argument("--error-status", type=int, default=MOCK_DEFAULTS["mock_error_status"], help="Injected status, e.g. 429 or 503 (mock_error_status)")
+	faults.add_argument("--retry-after", type=int, default=MOCK_DEFAULTS["mock_retry_after_s"], help="Retry-After seconds on injected errors (mock_retry_after_s)")
+	faults.add_argument("--cut-after-tokens", type=int, default=MOCK_DEFAULTS["mock_cut_after_tokens"], help="Drop streams after N tokens (mock_cut_after_tokens)")
+	faults.add_argument("--stall-rate", type=float, default=MOCK_DEFAULTS["mock_stall_rate"], help="Share of streams that stall once (mock_stall_rate)")
+	faults.add_argument("--stall-ms", type=int, default=MOCK_DEFAULTS["mock_stall_ms"], help="Length of an injected stall (mock_stall_ms)")
+	faults.add_argument("--write-bps", type=int, default=MOCK_DEFAULTS["mock_write_bps"], help="Write rate cap in bytes/s, 0 = unlimited (mock_write_bps)")
+	faults.add_argument("--fault-seed", help="Seed the fault stream for requests without mock_fault_seed")
+	parser.add_argument(
+		"--profiles",
+		metavar="FILE",
+		help="JSON {model or glob: {ttft_ms, tokens_per_s, max_concurrency, max_queue, error_rate, mock_*...}}; "
+		"request mock_* fields still override (limits are per --workers process)",
+	)
+	parser.add_argument(
+		"--tokenizer",
+		choices=("bpe", "char"),
+		default="bpe",
+		help="bpe: subword tokens from the bundled vocabulary; char: one token per character",
+	)
+	parser.add_argument("--vocab", default=VOCAB_PATH, help="BPE vocabulary file (see build-vocab)")
+	commands = parser.add_subparsers(dest="command", metavar="{serve,bench,microbench,build-vocab,self-test}")
+	commands.add_parser("serve", help="Run the mock server (default)")
+
+	bench = commands.add_parser("bench", help="Load-test a streaming chat endpoint (OpenAI, Anthropic or Gemini wire format)")
+	bench.add_argument("url", nargs="?", default="http://127.0.0.1:18000", help="Endpoint or base URL (mock or fount API)")
+	bench.add_argument("-c", "--concurrency", type=int, default=16, help="Concurrent streams")
+	bench.add_argument("-d", "--duration", type=float, default=10.0, help="Seconds to keep starting new streams")
+	bench.add_argument("--model", default="mock-model", help="Request model name")
+	bench.add_argument("--prompt", default="Hello from the bench client.", help="User message content")
+	bench.add_argument("--body", help="JSON object merged into the request body (e.g. mock_* knobs)")
+	bench.add_argument("--api-key", help="API key (Authorization: Bearer, x-api-key or x-goog-api-key per --protocol)")
+	bench.add_argument("--protocol", choices=BENCH_PROTOCOLS, default="openai", help="Wire protocol: chat completions, Anthropic messages or Gemini streamGenerateContent")
+	bench.add_argument("--unix", metavar="PATH", help="Connect to this AF_UNIX socket instead of the URL's host:port")
+	bench.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+	bench.add_argument("--json", action="store_true", help="Print the report as JSON instead of a table")
+	bench.add_argument("--output", help="Also write the JSON report to this file")
+
+	microbench = commands.add_parser("microbench", help="CPU micro-benchmarks of the response encoders")
+	microbench.add_argument("--tokens", type=int, default=2000, help="Tokens per simulated stream")
+	microbench.add_argument("--top-logprobs", type=int, default=5, help="top_logprobs for the logprobs case")
+	microbench.add_argument("--prompt-mb", type=float, default=4.0, help="Size of the synthetic fount prompt")
+	microbench.add_argument("--min-seconds", type=float, default=1.0, help="Minimum timing window per case")
+	microbench.add_argument("--json", action="store_true", help="Print results as JSON")
+
+	build_vocab = commands.add_parser("build-vocab", help="Retrain the bundled BPE vocabulary from the fount tree")
+	build_vocab.add_argument("--root", default=os.path.join(os.path.dirname(VOCAB_PATH), "..", ".."), help="fount checkout to read the corpus from")
+	build_vocab.add_argument("--merges", type=int, default=16384, help="Number of merges to learn")
+	build_vocab.add_argument("--output", default=VOCAB_PATH, help="Vocabulary file to write")
+
+	commands.add_parser("self-test", help="Run the built-in checks (pacing, parser, tokenizer, ...); exit 1 on failure")
+
+	args = parser.parse_args()
+	if args.command == "build-vocab":
+		run_build_vocab(args)
+		return
+	if args.command == "bench":
+		run_bench(args)
+		return
+	if args.command == "microbench":
+		run_microbench(args)
+		return
+	if args.command == "self-test":
+		sys.exit(run_self_test(args))
+	serve(args)
 
 
 if __name__ == "__main__":
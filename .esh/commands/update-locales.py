@@ -1,16 +1,25 @@
+import abc
+import argparse
 import json
 import os
 import copy
 import re
 import itertools
 from deep_translator import GoogleTranslator
+from deep_translator.exceptions import RequestError, TooManyRequests
+import requests
 import time
+import queue
+import random
 from collections import OrderedDict, Counter
 import sys
+import sqlite3
 import subprocess
+import unicodedata
 import concurrent.futures
 import threading
 import builtins
+import contextlib
 import pathspec
 import json5
 
@@ -40,10 +49,41 @@ REFERENCE_LANG_CODES = [
 	"es",
 	"it",
 ]
-# 翻译API调用之间的最小延迟（秒）
-TRANSLATION_DELAY = 0.6
-# 连续 API 失败达到此次数后停止后续翻译，按当前结果收尾
-TRANSLATION_ABORT_AFTER = 13
+# 翻译调度（所有语言、所有阶段共用）：令牌桶速率（次/秒）与桶容量、同时在途请求上限
+TRANSLATION_RATE_PER_S = 5.0
+TRANSLATION_BURST = 5
+TRANSLATION_CONCURRENCY = 8
+# 自适应退避：失败（429 / 网络错误）时速率减半但不低于下限，全体暂停 base * 2^(n-1) 秒（封顶）；成功后每次加回 step
+TRANSLATION_MIN_RATE_PER_S = 0.2
+TRANSLATION_RATE_STEP = 0.1
+TRANSLATION_BACKOFF_BASE_S = 2.0
+TRANSLATION_BACKOFF_MAX_S = 60.0
+# 持续失败这么久（期间无一次成功）才停止后续翻译，按当前结果收尾
+TRANSLATION_GIVE_UP_AFTER_S = 300.0
+# 本地翻译记忆（SQLite）；命中时不走网络、不占限速令牌。放在仓库外的用户缓存目录，CI 的 git add -A 不会提交它
+# （工作流用 actions/cache 在运行间保留）。环境变量 FOUNT_LOCALES_CACHE 或 --cache PATH 可改位置，--no-cache 停用
+TRANSLATION_CACHE_PATH = os.environ.get("FOUNT_LOCALES_CACHE") or os.path.join(
+	os.environ.get("XDG_CACHE_HOME") or os.environ.get("LOCALAPPDATA") or os.path.join(os.path.expanduser("~"), ".cache"),
+	"fount",
+	"locale_translation_cache.sqlite3",
+)
+# 批量翻译（google 后端）：多段原文用分隔行拼成一次请求；单次请求字符上限（免费接口上限 5000）与段数上限
+TRANSLATION_BATCH_MAX_CHARS = 4500
+TRANSLATION_BATCH_MAX_SEGMENTS = 40
+# 分隔标记：符号不会被翻译；拆分时容忍其两侧空白/换行被改写
+TRANSLATION_BATCH_SEPARATOR = "§§§"
+# 翻译后端：google（deep_translator 免费接口）、openai（任意 OpenAI 兼容 /v1/chat/completions，JSON 数组批量）、
+# null（原样返回原文，离线跑通流程用）。环境变量 FOUNT_LOCALES_BACKEND 可覆盖
+TRANSLATION_BACKEND_NAME = os.environ.get("FOUNT_LOCALES_BACKEND", "google")
+# openai 后端：接口地址（到 /v1 为止）、模型、密钥，以及并入请求体的额外字段（JSON 对象，如 {"temperature": 0}）
+OPENAI_TRANSLATION_BASE_URL = os.environ.get("FOUNT_LOCALES_OPENAI_BASE_URL", "https://api.openai.com/v1")
+OPENAI_TRANSLATION_MODEL = os.environ.get("FOUNT_LOCALES_OPENAI_MODEL", "gpt-4o-mini")
+OPENAI_TRANSLATION_API_KEY = os.environ.get("FOUNT_LOCALES_OPENAI_API_KEY") or os.environ.get("OPENAI_API_KEY", "")
+OPENAI_TRANSLATION_EXTRA_BODY = os.environ.get("FOUNT_LOCALES_OPENAI_EXTRA_BODY", "")
+# openai 后端单次请求的字符数 / 段数上限（段太多时模型容易漏段、错位）与流式读取超时
+OPENAI_TRANSLATION_BATCH_MAX_CHARS = 8000
+OPENAI_TRANSLATION_BATCH_MAX_SEGMENTS = 60
+OPENAI_TRANSLATION_TIMEOUT_S = 120
 # 同步最大迭代次数
 MAX_SYNC_ITERATIONS = 10
 # 占位符名称相似度修复阈值
@@ -54,12 +94,7 @@ LOCALES_JSON_FILENAME = "locales.json"
 # 仅翻译这些字段，其他字段（如 version, author, home_page）直接复制
 TRANSLATABLE_INFO_FIELDS = {"name", "description", "description_markdown", "summary", "tags"}
 
-# GitHub Actions 下按语言并发翻译（一语言一线程）；本地串行以免打爆免费翻译接口
-IN_GITHUB_ACTIONS = os.environ.get("GITHUB_ACTIONS") == "true"
 _PRINT_LOCK = threading.Lock()
-_TRANSLATION_LOCK = threading.Lock()
-_consecutive_translation_failures = 0
-_translation_aborted = False
 _REAL_PRINT = builtins.print
 
 
@@ -79,7 +114,7 @@ _ensure_stdio_unicode()
 
 
 class TranslationAborted(Exception):
-	"""连续翻译失败已达上限，停止后续 API 调用。"""
+	"""翻译接口持续失败超过 TRANSLATION_GIVE_UP_AFTER_S，停止后续 API 调用。"""
 
 
 def print(*args, **kwargs):  # noqa: A001 — 并发时串行化日志，避免多线程日志交错
@@ -92,35 +127,313 @@ def print(*args, **kwargs):  # noqa: A001 — 并发时串行化日志，避免
 			_REAL_PRINT(*safe, **kwargs)
 
 
+# 视为限流 / 网络问题、需要退避的异常；其它异常（如找不到译文）只算本条失败
+THROTTLE_ERRORS = (TooManyRequests, RequestError, requests.RequestException, OSError)
+
+
+class TranslationScheduler:
+	"""
+	所有翻译 API 调用的共享调度（线程安全，本地与 CI 相同）：
+	- 令牌桶：平均 rate 次/秒，允许 burst 次突发；另有 concurrency 个在途名额
+	- 自适应退避（AIMD）：限流/网络失败时 rate 减半（不低于 min_rate），并让所有调用方
+	  暂停 backoff_base_s * 2^(连续失败-1) 秒（封顶 backoff_max_s，带抖动）；成功一次 rate 加 rate_step，
+	  直到回到初始速率
+	- 只有在 give_up_after_s 内持续失败、没有一次成功时才中止（取代固定次数熔断），
+	  之后 call() 抛 TranslationAborted
+	"""
+
+	def __init__(self, rate, burst, concurrency, min_rate, rate_step, backoff_base_s, backoff_max_s, give_up_after_s):
+		self.max_rate = rate
+		self.rate = rate
+		self.burst = burst
+		self.min_rate = min_rate
+		self.rate_step = rate_step
+		self.backoff_base_s = backoff_base_s
+		self.backoff_max_s = backoff_max_s
+		self.give_up_after_s = give_up_after_s
+		self.aborted = False
+		self.calls = 0
+		self.failures = 0
+		self._tokens = float(burst)
+		self._refilled = time.monotonic()
+		self._paused_until = 0.0
+		self._consecutive_failures = 0
+		self._failing_since = None
+		self._cond = threading.Condition()
+		self._slots = threading.BoundedSemaphore(concurrency)
+
+	def _take_token(self):
+		with self._cond:
+			while True:
+				if self.aborted:
+					raise TranslationAborted()
+				now = time.monotonic()
+				self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+				self._refilled = now
+				wait_s = self._paused_until - now
+				if wait_s <= 0:
+					if self._tokens >= 1:
+						self._tokens -= 1
+						self.calls += 1
+						return
+					wait_s = (1 - self._tokens) / self.rate
+				self._cond.wait(wait_s)
+
+	def call(self, fn, *args):
+		"""限速执行一次 API 调用 fn(*args)；异常原样抛出（限流类异常先记入退避）。"""
+		with self._slots:
+			self._take_token()
+			try:
+				result = fn(*args)
+			except THROTTLE_ERRORS as e:
+				self._throttled(e)
+				raise
+			self._succeeded()
+			return result
+
+	def _succeeded(self):
+		with self._cond:
+			self._consecutive_failures = 0
+			self._failing_since = None
+			self.rate = min(self.max_rate, self.rate + self.rate_step)
+
+	def _throttled(self, error):
+		with self._cond:
+			now = time.monotonic()
+			self.failures += 1
+			self._consecutive_failures += 1
+			if self._failing_since is None:
+				self._failing_since = now
+			self.rate = max(self.min_rate, self.rate / 2)
+			self._tokens = min(self._tokens, 1.0)
+			backoff_s = min(self.backoff_max_s, self.backoff_base_s * 2 ** (self._consecutive_failures - 1))
+			backoff_s *= random.uniform(0.5, 1.0)
+			self._paused_until = max(self._paused_until, now + backoff_s)
+			print(f"    ! 翻译接口失败（{type(error).__name__}），速率降至 {self.rate:.2f}/s，暂停 {backoff_s:.1f}s。")
+			if not self.aborted and now - self._failing_since >= self.give_up_after_s:
+				self.aborted = True
+				print(f"    ! 翻译接口已持续失败 {self.give_up_after_s:.0f}s，停止后续翻译，按当前结果收尾。")
+			self._cond.notify_all()
+
+
+TRANSLATION_SCHEDULER = TranslationScheduler(
+	TRANSLATION_RATE_PER_S,
+	TRANSLATION_BURST,
+	TRANSLATION_CONCURRENCY,
+	TRANSLATION_MIN_RATE_PER_S,
+	TRANSLATION_RATE_STEP,
+	TRANSLATION_BACKOFF_BASE_S,
+	TRANSLATION_BACKOFF_MAX_S,
+	TRANSLATION_GIVE_UP_AFTER_S,
+)
+
+
 def is_translation_aborted():
-	with _TRANSLATION_LOCK:
-		return _translation_aborted
+	return TRANSLATION_SCHEDULER.aborted
+
 
+class PooledRequests:
+	"""
+	deep_translator 的 google 模块每次翻译都 requests.get（新建连接、重新 TLS 握手）。
+	换成这个对象后 get 从会话池借 requests.Session 复用 keep-alive 连接；池大小随并发自然封顶。
+	"""
 
-def note_translation_success():
-	global _consecutive_translation_failures
-	with _TRANSLATION_LOCK:
-		_consecutive_translation_failures = 0
+	def __init__(self):
+		self._idle = queue.SimpleQueue()
 
+	@contextlib.contextmanager
+	def session(self):
+		"""借出一个会话直到 with 结束（流式响应读完前不能归还，否则别的线程会复用同一连接）。"""
+		try:
+			session = self._idle.get_nowait()
+		except queue.Empty:
+			session = requests.Session()
+		try:
+			yield session
+		finally:
+			self._idle.put(session)
 
-def note_translation_failure():
-	"""记录一次 API 失败；达上限则熔断。返回是否已中止。"""
-	global _consecutive_translation_failures, _translation_aborted
-	with _TRANSLATION_LOCK:
-		_consecutive_translation_failures += 1
-		n = _consecutive_translation_failures
-		if n >= TRANSLATION_ABORT_AFTER and not _translation_aborted:
-			_translation_aborted = True
-			print(f"    ! 连续 {TRANSLATION_ABORT_AFTER} 次翻译失败，停止后续翻译，按当前结果收尾。")
-		return _translation_aborted
+	def get(self, *args, **kwargs):
+		with self.session() as session:
+			return session.get(*args, **kwargs)
+
+	def __getattr__(self, name):
+		return getattr(requests, name)
+
+
+def reuse_translator_connections():
+	try:
+		import deep_translator.google as google_module
+	except ImportError:
+		return
+	if getattr(google_module, "requests", None) is requests:
+		google_module.requests = PooledRequests()
+
+
+# ----------- 翻译后端 -----------
+_BATCH_SPLIT_RE = re.compile(rf"\s*{re.escape(TRANSLATION_BATCH_SEPARATOR)}\s*")
+_JSON_FENCE_RE = re.compile(r"^```(?:json)?\s*|\s*```$")
+
+OPENAI_TRANSLATION_PROMPT = (
+	"You translate user interface strings of a software product from {source} to {target}. "
+	"The user message is a JSON array of strings. Reply with only a JSON array holding the translations, "
+	"with the same length and order and no commentary. Keep placeholders such as ${{name}}, {{0}} and %s, "
+	"HTML tags, Markdown, emoji and line breaks exactly as they are."
+)
+
+
+class TranslationBackend(abc.ABC):
+	"""
+	翻译后端接口；语言代码均为 get_compatible_code 处理后的代码，返回接口原始译文（占位符由调用方对齐）。
+	- name：兼作翻译缓存的 provider，不同后端/模型的译文互不混用
+	- load_supported_codes()：支持的语言代码集合；空集表示不限制，语言代码原样交给后端
+	- translate(text, source, target)：单条翻译；translate_batch(texts, ...)：一次调用翻译多段（均须实现）
+	- max_batch_chars / max_batch_segments / can_batch()：prefetch_translations 怎么拼批
+	- persist_cache 为 False 时译文只留在本次运行的内存缓存里
+	失败一律抛异常（THROTTLE_ERRORS 会让 TRANSLATION_SCHEDULER 退避）。
+	"""
+
+	name = ""
+	max_batch_chars = TRANSLATION_BATCH_MAX_CHARS
+	max_batch_segments = TRANSLATION_BATCH_MAX_SEGMENTS
+	persist_cache = True
+
+	def load_supported_codes(self) -> set[str]:
+		return set()
+
+	def can_batch(self, text: str) -> bool:
+		return len(text) <= self.max_batch_chars
+
+	@abc.abstractmethod
+	def translate(self, text: str, source_code: str, target_code: str) -> str | None:
+		...
+
+	@abc.abstractmethod
+	def translate_batch(self, texts: list[str], source_code: str, target_code: str) -> list[str] | None:
+		...
+
+
+class GoogleBackend(TranslationBackend):
+	"""deep_translator 的 Google 免费接口；批量时多段用分隔行拼成一段文本，译完再拆开。"""
+
+	name = "google"
+
+	def load_supported_codes(self):
+		return set(GoogleTranslator(source="auto", target="en").get_supported_languages(as_dict=True).values())
+
+	def can_batch(self, text):
+		return super().can_batch(text) and TRANSLATION_BATCH_SEPARATOR not in text
+
+	def translate(self, text, source_code, target_code):
+		return GoogleTranslator(source=source_code, target=target_code).translate(text)
+
+	def translate_batch(self, texts, source_code, target_code):
+		translated = self.translate(f"\n{TRANSLATION_BATCH_SEPARATOR}\n".join(texts), source_code, target_code)
+		return None if translated is None else _BATCH_SPLIT_RE.split(translated.strip())
+
+
+class OpenAIBatchBackend(TranslationBackend):
+	"""
+	OpenAI 兼容的 /v1/chat/completions（也可以是本地的 mock_openai_server.py --reply echo）。
+	一批原文作为 JSON 数组发出，要求回复等长的 JSON 数组；流式读取，长批次不会撞上读超时。
+	不限制语言代码；429 / 5xx 按限流处理，其它错误状态与解析不出的回复只算本次失败。
+	"""
+
+	max_batch_chars = OPENAI_TRANSLATION_BATCH_MAX_CHARS
+	max_batch_segments = OPENAI_TRANSLATION_BATCH_MAX_SEGMENTS
+
+	def __init__(self, base_url: str, model: str, api_key: str = "", extra_body: dict | None = None):
+		self.name = f"openai:{model}"
+		self.url = base_url.rstrip("/") + "/chat/completions"
+		self.model = model
+		self.headers = {"Content-Type": "application/json"}
+		if api_key:
+			self.headers["Authorization"] = f"Bearer {api_key}"
+		self.extra_body = extra_body or {}
+		self.http = PooledRequests()
+
+	def translate(self, text, source_code, target_code):
+		translated = self.translate_batch([text], source_code, target_code)
+		if len(translated) != 1:
+			raise ValueError(f"回复应为 1 段，实际 {len(translated)} 段")
+		return translated[0]
+
+	def translate_batch(self, texts, source_code, target_code):
+		body = {
+			"model": self.model,
+			"messages": [
+				{"role": "system", "content": OPENAI_TRANSLATION_PROMPT.format(source=source_code, target=target_code)},
+				{"role": "user", "content": json.dumps(texts, ensure_ascii=False)},
+			],
+			"stream": True,
+			**self.extra_body,
+		}
+		with self.http.session() as session, session.post(self.url, json=body, headers=self.headers, stream=True, timeout=OPENAI_TRANSLATION_TIMEOUT_S) as response:
+			if response.status_code == 429 or response.status_code >= 500:
+				response.raise_for_status()
+			if response.status_code != 200:
+				raise ValueError(f"HTTP {response.status_code}: {response.text[:200]}")
+			content = self._read_content(response)
+		try:
+			translated = json.loads(_JSON_FENCE_RE.sub("", content.strip()))
+		except json.JSONDecodeError:
+			translated = None
+		if not isinstance(translated, list) or not all(isinstance(item, str) for item in translated):
+			raise ValueError(f"回复不是字符串 JSON 数组: {content[:100]!r}")
+		return translated
+
+	@staticmethod
+	def _read_content(response) -> str:
+		"""回复正文：SSE 流逐个拼接 delta.content；服务端不支持流式时按普通 JSON 响应读取。"""
+		if not response.headers.get("Content-Type", "").startswith("text/event-stream"):
+			return response.json()["choices"][0]["message"]["content"] or ""
+		parts = []
+		for line in response.iter_lines():
+			if not line.startswith(b"data:"):
+				continue
+			data = line[5:].strip()
+			if data == b"[DONE]":
+				break
+			choices = json.loads(data).get("choices") or []
+			if choices:
+				parts.append((choices[0].get("delta") or {}).get("content") or "")
+		return "".join(parts)
+
+
+class NullBackend(TranslationBackend):
+	"""原样返回原文：不联网跑通整条同步流程（结构同步、批量、占位符对齐）；结果不写入磁盘缓存。"""
+
+	name = "null"
+	persist_cache = False
+
+	def translate(self, text, source_code, target_code):
+		return text
+
+	def translate_batch(self, texts, source_code, target_code):
+		return list(texts)
+
+
+def create_translation_backend(name: str) -> TranslationBackend:
+	"""按名称创建翻译后端；openai 后端读取 OPENAI_TRANSLATION_* 配置。"""
+	if name == "google":
+		return GoogleBackend()
+	if name == "openai":
+		extra_body = json.loads(OPENAI_TRANSLATION_EXTRA_BODY) if OPENAI_TRANSLATION_EXTRA_BODY else None
+		return OpenAIBatchBackend(OPENAI_TRANSLATION_BASE_URL, OPENAI_TRANSLATION_MODEL, OPENAI_TRANSLATION_API_KEY, extra_body)
+	if name == "null":
+		return NullBackend()
+	raise ValueError(f"未知的翻译后端 '{name}'（可选: google, openai, null）")
+
+
+TRANSLATION_BACKEND: TranslationBackend = GoogleBackend()
 
 
 def run_per_lang(fn, items):
-	"""对每个语言项执行 fn；CI 中一语言一线程，本地串行。"""
+	"""对每个语言项并发执行 fn（一语言一线程）；API 速率与在途数由 TRANSLATION_SCHEDULER 统一约束。"""
 	items = list(items)
 	if not items:
 		return []
-	if IN_GITHUB_ACTIONS and len(items) > 1:
+	if len(items) > 1:
 		with concurrent.futures.ThreadPoolExecutor(max_workers=len(items)) as executor:
 			return list(executor.map(fn, items))
 	return [fn(x) for x in items]
@@ -155,7 +468,7 @@ def load_gitignore_spec(fount_root_dir):
 	return spec
 
 
-SUPPORTED_GOOGLE_CODES = set()
+SUPPORTED_LANGUAGE_CODES = set()
 
 
 def ensure_allowed_to_run():
@@ -172,17 +485,20 @@ def ensure_allowed_to_run():
 	sys.exit(0)
 
 
-def load_supported_google_codes():
-	"""加载 Google Translator 支持的语言代码集合。"""
-	global SUPPORTED_GOOGLE_CODES
+def load_supported_language_codes():
+	"""加载当前翻译后端支持的语言代码集合（空集表示不限制）。"""
+	global SUPPORTED_LANGUAGE_CODES
+	backend_name = TRANSLATION_BACKEND.name
 	try:
-		supp_lang_translator = GoogleTranslator(source="auto", target="en")
-		SUPPORTED_GOOGLE_CODES = set(supp_lang_translator.get_supported_languages(as_dict=True).values())
-		print(f"成功加载 Google Translator 支持的语言 ({len(SUPPORTED_GOOGLE_CODES)} 种)。")
+		SUPPORTED_LANGUAGE_CODES = TRANSLATION_BACKEND.load_supported_codes()
+		if SUPPORTED_LANGUAGE_CODES:
+			print(f"成功加载翻译后端 {backend_name} 支持的语言 ({len(SUPPORTED_LANGUAGE_CODES)} 种)。")
+		else:
+			print(f"翻译后端 {backend_name} 不限制语言代码。")
 	except Exception as e:
-		print(f"错误: 初始化 Google Translator 失败，无法获取支持语言列表: {e}")
-		print("翻译功能将无法正常工作。请检查网络连接或 deep_translator 库。")
-		SUPPORTED_GOOGLE_CODES = set()
+		print(f"错误: 初始化翻译后端 {backend_name} 失败，无法获取支持语言列表: {e}")
+		print("翻译功能将无法正常工作。请检查网络连接或后端配置。")
+		SUPPORTED_LANGUAGE_CODES = set()
 
 
 def get_lang_from_filename(filename):
@@ -368,46 +684,55 @@ def align_placeholders_google_raw(original_text_with_placeholders: str, translat
 
 
 def get_compatible_code(code):
-	"""Helper function to get a compatible Google Translate API language code."""
-	if not SUPPORTED_GOOGLE_CODES:
+	"""Helper function to get a language code the current translation backend accepts."""
+	if not SUPPORTED_LANGUAGE_CODES:
 		return code
-	if code in SUPPORTED_GOOGLE_CODES:
+	if code in SUPPORTED_LANGUAGE_CODES:
 		return code
 	base_code = code.split("-")[0]
-	if base_code in SUPPORTED_GOOGLE_CODES:
+	if base_code in SUPPORTED_LANGUAGE_CODES:
 		return base_code
 	code_lower = code.lower()
-	for sc in SUPPORTED_GOOGLE_CODES:
+	for sc in SUPPORTED_LANGUAGE_CODES:
 		if sc.lower() == code_lower:
 			return sc
 	base_lower = base_code.lower()
-	for sc in SUPPORTED_GOOGLE_CODES:
+	for sc in SUPPORTED_LANGUAGE_CODES:
 		if sc.lower() == base_lower:
 			return sc
 	return None
 
 
-def perform_translation_with_retry(text: str, source_lang_code: str, target_lang_code: str, original_source_lang: str, original_target_lang: str) -> str | None:
+def preview_translation(value) -> str:
+	"""日志用：单条取前 50 字；批量显示段数与首段开头。"""
+	if isinstance(value, list):
+		return f"[{len(value)} 段] {preview_translation(value[0]) if value else ''}"
+	return f"'{value[:50]}{'...' if len(value) > 50 else ''}'"
+
+
+def perform_translation_with_retry(text: str | list[str], source_lang_code: str, target_lang_code: str, original_source_lang: str, original_target_lang: str) -> str | list[str] | None:
 	"""
-	Performs translation with a retry mechanism using base language codes if the initial attempt fails.
-	Returns the translated text or None if all attempts fail.
+	Performs translation with TRANSLATION_BACKEND, retrying with base language codes if the initial attempt fails.
+	`text` may be a list of segments, which goes to the backend's translate_batch in one call.
+	Every API call goes through TRANSLATION_SCHEDULER (rate limit, concurrency cap, backoff).
+	Returns the raw translation or None if all attempts fail; raises TranslationAborted once the scheduler gave up.
 	"""
-	print(f"    - 正在翻译: '{text[:50]}{'...' if len(text) > 50 else ''}' 从 {original_source_lang}({source_lang_code}) 到 {original_target_lang}({target_lang_code})")
-	time.sleep(TRANSLATION_DELAY)
+	translate = TRANSLATION_BACKEND.translate_batch if isinstance(text, list) else TRANSLATION_BACKEND.translate
+	print(f"    - 正在翻译: {preview_translation(text)} 从 {original_source_lang}({source_lang_code}) 到 {original_target_lang}({target_lang_code})")
 
 	try:
-		translator = GoogleTranslator(source=source_lang_code, target=target_lang_code)
-		translated_result = translator.translate(text)
+		translated_result = TRANSLATION_SCHEDULER.call(translate, text, source_lang_code, target_lang_code)
 		if translated_result is not None:
 			# No alignment here, it will be done in the caller
-			print(f"      - API翻译成功: '{translated_result[:50]}{'...' if len(translated_result) > 50 else ''}'")
+			print(f"      - API翻译成功: {preview_translation(translated_result)}")
 			return translated_result
 		else:
-			# This case might not be typically hit if deep_translator raises an exception for failed translations
-			print(f"    - 翻译 '{text[:50]}...' ({source_lang_code} -> {target_lang_code}) API返回None。")
-			raise ValueError("翻译器返回 None")  # Force into exception handling for retry
+			print(f"    - 翻译 {preview_translation(text)} ({source_lang_code} -> {target_lang_code}) API返回None。")
+			raise ValueError("翻译后端返回 None")  # Force into exception handling for retry
+	except TranslationAborted:
+		raise
 	except Exception as e:
-		print(f"    - 翻译 '{text[:50]}...' ({source_lang_code} -> {target_lang_code}) 初始失败: {e}")
+		print(f"    - 翻译 {preview_translation(text)} ({source_lang_code} -> {target_lang_code}) 初始失败: {e}")
 
 		# Prepare for retry with base codes
 		s_base = original_source_lang.split("-")[0]
@@ -421,30 +746,245 @@ def perform_translation_with_retry(text: str, source_lang_code: str, target_lang
 		# 3. Base source and target are not the same (no point translating to itself).
 		if s_base_compat and t_base_compat and (s_base_compat != source_lang_code or t_base_compat != target_lang_code) and s_base_compat != t_base_compat:
 			print(f"      - 尝试备选 (基本代码): source={s_base_compat}, target={t_base_compat}")
-			time.sleep(TRANSLATION_DELAY)
 			try:
-				translator_retry = GoogleTranslator(source=s_base_compat, target=t_base_compat)
-				translated_result_retry = translator_retry.translate(text)
+				translated_result_retry = TRANSLATION_SCHEDULER.call(translate, text, s_base_compat, t_base_compat)
 				if translated_result_retry is not None:
 					# No alignment here
-					print(f"      - 备选API翻译成功: '{translated_result_retry[:50]}{'...' if len(translated_result_retry) > 50 else ''}'")
+					print(f"      - 备选API翻译成功: {preview_translation(translated_result_retry)}")
 					return translated_result_retry
 				else:
 					print(f"      - 尝试 {s_base_compat} -> {t_base_compat} API返回None。")
 					return None  # Explicitly return None for this failure path
+			except TranslationAborted:
+				raise
 			except Exception as e2:
 				print(f"      - 尝试 {s_base_compat} -> {t_base_compat} 失败: {e2}")
 		# If retry is not applicable or fails
-		print(f"    - 翻译 '{text[:50]}...' ({original_source_lang} -> {original_target_lang}) 所有尝试均失败。返回 None。")
+		print(f"    - 翻译 {preview_translation(text)} ({original_source_lang} -> {original_target_lang}) 所有尝试均失败。返回 None。")
+		return None
+
+
+def normalize_cache_text(text: str) -> str:
+	"""缓存键用的原文：统一换行与 Unicode 组合形式，去掉首尾空白（Google 本就不保留）。"""
+	return unicodedata.normalize("NFC", text.replace("\r\n", "\n")).strip()
+
+
+class TranslationCache:
+	"""
+	翻译记忆：(provider, 规范化原文, 源语言, 目标语言) -> 接口原始译文（占位符对齐前，命中后照常对齐）。
+	语言用实际发给接口的兼容代码，zh-CN / zh-TW 等映射到同一代码时共用结果。
+	只缓存成功结果；每条写入立即提交，中途失败或中止的运行下次可直接续上。
+	首次使用时才打开；打不开（只读目录等）则只留本次运行的内存层。
+	批量预取拆出的译文以 persist=False 放入内存层、记为待验收：translate_text 用到时经 accept() 校验，
+	通过才写入磁盘，不通过则丢弃——拆错位的批次不会留在持久缓存里。
+	"""
+
+	def __init__(self, path: str | None):
+		self.path = path
+		self.hits = 0
+		self.stores = 0
+		self._memory = {}
+		self._pending = set()
+		self._conn = None
+		self._disabled = not path
+		self._lock = threading.Lock()
+
+	def _connection(self):
+		if self._conn is None and not self._disabled:
+			try:
+				os.makedirs(os.path.dirname(self.path), exist_ok=True)
+				conn = sqlite3.connect(self.path, check_same_thread=False)
+				conn.execute("PRAGMA journal_mode=WAL")
+				conn.execute("PRAGMA synchronous=NORMAL")
+				conn.execute(
+					"CREATE TABLE IF NOT EXISTS translations ("
+					"provider TEXT NOT NULL, source_text TEXT NOT NULL, source_lang TEXT NOT NULL, target_lang TEXT NOT NULL, "
+					"translated TEXT NOT NULL, updated_at INTEGER NOT NULL, "
+					"PRIMARY KEY (provider, source_lang, target_lang, source_text)) WITHOUT ROWID"
+				)
+				conn.commit()
+				self._conn = conn
+			except (OSError, sqlite3.Error) as e:
+				print(f"警告: 无法打开翻译缓存 {self.path}: {e}，本次不使用缓存。")
+				self._disabled = True
+		return self._conn
+
+	def _lookup(self, key):
+		if key in self._memory:
+			return self._memory[key]
+		conn = self._connection()
+		if conn is None:
+			return None
+		try:
+			row = conn.execute(
+				"SELECT translated FROM translations WHERE provider = ? AND source_text = ? AND source_lang = ? AND target_lang = ?",
+				key,
+			).fetchone()
+		except sqlite3.Error as e:
+			print(f"警告: 读取翻译缓存失败: {e}")
+			return None
+		if row is None:
+			return None
+		self._memory[key] = row[0]
+		return row[0]
+
+	def get(self, text: str, source_lang: str, target_lang: str, provider: str = "google") -> str | None:
+		with self._lock:
+			translated = self._lookup((provider, normalize_cache_text(text), source_lang, target_lang))
+			if translated is not None:
+				self.hits += 1
+			return translated
+
+	def has(self, text: str, source_lang: str, target_lang: str, provider: str = "google") -> bool:
+		"""同 get，但不计入命中数（批量预取时过滤已有条目用）。"""
+		with self._lock:
+			return self._lookup((provider, normalize_cache_text(text), source_lang, target_lang)) is not None
+
+	def put(self, text: str, source_lang: str, target_lang: str, translated: str, provider: str = "google", persist: bool = True):
+		"""persist=False 只放进内存层并记为待验收（批量预取用），见 accept()。"""
+		key = (provider, normalize_cache_text(text), source_lang, target_lang)
+		with self._lock:
+			self._memory[key] = translated
+			if persist:
+				self._pending.discard(key)
+				self._store(key, translated)
+			else:
+				self._pending.add(key)
+
+	def accept(self, text: str, source_lang: str, target_lang: str, ok: bool, provider: str = "google") -> bool:
+		"""
+		验收刚 get() 到的条目：已持久化的条目直接通过；待验收条目 ok 时写入磁盘，否则从内存层删除（不计命中）。
+		返回该条目是否可用。
+		"""
+		key = (provider, normalize_cache_text(text), source_lang, target_lang)
+		with self._lock:
+			if key not in self._pending:
+				return True
+			self._pending.discard(key)
+			if ok:
+				self._store(key, self._memory[key])
+				return True
+			self._memory.pop(key, None)
+			self.hits -= 1
+			return False
+
+	def _store(self, key, translated):
+		conn = self._connection()
+		if conn is None:
+			return
+		try:
+			conn.execute("INSERT OR REPLACE INTO translations VALUES (?, ?, ?, ?, ?, ?)", (*key, translated, int(time.time())))
+			conn.commit()
+			self.stores += 1
+		except sqlite3.Error as e:
+			print(f"警告: 写入翻译缓存失败: {e}")
+
+	def close(self):
+		with self._lock:
+			self._pending.clear()
+			if self._conn is not None:
+				self._conn.close()
+				self._conn = None
+
+
+TRANSLATION_CACHE = TranslationCache(TRANSLATION_CACHE_PATH)
+
+
+def use_translation_backend(backend: TranslationBackend):
+	"""切换当前翻译后端；persist_cache 为 False 的后端换用只在内存里的翻译缓存。"""
+	global TRANSLATION_BACKEND, TRANSLATION_CACHE
+	TRANSLATION_BACKEND = backend
+	if not backend.persist_cache:
+		TRANSLATION_CACHE.close()
+		TRANSLATION_CACHE = TranslationCache(None)
+
+
+def pack_translation_batches(texts: list[str]) -> list[list[str]]:
+	"""按当前后端的字符数（含分隔开销）与段数上限把原文切成若干批。"""
+	batches, current, size = [], [], 0
+	joiner_len = len(TRANSLATION_BATCH_SEPARATOR) + 2
+	max_chars, max_segments = TRANSLATION_BACKEND.max_batch_chars, TRANSLATION_BACKEND.max_batch_segments
+	for text in texts:
+		extra = len(text) + (joiner_len if current else 0)
+		if current and (size + extra > max_chars or len(current) >= max_segments):
+			batches.append(current)
+			current, size, extra = [], 0, len(text)
+		current.append(text)
+		size += extra
+	if current:
+		batches.append(current)
+	return batches
+
+
+def translate_batch(texts: list[str], source_code: str, target_code: str, source_lang: str, target_lang: str) -> list[str] | None:
+	"""一次 API 调用翻译多段；返回与 texts 等长的原始译文，段数对不上或失败返回 None。"""
+	translated = perform_translation_with_retry(list(texts), source_code, target_code, source_lang, target_lang)
+	if translated is None:
 		return None
+	if len(translated) != len(texts):
+		print(f"      - 批量译文拆分失败（{len(texts)} 段 → {len(translated)} 段），改为逐条翻译。")
+		return None
+	return translated
+
+
+def prefetch_translations(jobs):
+	"""
+	批量预取：jobs 为 (text, source_lang, target_lang)。按实际兼容语言对分组，跳过已缓存、
+	不需翻译（空串、同语言、后端不支持）和放不进单批的原文，其余拼成多段请求一次翻译，
+	拆回的各段原始译文以待验收状态存入 TRANSLATION_CACHE 的内存层。之后 translate_text 照常逐条调用、
+	命中缓存、各自做占位符对齐并验收，通过才写入磁盘。段数对不上、任一段校验不过（错位会让后面各段
+	整体串位，只丢单段不可靠）或请求失败的批次整批丢弃，由逐条翻译兜底。
+	调度器放弃时直接返回、不抛 TranslationAborted：调用方都在 translate_value 的 try 之外。
+	"""
+	groups = {}
+	for text, source_lang, target_lang in jobs:
+		if not isinstance(text, str) or not text.strip() or source_lang == target_lang:
+			continue
+		if not TRANSLATION_BACKEND.can_batch(text):
+			continue
+		source_code, target_code = get_compatible_code(source_lang), get_compatible_code(target_lang)
+		if source_code is None or target_code is None or source_code == target_code:
+			continue
+		group = groups.setdefault((source_code, target_code), (source_lang, target_lang, {}))
+		group[2].setdefault(normalize_cache_text(text), text)
+
+	for (source_code, target_code), (source_lang, target_lang, texts_by_key) in groups.items():
+		pending = [text for text in texts_by_key.values() if not TRANSLATION_CACHE.has(text, source_code, target_code, TRANSLATION_BACKEND.name)]
+		if len(pending) < 2:
+			continue  # 单条无需拼批，交给 translate_text
+		print(f"    - 批量翻译 {len(pending)} 条: {source_lang}({source_code}) → {target_lang}({target_code})")
+		for batch in pack_translation_batches(pending):
+			if is_translation_aborted():
+				return
+			if len(batch) < 2:
+				continue
+			try:
+				translated = translate_batch(batch, source_code, target_code, source_lang, target_lang)
+			except TranslationAborted:
+				return  # 预取只是加速；之后逐条的 translate_text 会在调用方的 try 里再抛出并收尾
+			if translated is None:
+				continue
+			rejected = next((text for text, segment in zip(batch, translated) if not is_plausible_translation(text, align_placeholders_google_raw(text, segment))), None)
+			if rejected is not None:
+				print(f"      - 批量译文校验失败（'{rejected[:30]}' 的译文为空或占位符不符，可能错位），整批改为逐条翻译。")
+				continue
+			for text, segment in zip(batch, translated):
+				TRANSLATION_CACHE.put(text, source_code, target_code, segment, TRANSLATION_BACKEND.name, persist=False)
+
+
+def is_plausible_translation(source_text: str, translated_text: str) -> bool:
+	"""批量拆分所得译文的验收（占位符对齐后）：原文非空则译文非空，占位符与原文一致。"""
+	if source_text.strip() and not translated_text.strip():
+		return False
+	return Counter(extract_placeholders(source_text)) == Counter(extract_placeholders(translated_text))
 
 
 def translate_text(text: str, source_lang: str, target_lang: str) -> str | None:
 	"""
-	Translates text using GoogleTranslator with compatibility checks and retry logic.
+	Translates text using TRANSLATION_BACKEND with compatibility checks and retry logic.
 	Aligns placeholders after successful translation.
-	Returns: 译文；Google 不支持的语言回退原文；API 失败返回 None。
-	已熔断时抛 TranslationAborted（调用方勿写入，保持现状）。
+	Returns: 译文；后端不支持的语言回退原文；API 失败返回 None。
+	调度器已放弃（接口持续失败）时抛 TranslationAborted（调用方勿写入，保持现状）。
 	"""
 	if is_translation_aborted():
 		raise TranslationAborted()
@@ -455,25 +995,34 @@ def translate_text(text: str, source_lang: str, target_lang: str) -> str | None:
 	src_code_compat = get_compatible_code(source_lang)
 	tgt_code_compat = get_compatible_code(target_lang)
 
-	# Google 不支持的语言：直接留原文，方便后续人工/其它渠道翻译。API 失败才写 null。
+	# 后端不支持的语言：直接留原文，方便后续人工/其它渠道翻译。API 失败才写 null。
 	if src_code_compat is None:
-		print(f"    - 源语言 '{source_lang}' 不被 Google 支持，回退原文。")
+		print(f"    - 源语言 '{source_lang}' 不被翻译后端 {TRANSLATION_BACKEND.name} 支持，回退原文。")
 		return text
 	if tgt_code_compat is None:
-		print(f"    - 目标语言 '{target_lang}' 不被 Google 支持，回退原文。")
+		print(f"    - 目标语言 '{target_lang}' 不被翻译后端 {TRANSLATION_BACKEND.name} 支持，回退原文。")
 		return text
 	if src_code_compat == tgt_code_compat:
 		return text
 
+	translated_text_raw = TRANSLATION_CACHE.get(text, src_code_compat, tgt_code_compat, TRANSLATION_BACKEND.name)
+	if translated_text_raw is not None:
+		aligned_translated = align_placeholders_google_raw(text, translated_text_raw)
+		if not TRANSLATION_CACHE.accept(text, src_code_compat, tgt_code_compat, is_plausible_translation(text, aligned_translated), TRANSLATION_BACKEND.name):
+			print(f"    - 批量译文未通过校验，改为逐条翻译: '{text[:50]}{'...' if len(text) > 50 else ''}'")
+			translated_text_raw = None
+	if translated_text_raw is not None:
+		print(f"    - 缓存命中: '{text[:50]}{'...' if len(text) > 50 else ''}' ({source_lang} -> {target_lang}): '{aligned_translated[:50]}{'...' if len(aligned_translated) > 50 else ''}'")
+		return aligned_translated
+
 	translated_text_raw = perform_translation_with_retry(text, src_code_compat, tgt_code_compat, source_lang, target_lang)
 
 	if translated_text_raw is not None:
-		note_translation_success()
+		TRANSLATION_CACHE.put(text, src_code_compat, tgt_code_compat, translated_text_raw, TRANSLATION_BACKEND.name)
 		aligned_translated = align_placeholders_google_raw(text, translated_text_raw)
-		print(f"      - 翻译成功 (Google对齐后): '{aligned_translated[:50]}{'...' if len(aligned_translated) > 50 else ''}'")
+		print(f"      - 翻译成功 (占位符对齐后): '{aligned_translated[:50]}{'...' if len(aligned_translated) > 50 else ''}'")
 		return aligned_translated
 
-	note_translation_failure()
 	return None
 
 
@@ -532,6 +1081,23 @@ def translate_value(value, source_lang, target_lang):
 		return value
 
 
+def iter_translatable_strings(value):
+	"""按 translate_value 的规则列出 value 中会被翻译的字符串（供批量预取）。"""
+	if isinstance(value, str):
+		yield value
+	elif isinstance(value, OrderedDict):
+		if is_switch_value(value):
+			yield from iter_translatable_strings(value["default"])
+			for v in (value.get("cases") or {}).values():
+				yield from iter_translatable_strings(v)
+			return
+		for v in value.values():
+			yield from iter_translatable_strings(v)
+	elif isinstance(value, list):
+		for item in value:
+			yield from iter_translatable_strings(item)
+
+
 def single_applicator_key(value):
 	"""若 value 为仅含一个 DOM applicator 字段的对象，返回该字段名，否则 None。"""
 	if is_switch_value(value):
@@ -575,10 +1141,48 @@ def normalize_string_vs_applicator_object(parent_dict_a, parent_dict_b, key, lan
 	return val_a, val_b, changed_here
 
 
+# DeferredKeyTranslations 范围内 handle_missing_key_translation 只登记，范围结束时批量翻译后写入
+_DEFERRED = threading.local()
+
+
+class DeferredKeyTranslations:
+	"""
+	with DeferredKeyTranslations() as batch: ... batch.flush()
+	收集本线程这一轮同步里所有缺失键，flush() 先 prefetch_translations 批量翻译，
+	再逐键写入（逐条命中缓存、各自对齐占位符）。返回是否有更改。
+	"""
+
+	def __enter__(self):
+		self.jobs = []
+		_DEFERRED.jobs = self.jobs
+		return self
+
+	def __exit__(self, *exc_info):
+		_DEFERRED.jobs = None
+		return False
+
+	def flush(self):
+		_DEFERRED.jobs = None
+		jobs, self.jobs = self.jobs, []
+		if not jobs or is_translation_aborted():
+			return False
+		prefetch_translations(
+			(text, source_lang, target_lang)
+			for _, _, source_value, target_lang, source_lang, _ in jobs
+			for text in iter_translatable_strings(source_value)
+		)
+		changed = False
+		for job in jobs:
+			if write_missing_key_translation(*job):
+				changed = True
+		return changed
+
+
 def handle_missing_key_translation(target_dict, source_dict, key, target_lang, source_lang_for_trans, current_path):
 	"""
 	翻译并写入缺失（或不合法 null）的键。
 	翻译失败时写入 null（下次运行会重试）；空串是合法值，照常写入。
+	在 DeferredKeyTranslations 范围内只登记（返回 False，更改由 flush() 报告）。
 	Returns True if a change was made, False otherwise.
 	"""
 	if is_translation_aborted():
@@ -589,8 +1193,19 @@ def handle_missing_key_translation(target_dict, source_dict, key, target_lang, s
 		print(f"  - 跳过: 键 '{current_path}' 在源语言 {source_lang_for_trans} 中也为 null。")
 		return False
 
+	pending = getattr(_DEFERRED, "jobs", None)
+	if pending is not None:
+		pending.append((target_dict, key, copy.deepcopy(source_value_direct), target_lang, source_lang_for_trans, current_path))
+		return False
+	return write_missing_key_translation(target_dict, key, copy.deepcopy(source_value_direct), target_lang, source_lang_for_trans, current_path)
+
+
+def write_missing_key_translation(target_dict, key, source_value, target_lang, source_lang_for_trans, current_path):
+	"""翻译 source_value 并写入 target_dict[key]；Returns True if a change was made."""
+	if is_translation_aborted():
+		return False
 	try:
-		translated_val = translate_value(copy.deepcopy(source_value_direct), source_lang_for_trans, target_lang)
+		translated_val = translate_value(source_value, source_lang_for_trans, target_lang)
 	except TranslationAborted:
 		return False
 
@@ -724,6 +1339,7 @@ def sync_localized_block(block_data, available_lang_codes):
 		print(f"      + 为 '{target_lang}' 补充内容 (基于 '{source_lang}')")
 		if target_lang == "emoji":
 			return target_lang, copy.deepcopy(source_val)
+		prefetch_translations((text, source_lang, target_lang) for text in iter_translatable_strings(source_val))
 		try:
 			translated = translate_value(copy.deepcopy(source_val), source_lang, target_lang)
 		except TranslationAborted:
@@ -796,7 +1412,7 @@ def sync_info_content(info_data, available_lang_codes):
 	if not isinstance(source_obj, (dict, OrderedDict)):
 		return False
 
-	# 2. 按语言补齐缺失块/字段（CI 下一语言一线程）
+	# 2. 按语言补齐缺失块/字段（一语言一线程）
 	target_langs = [lang for lang in available_lang_codes if lang != source_lang]
 
 	def sync_one_info_lang(target_lang):
@@ -806,6 +1422,12 @@ def sync_info_content(info_data, available_lang_codes):
 		if not existed:
 			print(f"    + 为 '{target_lang}' 创建新块 (基于 '{source_lang}')")
 
+		prefetch_translations(
+			(text, source_lang, target_lang)
+			for key, val in source_obj.items()
+			if key in TRANSLATABLE_INFO_FIELDS and (key not in target_obj or contains_null(target_obj[key]))
+			for text in iter_translatable_strings(val)
+		)
 		for key, val in source_obj.items():
 			# 已有且不含 null 则跳过；空串合法。null / 缺失则补。
 			if key in target_obj and not contains_null(target_obj[key]):
@@ -1367,7 +1989,7 @@ def find_reference_language(lang_to_path, all_data, languages):
 def run_synchronization_loop(all_data, languages, ref_path):
 	"""
 	将各语言与参考语言对齐；以参考语言为唯一真相源。
-	GitHub Actions 下按语言并发（一语言一线程）；本地串行。
+	按语言并发（一语言一线程），API 调用由 TRANSLATION_SCHEDULER 统一限速。
 	"""
 	if len(all_data) < 2:
 		print("文件少于两个，跳过内容同步。")
@@ -1379,7 +2001,7 @@ def run_synchronization_loop(all_data, languages, ref_path):
 	if all_data[ref_path].get("lang") != ref_lang:
 		all_data[ref_path]["lang"] = ref_lang
 
-	mode = f"并发 ({len(other_paths)} 线程)" if IN_GITHUB_ACTIONS and len(other_paths) > 1 else "串行"
+	mode = f"并发 ({len(other_paths)} 线程，限速 {TRANSLATION_RATE_PER_S:g}/s，在途 ≤ {TRANSLATION_CONCURRENCY})" if len(other_paths) > 1 else "串行"
 	print(f"\n--- 开始同步内容和结构 (locales)，模式: {mode}，参考: {ref_lang} ---")
 
 	for synchronization_iteration in range(1, MAX_SYNC_ITERATIONS + 1):
@@ -1393,7 +2015,10 @@ def run_synchronization_loop(all_data, languages, ref_path):
 			ref_copy = copy.deepcopy(all_data[ref_path])
 			lang_b = languages[other_path]
 			print(f"  ↔ 同步 {ref_lang} → {lang_b}")
-			return normalize_and_sync_dicts(ref_copy, all_data[other_path], ref_lang, lang_b, REFERENCE_LANG_CODES)
+			# 缺失键先登记，结构同步走完后按语言对批量翻译再写入
+			with DeferredKeyTranslations() as batch:
+				changed = normalize_and_sync_dicts(ref_copy, all_data[other_path], ref_lang, lang_b, REFERENCE_LANG_CODES)
+				return batch.flush() or changed
 
 		changes_in_iter = any(run_per_lang(sync_one, other_paths))
 
@@ -1679,6 +2304,222 @@ export type LocaleKeyWithoutParams = Exclude<LocaleKey, LocaleKeyWithParams>
 		print(f"  - Error: Failed to write to {output_path}: {e}")
 
 
+def self_test_translation_scheduler() -> int:
+	"""CLI smoke：令牌桶限速、在途上限、AIMD 降速/恢复与退避暂停、持续失败才中止。"""
+	import io
+	from contextlib import redirect_stdout
+
+	scheduler = TranslationScheduler(50.0, 5, 8, 1.0, 1.0, 0.01, 0.01, 60.0)
+	started = time.monotonic()
+	for _ in range(25):
+		scheduler.call(lambda: None)
+	elapsed = time.monotonic() - started
+	if not 0.3 <= elapsed <= 0.8:
+		print(f"25 calls at 50/s with burst 5 took {elapsed:.2f}s, expected ~0.4s", file=sys.stderr)
+		return 1
+
+	scheduler = TranslationScheduler(1000.0, 1000, 2, 1.0, 1.0, 0.01, 0.01, 60.0)
+	in_flight, peak, lock = [0], [0], threading.Lock()
+
+	def slow_call():
+		with lock:
+			in_flight[0] += 1
+			peak[0] = max(peak[0], in_flight[0])
+		time.sleep(0.05)
+		with lock:
+			in_flight[0] -= 1
+
+	with concurrent.futures.ThreadPoolExecutor(max_workers=6) as pool:
+		for future in [pool.submit(scheduler.call, slow_call) for _ in range(6)]:
+			future.result()
+	if peak[0] != 2:
+		print(f"concurrency 2 allowed {peak[0]} calls in flight", file=sys.stderr)
+		return 1
+
+	def fail():
+		raise OSError("throttled")
+
+	def broken():
+		raise KeyError("not a throttle error")
+
+	scheduler = TranslationScheduler(100.0, 100, 4, 10.0, 5.0, 0.2, 0.2, 60.0)
+	with redirect_stdout(io.StringIO()):
+		for _ in range(3):
+			try:
+				scheduler.call(fail)
+			except OSError:
+				pass
+		paused_at = time.monotonic()
+		scheduler.call(lambda: None)
+		paused_s = time.monotonic() - paused_at
+		try:
+			scheduler.call(broken)
+		except KeyError:
+			pass
+	if scheduler.rate != 100.0 / 8 + 5.0 or scheduler.failures != 3:
+		print(f"AIMD: rate {scheduler.rate} failures {scheduler.failures}, expected 17.5 / 3", file=sys.stderr)
+		return 1
+	if paused_s < 0.09:
+		print(f"backoff: next call waited {paused_s:.3f}s after a failure, expected >= 0.1s", file=sys.stderr)
+		return 1
+
+	scheduler = TranslationScheduler(1000.0, 1000, 4, 1.0, 1.0, 0.001, 0.001, 0.05)
+	with redirect_stdout(io.StringIO()):
+		for outcome in (fail, lambda: None, fail):
+			time.sleep(0.06)
+			try:
+				scheduler.call(outcome)
+			except OSError:
+				pass
+		if scheduler.aborted:
+			print("scheduler gave up although a call succeeded in between", file=sys.stderr)
+			return 1
+		time.sleep(0.06)
+		try:
+			scheduler.call(fail)
+		except OSError:
+			pass
+	try:
+		scheduler.call(lambda: None)
+	except TranslationAborted:
+		return 0
+	print("scheduler kept calling after failing for longer than give_up_after_s", file=sys.stderr)
+	return 1
+
+
+class _ScriptedBatchBackend(TranslationBackend):
+	"""self-test 用：translate_batch 按给定函数改写各段，translate 加前缀，均记录调用。"""
+
+	name = "self-test"
+
+	def __init__(self, rewrite_batch):
+		self.rewrite_batch = rewrite_batch
+		self.single_calls = []
+
+	def translate(self, text, source_code, target_code):
+		self.single_calls.append(text)
+		return f"T:{text}"
+
+	def translate_batch(self, texts, source_code, target_code):
+		return self.rewrite_batch(list(texts))
+
+
+def self_test_translation_batches() -> int:
+	"""CLI smoke：拼批上限；后端须实现两种翻译接口；批量译文校验不过整批丢弃；通过的只在 translate_text 验收后才写入磁盘。"""
+	import io
+	import tempfile
+	from contextlib import redirect_stdout
+	global TRANSLATION_BACKEND, TRANSLATION_CACHE, TRANSLATION_SCHEDULER
+
+	saved = TRANSLATION_BACKEND, TRANSLATION_CACHE, TRANSLATION_SCHEDULER, set(SUPPORTED_LANGUAGE_CODES)
+	texts = ["Hello ${name}", "Delete ${count} items", "Save", "Cancel"]
+	jobs = [(text, "en-UK", "zh-CN") for text in texts]
+	cases = [
+		("valid", lambda batch: [f"B:{text}" for text in batch], True),
+		("placeholder mismatch", lambda batch: [f"B:{text}".replace("${count}", "") for text in batch], False),
+		("empty segment", lambda batch: [f"B:{text}" if text != "Save" else " " for text in batch], False),
+		("shifted", lambda batch: [f"B:{text}" for text in batch[1:]] + ["B:"], False),
+	]
+	try:
+		SUPPORTED_LANGUAGE_CODES.clear()
+		TRANSLATION_SCHEDULER = TranslationScheduler(1000.0, 1000.0, 4, 1.0, 1.0, 0.01, 0.01, 60.0)
+		backend = TRANSLATION_BACKEND = _ScriptedBatchBackend(None)
+		backend.max_batch_chars, backend.max_batch_segments = 30, 3
+		batches = pack_translation_batches(["a" * 10, "b" * 10, "c" * 10, "d", "e", "f", "g", "h" * 40])
+		if [len(batch) for batch in batches] != [2, 3, 2, 1]:
+			print(f"pack_translation_batches ignored limits: {batches!r}", file=sys.stderr)
+			return 1
+		backend.max_batch_chars, backend.max_batch_segments = TRANSLATION_BATCH_MAX_CHARS, TRANSLATION_BATCH_MAX_SEGMENTS
+
+		class SingleOnlyBackend(TranslationBackend):
+			def translate(self, text, source_code, target_code):
+				return text
+		try:
+			SingleOnlyBackend()
+		except TypeError:
+			pass
+		else:
+			print("TranslationBackend without translate_batch should not instantiate", file=sys.stderr)
+			return 1
+
+		with tempfile.TemporaryDirectory() as tmp:
+			for label, rewrite, accepted in cases:
+				path = os.path.join(tmp, f"{label}.sqlite3")
+				backend = TRANSLATION_BACKEND = _ScriptedBatchBackend(rewrite)
+				TRANSLATION_CACHE = TranslationCache(path)
+				with redirect_stdout(io.StringIO()):
+					prefetch_translations(jobs)
+					stored_before = TRANSLATION_CACHE.stores
+					results = [translate_text(text, "en-UK", "zh-CN") for text in texts]
+				TRANSLATION_CACHE.close()
+				expected = [f"{'B' if accepted else 'T'}:{text}" for text in texts]
+				if results != expected or stored_before != 0:
+					print(f"{label}: results={results!r} stored_before_accept={stored_before}", file=sys.stderr)
+					return 1
+				if backend.single_calls != ([] if accepted else texts):
+					print(f"{label}: unexpected per-string calls {backend.single_calls!r}", file=sys.stderr)
+					return 1
+				reopened = TranslationCache(path)
+				persisted = [reopened.get(text, "en-UK", "zh-CN", backend.name) for text in texts]
+				reopened.close()
+				if persisted != expected:
+					print(f"{label}: persisted {persisted!r}, expected {expected!r}", file=sys.stderr)
+					return 1
+	finally:
+		TRANSLATION_BACKEND, TRANSLATION_CACHE, TRANSLATION_SCHEDULER, codes = saved
+		SUPPORTED_LANGUAGE_CODES.clear()
+		SUPPORTED_LANGUAGE_CODES.update(codes)
+	return 0
+
+
+def self_test_translation_abort() -> int:
+	"""CLI smoke：批量翻译途中调度器放弃时，同步循环正常收尾，已有结果照常保存。"""
+	import io
+	import tempfile
+	from contextlib import redirect_stdout
+	global TRANSLATION_BACKEND, TRANSLATION_CACHE, TRANSLATION_SCHEDULER
+
+	def throttled(texts):
+		raise OSError("throttled")
+
+	saved = TRANSLATION_BACKEND, TRANSLATION_CACHE, TRANSLATION_SCHEDULER, set(SUPPORTED_LANGUAGE_CODES)
+	try:
+		SUPPORTED_LANGUAGE_CODES.clear()
+		TRANSLATION_BACKEND = _ScriptedBatchBackend(throttled)
+		TRANSLATION_CACHE = TranslationCache(None)
+		TRANSLATION_SCHEDULER = TranslationScheduler(1000.0, 1000, 4, 1.0, 1.0, 0.001, 0.001, 0.0)
+		with tempfile.TemporaryDirectory() as tmp:
+			ref_path, other_path = os.path.join(tmp, "zh-CN.json"), os.path.join(tmp, "en-UK.json")
+			all_data = OrderedDict([
+				(ref_path, OrderedDict([("lang", "zh-CN"), ("kept", "保留"), ("greet", "你好 ${name}"), ("save", "保存"), ("cancel", "取消")])),
+				(other_path, OrderedDict([("lang", "en-UK"), ("kept", "Kept")])),
+			])
+			languages = {ref_path: "zh-CN", other_path: "en-UK"}
+			try:
+				with redirect_stdout(io.StringIO()):
+					run_synchronization_loop(all_data, languages, ref_path)
+					save_locale_files(all_data, ref_path)
+			except TranslationAborted:
+				print("TranslationAborted escaped the sync loop; locale files were not saved", file=sys.stderr)
+				return 1
+			if not TRANSLATION_SCHEDULER.aborted:
+				print("scheduler should have given up on the failing batch", file=sys.stderr)
+				return 1
+			if not os.path.exists(other_path):
+				print("locale data was not saved after the translation was aborted", file=sys.stderr)
+				return 1
+			with open(other_path, encoding="utf-8") as f:
+				saved_other = json.load(f)
+			if saved_other.get("kept") != "Kept":
+				print(f"existing translation lost after abort: {saved_other!r}", file=sys.stderr)
+				return 1
+	finally:
+		TRANSLATION_BACKEND, TRANSLATION_CACHE, TRANSLATION_SCHEDULER, codes = saved
+		SUPPORTED_LANGUAGE_CODES.clear()
+		SUPPORTED_LANGUAGE_CODES.update(codes)
+	return 0
+
+
 def self_test_normalize_applicator() -> int:
 	"""CLI smoke：string ↔ 单 applicator 对象规范化；string ↔ switch 兼容。"""
 	import io
@@ -1748,13 +2589,153 @@ def self_test_normalize_applicator() -> int:
 	return 0
 
 
+def take_locale_strings(data, limit):
+	"""按原顺序截取 data 中的前 limit 个字符串（保留嵌套结构），返回 (截取结果, 剩余额度)。"""
+	taken = OrderedDict()
+	for key, value in data.items():
+		if limit <= 0:
+			break
+		if isinstance(value, OrderedDict) and not is_switch_value(value):
+			value, limit = take_locale_strings(value, limit)
+			if not value:
+				continue
+		elif key not in ("lang", "name"):
+			limit -= sum(1 for _ in iter_translatable_strings(value))
+		taken[key] = value
+	return taken, limit
+
+
+def count_locale_strings(data) -> int:
+	"""locale 数据中会被同步翻译的字符串数（根上的 lang / name 不翻译，不计）。"""
+	return sum(1 for key, value in data.items() if key not in ("lang", "name") for _ in iter_translatable_strings(value))
+
+
+def start_mock_openai_server(ttft_ms: int, delay_ms: int):
+	"""在空闲端口上启动同目录的 mock_openai_server.py（--reply echo），返回 (进程, /v1 地址)。"""
+	import socket
+
+	with socket.socket() as probe:
+		probe.bind(("127.0.0.1", 0))
+		port = probe.getsockname()[1]
+	process = subprocess.Popen(
+		[
+			sys.executable, os.path.join(MY_DIR, "mock_openai_server.py"),
+			"--port", str(port), "--reply", "echo",
+			"--ttft-ms", str(ttft_ms), "--delay-ms", str(delay_ms), "--chunk-tokens", "16",
+		],
+		stdout=subprocess.DEVNULL,
+		stderr=subprocess.DEVNULL,
+	)
+	base_url = f"http://127.0.0.1:{port}"
+	deadline = time.monotonic() + 10
+	while True:
+		try:
+			if requests.get(f"{base_url}/health", timeout=1).ok:
+				return process, f"{base_url}/v1"
+		except requests.RequestException:
+			pass
+		if process.poll() is not None or time.monotonic() > deadline:
+			process.kill()
+			raise RuntimeError("mock_openai_server.py 启动失败")
+		time.sleep(0.1)
+
+
+def run_translation_benchmark(argv) -> int:
+	"""
+	端到端计时：用 openai 后端把参考语言的前 N 个字符串同步到若干空白目标语言，走完整的结构同步、
+	批量预取、调度和占位符对齐。默认对着本地启动的 mock_openai_server.py（--reply echo 原样回显 JSON 数组），
+	不联网、不写 locale 文件、不用磁盘缓存。每个批量段数上限各跑一遍；段数上限 1 即逐条翻译。
+	"""
+	parser = argparse.ArgumentParser(prog="update-locales.py --bench", description="翻译同步端到端计时（openai 后端）")
+	parser.add_argument("--url", help="已有 OpenAI 兼容服务的 /v1 地址；不给则启动本地 mock")
+	parser.add_argument("--model", default="mock-model", help="请求里的模型名")
+	parser.add_argument("--keys", type=int, default=200, help="取参考语言的前 N 个字符串")
+	parser.add_argument("--langs", type=int, default=3, help="目标语言数（取 locales 目录里参考语言以外的前 N 个）")
+	parser.add_argument("--segments", default=f"1,{OPENAI_TRANSLATION_BATCH_MAX_SEGMENTS}", help="逗号分隔的批量段数上限，每个跑一遍")
+	parser.add_argument("--rate", type=float, default=1000.0, help="令牌桶速率（次/秒）；本地 mock 无配额，默认近乎不限")
+	parser.add_argument("--concurrency", type=int, default=TRANSLATION_CONCURRENCY, help="同时在途请求上限")
+	parser.add_argument("--ttft-ms", type=int, default=200, help="本地 mock 的首字延迟")
+	parser.add_argument("--delay-ms", type=int, default=1, help="本地 mock 的逐 token 延迟")
+	parser.add_argument("--verbose", action="store_true", help="保留同步过程日志")
+	args = parser.parse_args(argv)
+	segment_limits = [int(n) for n in args.segments.split(",") if n.strip()]
+
+	global TRANSLATION_SCHEDULER, TRANSLATION_CACHE, SUPPORTED_LANGUAGE_CODES
+	lang_files = sorted(filename for filename in os.listdir(LOCALE_DIR) if filename.endswith(".json"))
+	lang_codes = [get_lang_from_filename(filename) for filename in lang_files]
+	ref_lang = next((lang for lang in REFERENCE_LANG_CODES if lang in lang_codes), lang_codes[0])
+	ref_path = os.path.join(LOCALE_DIR, f"{ref_lang}.json")
+	with open(ref_path, "r", encoding="utf-8") as f:
+		ref_data, _ = take_locale_strings(loads_locale_json(f.read()), args.keys)
+	targets = [lang for lang in lang_codes if lang != ref_lang][: args.langs]
+	expected = count_locale_strings(ref_data) * len(targets)
+
+	process = None
+	url = args.url
+	if not url:
+		process, url = start_mock_openai_server(args.ttft_ms, args.delay_ms)
+	print(f"翻译基准: {ref_lang} → {', '.join(targets)}，每种语言 {count_locale_strings(ref_data)} 条，接口 {url}")
+	try:
+		for segments in segment_limits:
+			backend = OpenAIBatchBackend(url, args.model)
+			backend.max_batch_segments = max(1, segments)
+			use_translation_backend(backend)
+			TRANSLATION_CACHE = TranslationCache(None)  # 只用内存层：每轮都从零开始翻译
+			SUPPORTED_LANGUAGE_CODES = set()
+			TRANSLATION_SCHEDULER = TranslationScheduler(
+				args.rate,
+				max(1, int(args.rate)),
+				args.concurrency,
+				TRANSLATION_MIN_RATE_PER_S,
+				TRANSLATION_RATE_STEP,
+				TRANSLATION_BACKOFF_BASE_S,
+				TRANSLATION_BACKOFF_MAX_S,
+				TRANSLATION_GIVE_UP_AFTER_S,
+			)
+			all_data = OrderedDict([(ref_path, copy.deepcopy(ref_data))])
+			languages = {ref_path: ref_lang}
+			for lang in targets:
+				path = os.path.join(LOCALE_DIR, f"{lang}.json")
+				all_data[path] = OrderedDict([("lang", lang)])
+				languages[path] = lang
+
+			started = time.perf_counter()
+			with open(os.devnull, "w", encoding="utf-8") as sink, contextlib.redirect_stdout(sys.stdout if args.verbose else sink):
+				run_synchronization_loop(all_data, languages, ref_path)
+				perform_global_placeholder_alignment(all_data, languages, REFERENCE_LANG_CODES)
+			elapsed = time.perf_counter() - started
+			translated = sum(count_locale_strings(all_data[path]) for path in all_data if path != ref_path)
+			print(
+				f"  段数上限 {segments:>3}: {elapsed:7.2f}s，接口调用 {TRANSLATION_SCHEDULER.calls:>5} 次"
+				f"（失败 {TRANSLATION_SCHEDULER.failures}），译出 {translated}/{expected} 条，{translated / elapsed:8.1f} 条/s"
+			)
+	finally:
+		if process is not None:
+			process.terminate()
+			process.wait()
+	return 0
+
+
 # --- 主逻辑 (重构后) ---
-def main():
+def main(argv=None):
 	"""主执行函数"""
+	parser = argparse.ArgumentParser(description="同步 locales 结构并补全缺失翻译")
+	parser.add_argument("--cache", metavar="PATH", default=TRANSLATION_CACHE_PATH, help=f"翻译缓存（SQLite）位置，默认 {TRANSLATION_CACHE_PATH}")
+	parser.add_argument("--no-cache", action="store_true", help="不读写磁盘上的翻译缓存")
+	args = parser.parse_args(argv)
+	global TRANSLATION_CACHE
+	TRANSLATION_CACHE = TranslationCache(None if args.no_cache else args.cache)
+
 	type_mismatch_errors.clear()
 
 	ensure_allowed_to_run()
-	load_supported_google_codes()
+	try:
+		use_translation_backend(create_translation_backend(TRANSLATION_BACKEND_NAME))
+	except ValueError as e:
+		print(f"错误: {e}")
+		sys.exit(1)
+	reuse_translator_connections()
+	load_supported_language_codes()
 	gitignore_spec = load_gitignore_spec(FOUNT_DIR)
 
 	all_data, languages, lang_to_path = load_locale_files()
@@ -1787,7 +2768,13 @@ def main():
 
 	generate_list_csv(all_data)
 
-	print("\n脚本执行完毕。" + ("（翻译中途熔断）" if is_translation_aborted() else ""))
+	if TRANSLATION_CACHE.hits or TRANSLATION_CACHE.stores:
+		print(f"\n翻译缓存: 命中 {TRANSLATION_CACHE.hits} 条，新存入 {TRANSLATION_CACHE.stores} 条 ({TRANSLATION_CACHE.path or '仅内存'})")
+	TRANSLATION_CACHE.close()
+
+	if TRANSLATION_SCHEDULER.calls:
+		print(f"\n翻译接口 ({TRANSLATION_BACKEND.name}): 调用 {TRANSLATION_SCHEDULER.calls} 次，限流/网络失败 {TRANSLATION_SCHEDULER.failures} 次，结束时速率 {TRANSLATION_SCHEDULER.rate:.2f}/s")
+	print("\n脚本执行完毕。" + ("（翻译中途放弃）" if is_translation_aborted() else ""))
 
 	if type_mismatch_errors:
 		unique = list(dict.fromkeys(type_mismatch_errors))
@@ -1801,5 +2788,7 @@ def main():
 
 if __name__ == "__main__":
 	if len(sys.argv) > 1 and sys.argv[1] == "--self-test":
-		sys.exit(self_test_normalize_applicator())
+		sys.exit(self_test_translation_scheduler() or self_test_translation_batches() or self_test_translation_abort() or self_test_normalize_applicator())
+	if len(sys.argv) > 1 and sys.argv[1] == "--bench":
+		sys.exit(run_translation_benchmark(sys.argv[2:]))
 	main()